@@ -4,31 +4,81 @@ from django_extensions.admin import ForeignKeyAutocompleteAdmin
 from django.utils.html import format_html
 from django.utils.translation import gettext_lazy as _
 from django.contrib import messages
+from django.http import JsonResponse
+from django.urls import path
+from django.conf import settings
 
 
-from .models import Season, Animal, Share
-from .tasks import make_animal_video
+from .enums import AnimalStatus, RenderQueue
+from .progress import RenderProgress
+from .models import Season, Animal, Share, RenderJob
+from .tasks import make_animal_video, send_forced_renders
 
 
 @admin.register(Season)
 class SeasonAdmin(admin.ModelAdmin):
-    list_display = ('year', 'name', 'auto_process')
+    list_display = ('year', 'name', 'auto_process', 'render_engine')
     search_fields = ('year', 'name')
 
 
+class RenderJobInline(admin.TabularInline):
+    model = RenderJob
+    fields = ('started_at', 'status', 'attempt', 'engine', 'worker', 'duration_seconds', 'encode_seconds', 'error')
+    readonly_fields = fields
+    extra = 0
+    max_num = 0
+    can_delete = False
+    ordering = ('-started_at',)
+
+
 @admin.register(Animal)
 class AnimalAdmin(ForeignKeyAutocompleteAdmin):
-    list_display = ('name', 'status', 'season', 'has_cover_image', 'share_count', 'download_processed_video')
+    list_display = ('name', 'status', 'render_progress', 'season', 'has_cover_image', 'share_count',
+                    'video_summary', 'download_processed_video')
     list_filter = ('status', 'created_at')
-    readonly_fields = ('processed_video_player', 'updated_at', 'created_at')
+    readonly_fields = ('render_progress', 'processed_video_player', 'render_key', 'render_plan', 'media_metadata',
+                       'lease_owner', 'lease_started_at', 'lease_heartbeat_at', 'attempts', 'retry_after',
+                       'media_changed_at', 'updated_at', 'created_at')
     search_fields = ('code', 'season__year')
     autocomplete_fields = ('season',)
-    actions = ['process_video']
+    actions = ['process_video', 'profile_video']
+    inlines = [RenderJobInline]
 
     @admin.display(description='name')
     def name(self, obj):
         return f'{obj.season.year}/{obj.code}'
 
+    progress_stages = {'preparing': 'Hazırlanıyor', 'encoding': 'Kodlanıyor', 'publishing': 'Yayınlanıyor'}
+
+    def get_urls(self):
+        urls = [
+            path('progress/', self.admin_site.admin_view(self.progress_view), name='core_animal_progress'),
+        ]
+        return urls + super().get_urls()
+
+    def progress_view(self, request):
+        """Progress of the given animals (?ids=1,2) or of every animal being processed, for polling."""
+        ids = [int(animal_id) for animal_id in request.GET.get('ids', '').split(',') if animal_id.isdigit()]
+        if not ids:
+            ids = list(Animal.objects.filter(status=AnimalStatus.PROCESSING).values_list('id', flat=True))
+        return JsonResponse({str(animal_id): data for animal_id, data in RenderProgress.get_many(ids).items()})
+
+    @admin.display(description='İlerleme')
+    def render_progress(self, obj):
+        if obj.status != AnimalStatus.PROCESSING:
+            return '-'
+        progress = RenderProgress.get(obj.id)
+        if progress is None:
+            return 'Bekleniyor'
+        parts = [self.progress_stages.get(progress['stage'], progress['stage'])]
+        if progress['percent'] is not None:
+            parts.append(f'%{progress["percent"]:.0f}')
+        if progress['fps']:
+            parts.append(f'{progress["fps"]:.1f} fps')
+        if progress['eta'] is not None:
+            parts.append(f'kalan {progress["eta"] // 60}:{progress["eta"] % 60:02d}')
+        return ' · '.join(parts)
+
     @admin.display(description='Kapak Görseli Mevcut', boolean=True)
     def has_cover_image(self, obj):
         return bool(obj.cover)
@@ -39,6 +89,12 @@ class AnimalAdmin(ForeignKeyAutocompleteAdmin):
         color = 'red' if share_count != 7 else 'green'
         return format_html('<strong style="color:{};">{}</strong>', color, share_count)
 
+    @admin.display(description='Video', ordering='video_duration')
+    def video_summary(self, obj):
+        if obj.video_duration is None:
+            return '-'
+        return f'{obj.video_width}x{obj.video_height} {obj.video_fps or 0:.0f}fps {obj.video_duration:.0f}sn'
+
     @admin.display(description='İşlenmiş Videoyu İndir')
     def download_processed_video(self, obj):
         if obj.processed_video:
@@ -67,10 +123,38 @@ class AnimalAdmin(ForeignKeyAutocompleteAdmin):
         if not ids:
             self.message_user(request, _("Seçili hayvan içerisinde işlenmeye uygun olan bulunamadı."), messages.ERROR)
             return
-        for animal_id in ids:
-            make_animal_video.delay(animal_id, force=True)
+        send_forced_renders(ids)
         self.message_user(request, _(f'{len(ids)} kurban videosu başarıyla işleme kuyruğuna alındı.'), messages.SUCCESS)
 
+    @admin.action(description='Seçili videoları profilleyerek işle')
+    def profile_video(self, request, queryset):
+        ids = list(queryset.values_list('id', flat=True).order_by('id'))
+        if not ids:
+            self.message_user(request, _("Seçili hayvan içerisinde işlenmeye uygun olan bulunamadı."), messages.ERROR)
+            return
+        for animal_id in ids:
+            make_animal_video.apply_async(
+                (animal_id,), {'force': True, 'profiler': settings.VIDEO_PROFILER}, queue=RenderQueue.URGENT)
+        self.message_user(request, _(f'{len(ids)} kurban videosu profillenmek üzere işleme kuyruğuna alındı. '
+                                     f'Sonuçlar {settings.VIDEO_TRACE_ROOT} dizinine yazılır.'), messages.SUCCESS)
+
+
+@admin.register(RenderJob)
+class RenderJobAdmin(admin.ModelAdmin):
+    list_display = ('animal', 'season', 'status', 'attempt', 'engine', 'queue', 'started_at', 'wait_seconds',
+                    'duration_seconds', 'probe_seconds', 'load_seconds', 'composite_seconds', 'encode_seconds',
+                    'publish_seconds')
+    list_filter = ('status', 'engine', 'queue', 'error_type', 'season')
+    search_fields = ('animal__code', 'worker')
+    date_hierarchy = 'started_at'
+    list_select_related = ('animal__season', 'season')
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
 
 @admin.register(Share)
 class ShareAdmin(admin.ModelAdmin):
@@ -0,0 +1,52 @@
+import logging
+
+from .clips import ClipScope
+from .compositor import OverlayCompositor
+from .overlays import OverlayService
+from .resize import ResizeService
+
+logger = logging.getLogger(__name__)
+
+
+class SeasonRenderContext:
+    """
+    Season assets shared by every animal rendered in one batch.
+    Intro/outro readers, overlay paths and decoded overlay compositors are created on first use and kept
+    until the batch is closed, so only the animal's own clip and cover are opened per render.
+    """
+    def __init__(self, season):
+        self.season = season
+        self.scope = ClipScope()
+        self.clips = {}
+        self.overlays = {}
+        self.compositors = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def clip(self, path, size):
+        """Intro/outro clip fitted to the canvas, shared by every render of the batch."""
+        key = (path, tuple(size))
+        if key not in self.clips:
+            logger.info(f'season_render_context - loading {path} at {size[0]}x{size[1]}')
+            self.clips[key] = ResizeService.fit_clip(self.scope.video(path), size)
+        return self.clips[key]
+
+    def get_overlay(self, size, *args):
+        key = (tuple(size), *args)
+        if key not in self.overlays:
+            self.overlays[key] = OverlayService.get_overlay(size, *args)
+        return self.overlays[key]
+
+    def compositor(self, overlay_path):
+        if overlay_path not in self.compositors:
+            self.compositors[overlay_path] = OverlayCompositor(*OverlayService.load_premultiplied(overlay_path))
+        return self.compositors[overlay_path]
+
+    def close(self):
+        self.scope.close()
+        self.clips.clear()
+        self.compositors.clear()
@@ -0,0 +1,135 @@
+import os
+import sys
+import pickle
+import logging
+import tempfile
+import contextlib
+import subprocess
+
+from django.conf import settings
+
+from .utils import create_temp_video_path, cpu_quota
+from .ffmpeg import FFmpegService
+
+logger = logging.getLogger(__name__)
+
+
+class ChunkEncodingError(Exception):
+    pass
+
+
+class ChunkedEncodingService:
+    """
+    Splits a render into frame ranges that are encoded by separate processes and joined with stream copy.
+    Range boundaries fall on the GOP of the encoder profile, so every chunk starts on the keyframe the serial
+    encode would have placed there and the joined video keeps the same frame count and keyframe layout.
+    Chunks run in encode_chunk command processes and not in a multiprocessing pool, the prefork children of a
+    Celery worker are daemonic and may not start one.
+    """
+    @staticmethod
+    def workers() -> int:
+        workers = settings.VIDEO_PARALLEL_WORKERS or cpu_quota()
+        return max(1, workers)
+
+    @staticmethod
+    def split(total_frames, workers, gop=None) -> list[tuple[int, int]]:
+        """(start_frame, frame_count) ranges covering total_frames, at most one per worker."""
+        gop = gop or settings.VIDEO_ENCODER_PROFILE['gop']
+        gops = -(-total_frames // gop)
+        count = max(1, min(workers, gops))
+        ranges = []
+        for index in range(count):
+            start = gops * index // count * gop
+            end = min(total_frames, gops * (index + 1) // count * gop)
+            if end > start:
+                ranges.append((start, end - start))
+        return ranges
+
+    @staticmethod
+    def settings_overrides() -> dict:
+        # Worker sizing and override_settings change these at runtime, the command would only see the module
+        return {
+            name: getattr(settings, name) for name in dir(settings)
+            if name.startswith('VIDEO_') or name in ('FFMPEG_BINARY', 'FFPROBE_BINARY')
+        }
+
+    @staticmethod
+    def write_payload(render_chunk, args) -> str:
+        payload_path = create_temp_video_path('.pickle')
+        with open(payload_path, 'wb') as f:
+            pickle.dump((ChunkedEncodingService.settings_overrides(), render_chunk, args), f)
+        return payload_path
+
+    @staticmethod
+    def start(payload_path, stderr) -> subprocess.Popen:
+        # The settings module comes from DJANGO_SETTINGS_MODULE, the project from the working directory
+        return subprocess.Popen([sys.executable, '-m', 'django', 'encode_chunk', payload_path],
+                                cwd=settings.BASE_DIR, stdout=subprocess.DEVNULL, stderr=stderr)
+
+    @staticmethod
+    def wait(process, stderr):
+        returncode = process.wait()
+        if returncode != 0:
+            stderr.seek(0)
+            error = stderr.read().strip()
+            raise ChunkEncodingError(error[-2000:] or f'encode_chunk exited with code {returncode}')
+
+    @staticmethod
+    def run(payload_path):
+        """Runs in the encode_chunk process, with the settings of the render that started it."""
+        with open(payload_path, 'rb') as f:
+            overrides, render_chunk, args = pickle.load(f)
+        for name, value in overrides.items():
+            setattr(settings, name, value)
+        render_chunk(*args)
+
+    @staticmethod
+    def encode(render_chunk, args, ranges, workers) -> list[str]:
+        """Runs render_chunk(*args, start_frame, frame_count, output_path, threads) for every range in its process."""
+        threads = max(1, settings.VIDEO_ENCODER_PROFILE['threads'] // workers)
+        chunk_paths = [create_temp_video_path() for _ in ranges]
+        payload_paths, processes = [], []
+        try:
+            with contextlib.ExitStack() as stack:
+                for (start, count), path in zip(ranges, chunk_paths):
+                    payload_paths.append(ChunkedEncodingService.write_payload(
+                        render_chunk, (*args, start, count, path, threads)))
+                    # Warnings and the traceback of a failing chunk, a file never blocks the process like a pipe
+                    stderr = stack.enter_context(tempfile.TemporaryFile(mode='w+'))
+                    processes.append((ChunkedEncodingService.start(payload_paths[-1], stderr), stderr))
+                for process, stderr in processes:
+                    ChunkedEncodingService.wait(process, stderr)
+        except BaseException:
+            # A failed chunk or the soft time limit of the task stops the chunks that are still encoding
+            for process, _ in processes:
+                if process.poll() is None:
+                    process.kill()
+                    process.wait()
+            ChunkedEncodingService.cleanup(chunk_paths)
+            raise
+        finally:
+            ChunkedEncodingService.cleanup(payload_paths)
+        return chunk_paths
+
+    @staticmethod
+    def join(chunk_paths, output_path, audio_path=None):
+        """Concatenates the chunks with stream copy and muxes the audio that was encoded once for the whole render."""
+        if audio_path is None:
+            FFmpegService.concat(chunk_paths, output_path)
+            return
+
+        video_path = create_temp_video_path()
+        try:
+            FFmpegService.concat(chunk_paths, video_path)
+            FFmpegService.run([
+                '-i', video_path, '-i', audio_path, '-map', '0:v', '-map', '1:a',
+                '-c', 'copy', '-movflags', '+faststart', str(output_path)
+            ])
+        finally:
+            os.remove(video_path)
+
+    @staticmethod
+    def cleanup(paths):
+        for path in paths:
+            if path and os.path.exists(path):
+                os.remove(path)
@@ -0,0 +1,42 @@
+import gc
+import os
+import logging
+
+from moviepy.editor import VideoFileClip
+
+from .tracing import RenderTrace
+
+logger = logging.getLogger(__name__)
+
+
+class ClipScope:
+    """
+    Owns every MoviePy reader opened for a render.
+    Each VideoFileClip holds an ffmpeg subprocess for its frames and one for its audio, derived clips share them.
+    The scope closes the originals on success, failure and soft time limit alike, so a long-lived worker never
+    keeps readers of old renders alive.
+    """
+    def __init__(self):
+        self.clips = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def video(self, path, **kwargs) -> VideoFileClip:
+        with RenderTrace.span('open', path=os.path.basename(path)):
+            clip = VideoFileClip(path, **kwargs)
+        self.clips.append(clip)
+        return clip
+
+    def close(self):
+        while self.clips:
+            clip = self.clips.pop()
+            try:
+                clip.close()
+            except Exception as e:
+                logger.warning(f'clip_scope - {clip.filename} could not be closed: {e}')
+        # Writers MoviePy abandons when a write fails mid-way only close their ffmpeg process in __del__
+        gc.collect()
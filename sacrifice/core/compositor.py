@@ -0,0 +1,38 @@
+import numpy as np
+
+
+class OverlayCompositor:
+    """
+    Blends a premultiplied overlay onto video frames.
+    The alpha mask is converted to 8 bit fixed point once and only the overlay's visible bounding box is blended.
+    The returned frame is a reused buffer, it is only valid until the next call.
+    """
+    def __init__(self, premultiplied_rgb, alpha):
+        self.size = (alpha.shape[1], alpha.shape[0])
+        visible = alpha[:, :, 0] > 0
+        rows, cols = np.flatnonzero(visible.any(axis=1)), np.flatnonzero(visible.any(axis=0))
+        if rows.size == 0:
+            self.box = None
+            return
+
+        y0, y1, x0, x1 = rows[0], rows[-1] + 1, cols[0], cols[-1] + 1
+        self.box = (slice(y0, y1), slice(x0, x1))
+        # out = (frame * (256 - a) + premultiplied * 256 + 128) >> 8, which never leaves uint16
+        fixed_alpha = np.rint(alpha[self.box] * 256).astype(np.uint16)
+        self.inverse_alpha = 256 - fixed_alpha
+        self.premultiplied = (np.rint(premultiplied_rgb[self.box] * 256) + 128).astype(np.uint16)
+        self.work = np.empty(self.premultiplied.shape, dtype=np.uint16)
+        self.output = np.empty((alpha.shape[0], alpha.shape[1], 3), dtype=np.uint8)
+
+    def __call__(self, frame):
+        if self.box is None:
+            return frame
+        if frame.shape != self.output.shape:
+            raise ValueError(f'Frame shape {frame.shape} does not match the overlay shape {self.output.shape}')
+
+        np.copyto(self.output, frame)
+        np.multiply(frame[self.box], self.inverse_alpha, out=self.work)
+        np.add(self.work, self.premultiplied, out=self.work)
+        np.right_shift(self.work, 8, out=self.work)
+        self.output[self.box] = self.work
+        return self.output
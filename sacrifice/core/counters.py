@@ -0,0 +1,99 @@
+import logging
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .enums import RenderJobStatus
+
+logger = logging.getLogger(__name__)
+
+
+class RenderCounters:
+    """
+    Totals of finished renders for the /metrics counters and histograms, kept in the cache.
+    RenderJob rows are deleted with their animal, totals aggregated from them could go down between two scrapes.
+    These only grow until the cache is flushed, which Prometheus handles as a counter reset. Durations are counted
+    in the bucket they fall in and made cumulative when read.
+    """
+    prefix = 'render_metrics'
+
+    @staticmethod
+    def key(name) -> str:
+        return f'{RenderCounters.prefix}:{name}'
+
+    @staticmethod
+    def incr(name, value=1):
+        key = RenderCounters.key(name)
+        cache.add(key, 0, timeout=None)
+        cache.incr(key, value)
+
+    @staticmethod
+    def get_many(names) -> dict:
+        values = cache.get_many([RenderCounters.key(name) for name in names])
+        return {name: values.get(RenderCounters.key(name), 0) for name in names}
+
+    @staticmethod
+    def bucket(seconds) -> str:
+        return str(next((bound for bound in settings.VIDEO_METRICS_BUCKETS if seconds <= bound), 'inf'))
+
+    @staticmethod
+    def record(job, stages):
+        """
+        Counts a job that RenderJobRecorder.finish() just saved, with the durations of the given stages.
+        Metrics are informational, a cache outage must not fail the render.
+        """
+        try:
+            RenderCounters.incr(f'jobs:{job.status}')
+            if job.status == RenderJobStatus.FAILED:
+                error_type = job.error_type or 'unknown'
+                if cache.add(RenderCounters.key(f'failures:{error_type}'), 0, timeout=None):
+                    error_types = cache.get(RenderCounters.key('error_types')) or []
+                    cache.set(RenderCounters.key('error_types'), sorted({*error_types, error_type}), timeout=None)
+                RenderCounters.incr(f'failures:{error_type}')
+            if job.status == RenderJobStatus.SUCCEEDED and job.frames:
+                RenderCounters.incr('frames', job.frames)
+            RenderCounters.incr('input_bytes', job.input_bytes or 0)
+            RenderCounters.incr('output_bytes', job.output_bytes or 0)
+            for stage in ('total', *stages):
+                seconds = job.duration_seconds if stage == 'total' else getattr(job, f'{stage}_seconds')
+                if seconds is None:
+                    continue
+                RenderCounters.incr(f'stage:{stage}:bucket:{RenderCounters.bucket(seconds)}')
+                RenderCounters.incr(f'stage:{stage}:sum_ms', round(seconds * 1000))
+        except Exception as e:
+            logger.warning(f'render_counters - job {job.pk} is not counted: {e}')
+
+    @staticmethod
+    def record_abandoned(count, input_bytes):
+        try:
+            RenderCounters.incr(f'jobs:{RenderJobStatus.ABANDONED}', count)
+            RenderCounters.incr('input_bytes', input_bytes or 0)
+        except Exception as e:
+            logger.warning(f'render_counters - {count} abandoned jobs are not counted: {e}')
+
+    @staticmethod
+    def jobs() -> dict:
+        counts = RenderCounters.get_many([f'jobs:{status}' for status in RenderJobStatus])
+        return {status: counts[f'jobs:{status}'] for status in RenderJobStatus}
+
+    @staticmethod
+    def failures() -> dict:
+        error_types = cache.get(RenderCounters.key('error_types')) or []
+        counts = RenderCounters.get_many([f'failures:{error_type}' for error_type in error_types])
+        return {error_type: counts[f'failures:{error_type}'] for error_type in error_types}
+
+    @staticmethod
+    def totals() -> dict:
+        return RenderCounters.get_many(['frames', 'input_bytes', 'output_bytes'])
+
+    @staticmethod
+    def histogram(stage) -> tuple[list[tuple[float, int]], int, float]:
+        """Cumulative bucket counts by upper bound, the observation count and the sum in seconds."""
+        bounds = [*settings.VIDEO_METRICS_BUCKETS, 'inf']
+        names = [*(f'stage:{stage}:bucket:{bound}' for bound in bounds), f'stage:{stage}:sum_ms']
+        counts = RenderCounters.get_many(names)
+        buckets, total = [], 0
+        for bound in bounds:
+            total += counts[f'stage:{stage}:bucket:{bound}']
+            buckets.append((float(bound), total))
+        return buckets, total, counts[f'stage:{stage}:sum_ms'] / 1000
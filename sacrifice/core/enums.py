@@ -26,3 +26,26 @@ class AnimalStatus(models.IntegerChoices):
     PROCESSING = 2, _("İşleniyor")
     PROCESSED = 3, _("İşlenmiş")
     ERROR = 4, _("Hata")
+
+
+class RenderJobStatus(models.IntegerChoices):
+    RUNNING = 1, _("Çalışıyor")
+    SUCCEEDED = 2, _("Başarılı")
+    FAILED = 3, _("Hata")
+    SKIPPED = 4, _("Atlandı")
+    DEFERRED = 5, _("Ertelendi")
+    ABANDONED = 6, _("Yarım Kaldı")
+    # The media changed while rendering, the animal was queued again with the new media
+    SUPERSEDED = 7, _("Yenisi Kuyrukta")
+
+
+class RenderQueue(models.TextChoices):
+    # Highest priority first, workers consume the queues in this order
+    URGENT = 'render-urgent', _("Acil")
+    UPLOADS = 'render-uploads', _("Yeni Yüklemeler")
+    BULK = 'render-bulk', _("Toplu İşleme")
+
+
+class RenderEngine(models.TextChoices):
+    MOVIEPY = 'moviepy', _("MoviePy")
+    FFMPEG = 'ffmpeg', _("FFmpeg")
@@ -0,0 +1,291 @@
+import os
+import json
+import hashlib
+import logging
+import tempfile
+import subprocess
+from pathlib import Path
+
+from django.conf import settings
+from django.core.files import File
+
+from .utils import create_temp_video_path, file_digest
+from .overlays import OverlayService
+from .planner import RenderPlanner
+from .publish import PublishService
+from .progress import RenderProgress, FrameReporter
+from .jobs import RenderJobRecorder
+
+logger = logging.getLogger(__name__)
+
+
+class FFmpegError(Exception):
+    pass
+
+
+class FFmpegService:
+    @staticmethod
+    def execute(command, reporter=None) -> subprocess.CompletedProcess:
+        logger.info(f'ffmpeg - command: {" ".join(command)}')
+        if reporter is None:
+            result = subprocess.run(command, capture_output=True, text=True)
+        else:
+            result = FFmpegService.execute_with_progress(command, reporter)
+        if result.returncode != 0:
+            raise FFmpegError(result.stderr.strip() or f'{command[0]} exited with code {result.returncode}')
+        return result
+
+    @staticmethod
+    def execute_with_progress(command, reporter) -> subprocess.CompletedProcess:
+        """Feeds the frame counter of ffmpeg's -progress output on stdout to the reporter."""
+        # stderr goes to a file, a pipe nobody reads while stdout is consumed could block ffmpeg
+        with tempfile.TemporaryFile(mode='w+') as stderr:
+            with subprocess.Popen(command, stdout=subprocess.PIPE, stderr=stderr, text=True) as process:
+                frames = 0
+                for line in process.stdout:
+                    key, _, value = line.strip().partition('=')
+                    if key == 'frame' and value.isdigit():
+                        reporter.add(int(value) - frames)
+                        frames = int(value)
+            reporter.flush()
+            stderr.seek(0)
+            return subprocess.CompletedProcess(command, process.returncode, '', stderr.read())
+
+    @staticmethod
+    def run(args, reporter=None) -> subprocess.CompletedProcess:
+        progress_args = ['-progress', 'pipe:1', '-nostats'] if reporter else []
+        return FFmpegService.execute(
+            [settings.FFMPEG_BINARY, '-hide_banner', '-loglevel', 'error', *progress_args, '-y', *args], reporter)
+
+    @staticmethod
+    def gop_args() -> list[str]:
+        # Fixed GOP so that segments encoded separately can be joined with stream copy
+        gop = str(settings.VIDEO_ENCODER_PROFILE['gop'])
+        return ['-g', gop, '-keyint_min', gop, '-sc_threshold', '0']
+
+    @staticmethod
+    def encoder_args() -> list[str]:
+        profile = settings.VIDEO_ENCODER_PROFILE
+        args = [
+            '-c:v', profile['video_codec'], '-preset', profile['preset'], '-crf', str(profile['crf']),
+            '-r', str(profile['fps']), '-pix_fmt', profile['pix_fmt'], *FFmpegService.gop_args(),
+            '-c:a', profile['audio_codec'], '-ar', str(profile['audio_sample_rate']),
+            '-ac', str(profile['audio_channels']), '-threads', str(profile['threads']),
+            '-movflags', '+faststart',
+        ]
+        return args
+
+    @staticmethod
+    def concat(paths, output_path):
+        """Joins segments encoded with the same profile through the concat demuxer without re-encoding."""
+        list_path = create_temp_video_path('.txt')
+        try:
+            with open(list_path, 'w') as f:
+                for path in paths:
+                    escaped_path = str(path).replace("'", "'\\''")
+                    f.write(f"file '{escaped_path}'\n")
+            FFmpegService.run([
+                '-f', 'concat', '-safe', '0', '-i', list_path,
+                '-c', 'copy', '-movflags', '+faststart', str(output_path)
+            ])
+        finally:
+            os.remove(list_path)
+
+
+class SegmentCacheService:
+    """
+    Keeps the season intro/outro encoded once with the current encoder profile.
+    Entries are keyed by the asset content, target size and encoder profile, so a new upload or a profile
+    change never hits a stale entry. Both engines render only the body, the cover and the animal clip, and join
+    it with the cached segments.
+    """
+    body_roles = ('cover', 'video')
+
+    @staticmethod
+    def cache_dir() -> Path:
+        return Path(settings.VIDEO_CACHE_ROOT) / 'segments'
+
+    @staticmethod
+    def profile_digest() -> str:
+        # Thread count is sized per worker and only changes scheduling, not the encoded stream settings
+        profile = {key: value for key, value in settings.VIDEO_ENCODER_PROFILE.items() if key != 'threads'}
+        profile = json.dumps(profile, sort_keys=True)
+        return hashlib.sha256(profile.encode()).hexdigest()[:16]
+
+    @staticmethod
+    def get_normalized_segment(plan, role) -> str:
+        item = plan.input(role)
+        source_digest = file_digest(item.path)[:32]
+        cache_dir = SegmentCacheService.cache_dir()
+        # Segments of an older engine version may have other frame counts
+        entry_prefix = f'{source_digest}-{SegmentCacheService.profile_digest()}-v{FFmpegConcatenationService.version}-'
+        segment_path = cache_dir / f'{entry_prefix}{plan.width}x{plan.height}.mp4'
+        if segment_path.exists():
+            logger.info(f'segment_cache - hit: {item.path} -> {segment_path}')
+            return str(segment_path)
+
+        logger.info(f'segment_cache - miss: {item.path} -> {segment_path}')
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        # Entries of the same asset encoded with an older profile are never read again
+        for stale_path in cache_dir.glob(f'{source_digest}-*.mp4'):
+            if not stale_path.name.startswith(entry_prefix):
+                stale_path.unlink(missing_ok=True)
+
+        # Encode next to the entry and rename, so concurrent workers never read a half written segment
+        partial_path = create_temp_video_path(directory=cache_dir)
+        try:
+            FFmpegService.run(FFmpegConcatenationService.build_command(partial_path, plan, roles=(role,)))
+            os.replace(partial_path, segment_path)
+        finally:
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
+        return str(segment_path)
+
+    @staticmethod
+    def enabled(plan) -> bool:
+        return settings.VIDEO_SEGMENT_CACHE and bool(plan.input('intro') or plan.input('outro'))
+
+    @staticmethod
+    def join(plan, body_path, output_path):
+        """Stream copies the cached intro and outro around a body encoded with the same profile and canvas."""
+        segments = [body_path]
+        if plan.input('intro'):
+            segments.insert(0, SegmentCacheService.get_normalized_segment(plan, 'intro'))
+        if plan.input('outro'):
+            segments.append(SegmentCacheService.get_normalized_segment(plan, 'outro'))
+        FFmpegService.concat(segments, output_path)
+
+    @staticmethod
+    def invalidate(path):
+        if not path or not os.path.exists(path):
+            return
+        source_digest = file_digest(path)[:32]
+        for segment_path in SegmentCacheService.cache_dir().glob(f'{source_digest}-*.mp4'):
+            logger.info(f'segment_cache - invalidated: {segment_path}')
+            segment_path.unlink(missing_ok=True)
+
+
+class FFmpegConcatenationService:
+    """
+    Renders the sacrifice video with a single ffmpeg process.
+    Runs the same RenderPlan as VideoConcatenationService but builds one filter_complex graph
+    instead of compositing every frame in Python.
+    """
+    # Bump when a change alters the rendered output, it is part of the render key
+    version = 2
+
+    @staticmethod
+    def fit_filter(item, size) -> str:
+        width, height = size
+        if item.action == 'none':
+            return ''
+        if item.action == 'scale':
+            return f'scale={width}:{height},'
+        return (f'scale={width}:{height}:force_original_aspect_ratio=decrease,'
+                f'pad={width}:{height}:(ow-iw)/2:(oh-ih)/2,')
+
+    @staticmethod
+    def build_command(output_path, plan, roles=RenderPlanner.segment_roles, overlay_path=None) -> list[str]:
+        profile = settings.VIDEO_ENCODER_PROFILE
+        fps, sample_rate = plan.fps, plan.sample_rate
+
+        inputs, filters, segments = [], [], []
+
+        def add_input(*args):
+            inputs.extend(args)
+            return inputs.count('-i') - 1
+
+        def add_segment(item, stream, audio_stream=None):
+            label = f's{len(segments)}'
+            # fps rounds every segment down on its own, the last frame is cloned up to the planned frame count
+            frames = item.frames(fps)
+            filters.append(f'{stream}{FFmpegConcatenationService.fit_filter(item, plan.size)}setsar=1,fps={fps},'
+                           f'tpad=stop=-1:stop_mode=clone,trim=end_frame={frames},'
+                           f'format={profile["pix_fmt"]},setpts=PTS-STARTPTS[{label}v]')
+            duration = f'{frames / fps:.6f}'
+            if audio_stream:
+                filters.append(f'{audio_stream}aresample={sample_rate},aformat=channel_layouts=stereo,apad,'
+                               f'atrim=duration={duration},asetpts=PTS-STARTPTS[{label}a]')
+            else:
+                filters.append(f'anullsrc=r={sample_rate}:cl=stereo,atrim=duration={duration}[{label}a]')
+            segments.append(label)
+
+        for role in roles:
+            item = plan.input(role)
+            if item is None:
+                continue
+
+            if role == 'cover':
+                index = add_input('-loop', '1', '-framerate', str(fps), '-t', str(item.duration), '-i', item.path)
+                add_segment(item, f'[{index}:v]')
+                continue
+
+            index = add_input('-i', item.path)
+            stream, audio_stream = f'[{index}:v]', f'[{index}:a]' if item.has_audio else None
+            if role == 'video' and overlay_path:
+                overlay_index = add_input('-i', overlay_path)
+                filters.append(f'{stream}[{overlay_index}:v]overlay=0:0[overlaid]')
+                stream = '[overlaid]'
+            add_segment(item, stream, audio_stream)
+
+        concat_inputs = ''.join(f'[{label}v][{label}a]' for label in segments)
+        filters.append(f'{concat_inputs}concat=n={len(segments)}:v=1:a=1[outv][outa]')
+
+        return [
+            *inputs,
+            '-filter_complex', ';'.join(filters),
+            '-map', '[outv]', '-map', '[outa]',
+            *FFmpegService.encoder_args(),
+            str(output_path),
+        ]
+
+    @staticmethod
+    def start_progress(plan, roles=RenderPlanner.segment_roles) -> FrameReporter | None:
+        """Sets the encoding stage of the running render with the frames ffmpeg encodes for the given roles."""
+        progress = RenderProgress.current()
+        if progress is None:
+            return None
+        progress.stage('encoding', sum(item.frames(plan.fps) for item in map(plan.input, roles) if item))
+        return progress.reporter()
+
+    @staticmethod
+    def render_with_cached_segments(output_path, plan, overlay_path=None):
+        """Encodes only the cover and the animal clip, intro and outro are stream copied from the segment cache."""
+        body_path = create_temp_video_path()
+        try:
+            roles = SegmentCacheService.body_roles
+            reporter = FFmpegConcatenationService.start_progress(plan, roles=roles)
+            FFmpegService.run(FFmpegConcatenationService.build_command(
+                body_path, plan, roles=roles, overlay_path=overlay_path), reporter)
+            SegmentCacheService.join(plan, body_path, output_path)
+        finally:
+            os.remove(body_path)
+
+    @staticmethod
+    def concatenate_sacrifice_clips(video_path, cover_path, intro_path, outro_path, frame_path, logo_path, logo_height,
+                                    logo_position, logo_margin_top, logo_margin_right, logo_margin_bottom,
+                                    logo_margin_left, plan=None, workers=None, context=None):
+        plan = plan or RenderPlanner.plan(video_path, cover_path, intro_path, outro_path, frame_path, logo_path)
+        # Intro/outro are already shared through the segment cache, a batch context only memoizes the overlay
+        get_overlay = context.get_overlay if context else OverlayService.get_overlay
+        overlay_path = get_overlay(
+            plan.input('video').size, frame_path, logo_path, logo_height, logo_position,
+            logo_margin_top, logo_margin_right, logo_margin_bottom, logo_margin_left)
+
+        temp_video_path = create_temp_video_path(directory=PublishService.scratch_dir())
+        try:
+            # Decoding, compositing and encoding all happen in one ffmpeg process
+            with RenderJobRecorder.measure('encode'):
+                if SegmentCacheService.enabled(plan):
+                    FFmpegConcatenationService.render_with_cached_segments(temp_video_path, plan, overlay_path)
+                else:
+                    reporter = FFmpegConcatenationService.start_progress(plan)
+                    FFmpegService.run(FFmpegConcatenationService.build_command(
+                        temp_video_path, plan, overlay_path=overlay_path), reporter)
+        except Exception:
+            os.remove(temp_video_path)
+            raise
+
+        f = open(temp_video_path, 'rb')
+        django_file = File(f, name='processed_video.mp4')
+        return django_file, temp_video_path
@@ -0,0 +1,23 @@
+import resource
+
+
+class IOCounter:
+    """
+    Bytes written to storage by this process and its finished child processes, such as ffmpeg.
+    Based on the block output counters of getrusage, so it includes every write the kernel accounted,
+    not only the ones made through Python file objects.
+    """
+    BLOCK_SIZE = 512
+
+    def __init__(self):
+        self.started = self.total()
+
+    @staticmethod
+    def total() -> int:
+        blocks = (resource.getrusage(resource.RUSAGE_SELF).ru_oublock
+                  + resource.getrusage(resource.RUSAGE_CHILDREN).ru_oublock)
+        return blocks * IOCounter.BLOCK_SIZE
+
+    @property
+    def written_bytes(self) -> int:
+        return self.total() - self.started
@@ -0,0 +1,156 @@
+import time
+import logging
+import traceback
+import contextlib
+from datetime import datetime, timezone as dt_timezone
+from contextvars import ContextVar
+from collections import defaultdict
+
+from celery import current_task
+from django.conf import settings
+from django.utils import timezone
+
+from .counters import RenderCounters
+from .enums import AnimalStatus, RenderJobStatus
+from .models import Animal, RenderJob
+from .tracing import RenderTrace
+
+logger = logging.getLogger(__name__)
+
+render_job = ContextVar('render_job', default=None)
+
+
+class RenderJobRecorder:
+    """
+    Records one render of an animal as a RenderJob row.
+    The row is created when the render starts. Engines add stage durations through measure() while it runs, the
+    outcome, sizes and error are written when it ends. A render that raises is recorded as failed with its trace.
+    """
+    stages = ('probe', 'load', 'composite', 'encode', 'publish')
+
+    def __init__(self, animal: Animal, input_bytes=None):
+        self.animal = animal
+        self.input_bytes = input_bytes
+        self.durations = defaultdict(float)
+        self.frames = None
+        self.error = ''
+        self.error_type = ''
+        self.superseded = False
+        self.job = None
+        self.token = None
+
+    @staticmethod
+    def current():
+        return render_job.get()
+
+    @staticmethod
+    def task_origin() -> tuple[datetime | None, str]:
+        """Publish time and queue of the running Celery task, see stamp_enqueue_time."""
+        request = current_task.request if current_task else None
+        if request is None:
+            return None, ''
+        enqueued_at = request.get('enqueued_at')
+        queue = (request.delivery_info or {}).get('routing_key') or ''
+        return (datetime.fromtimestamp(enqueued_at, dt_timezone.utc) if enqueued_at else None), queue
+
+    def __enter__(self):
+        queued_at, queue = RenderJobRecorder.task_origin()
+        self.job = RenderJob.objects.create(
+            animal_id=self.animal.id,
+            season_id=self.animal.season_id,
+            attempt=self.animal.attempts + 1,
+            queue=queue,
+            worker=self.animal.lease_owner,
+            engine=self.animal.season.render_engine,
+            encoder_profile=dict(settings.VIDEO_ENCODER_PROFILE),
+            queued_at=queued_at,
+            started_at=timezone.now(),
+            input_bytes=self.input_bytes,
+        )
+        self.token = render_job.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        render_job.reset(self.token)
+        if exc_type is not None and self.job.status == RenderJobStatus.RUNNING:
+            self.error = ''.join(traceback.format_exception(exc_type, exc_value, tb))
+            self.error_type = exc_type.__name__
+            self.finish(RenderJobStatus.FAILED)
+
+    @staticmethod
+    @contextlib.contextmanager
+    def measure(stage):
+        recorder = RenderJobRecorder.current()
+        started = time.perf_counter()
+        try:
+            with RenderTrace.span(stage):
+                yield
+        finally:
+            if recorder:
+                recorder.durations[stage] += time.perf_counter() - started
+
+    @staticmethod
+    def timed(stage, function):
+        """Wraps a per frame function, its calls add up to the stage of the running render."""
+        function = RenderTrace.timed(stage, function)
+        recorder = RenderJobRecorder.current()
+        if recorder is None:
+            return function
+
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                recorder.durations[stage] += time.perf_counter() - started
+        return wrapper
+
+    @staticmethod
+    def fail(error, exception: BaseException | None = None):
+        recorder = RenderJobRecorder.current()
+        if recorder:
+            recorder.error = error
+            recorder.error_type = type(exception).__name__ if exception else ''
+
+    @staticmethod
+    def supersede():
+        """The running render is recorded as SUPERSEDED whatever its outcome, its media changed meanwhile."""
+        recorder = RenderJobRecorder.current()
+        if recorder:
+            recorder.superseded = True
+
+    @staticmethod
+    def count_frames(frames):
+        """Frames the running render encodes, set once its plan is known."""
+        recorder = RenderJobRecorder.current()
+        if recorder:
+            recorder.frames = frames
+
+    @staticmethod
+    def job_status(animal_status, rendered) -> RenderJobStatus:
+        if animal_status == AnimalStatus.PROCESSED:
+            return RenderJobStatus.SUCCEEDED if rendered else RenderJobStatus.SKIPPED
+        if animal_status == AnimalStatus.UNPROCESSED:
+            return RenderJobStatus.DEFERRED
+        return RenderJobStatus.FAILED
+
+    def finish(self, status, output_bytes=None):
+        durations = dict(self.durations)
+        # Frames are composited while MoviePy encodes them, the encode stage is what is left
+        if 'composite' in durations and 'encode' in durations:
+            durations['encode'] = max(0.0, durations['encode'] - durations['composite'])
+
+        job = self.job
+        job.status = RenderJobStatus.SUPERSEDED if self.superseded else status
+        job.finished_at = timezone.now()
+        job.duration_seconds = (job.finished_at - job.started_at).total_seconds()
+        job.wait_seconds = (job.started_at - job.queued_at).total_seconds() if job.queued_at else None
+        job.output_bytes = output_bytes
+        job.frames = self.frames
+        job.error = self.error
+        job.error_type = self.error_type
+        for stage in RenderJobRecorder.stages:
+            setattr(job, f'{stage}_seconds', durations.get(stage))
+        job.save()
+        RenderCounters.record(job, RenderJobRecorder.stages)
+        logger.info(f'render_job - {job}: {job.get_status_display()} in {job.duration_seconds:.1f}s {durations}')
@@ -0,0 +1,113 @@
+import os
+import socket
+import logging
+import threading
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Q, Sum
+from django.utils import timezone
+
+from .counters import RenderCounters
+from .enums import AnimalStatus, RenderJobStatus
+from .models import Animal, RenderJob
+
+logger = logging.getLogger(__name__)
+
+
+class RenderLease:
+    """
+    Ownership of an animal in PROCESSING state.
+    prepare_animal_for_processing records the worker and the start time, a background thread refreshes the
+    heartbeat while the render runs. When a worker dies the heartbeat stops and reclaim() puts the animal back
+    in the queue after a backoff, or marks it as failed once it used up its attempts.
+    """
+    def __init__(self, animal_id, owner):
+        self.animal_id = animal_id
+        self.owner = owner
+        self.stopped = threading.Event()
+        self.thread = None
+
+    @staticmethod
+    def owner_id() -> str:
+        return f'{socket.gethostname()}:{os.getpid()}'
+
+    @staticmethod
+    def acquire_values() -> dict:
+        now = timezone.now()
+        return {'lease_owner': RenderLease.owner_id(), 'lease_started_at': now, 'lease_heartbeat_at': now}
+
+    @staticmethod
+    def release_values() -> dict:
+        return {'lease_owner': '', 'lease_started_at': None, 'lease_heartbeat_at': None}
+
+    def __enter__(self):
+        self.thread = threading.Thread(target=self.run, name=f'lease-{self.animal_id}', daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stopped.set()
+        self.thread.join()
+
+    def run(self):
+        try:
+            while not self.stopped.wait(settings.VIDEO_LEASE_HEARTBEAT):
+                if not self.beat():
+                    # Either the render just finished and released it or the lease was reclaimed
+                    if not self.stopped.is_set():
+                        logger.warning(f'render_lease - lease of {self.animal_id} is lost, it was reclaimed')
+                    return
+        finally:
+            # The thread has its own database connection
+            connection.close()
+
+    def beat(self) -> bool:
+        return bool(Animal.objects.filter(
+            pk=self.animal_id, status=AnimalStatus.PROCESSING, lease_owner=self.owner
+        ).update(lease_heartbeat_at=timezone.now()))
+
+    @staticmethod
+    def backoff(attempts) -> timedelta:
+        seconds = settings.VIDEO_LEASE_BACKOFF * 2 ** (attempts - 1)
+        return timedelta(seconds=min(seconds, settings.VIDEO_LEASE_MAX_BACKOFF))
+
+    @staticmethod
+    def reclaim() -> dict:
+        """
+        Returns animals whose worker stopped sending heartbeats to the queue.
+        Returns the retry time of every reclaimed animal by id, None for the ones given up on.
+        """
+        now = timezone.now()
+        expired_before = now - timedelta(seconds=settings.VIDEO_LEASE_TIMEOUT)
+        # Rows put in PROCESSING before leases existed only have updated_at
+        legacy_before = now - timedelta(seconds=settings.CELERY_TASK_TIME_LIMIT)
+        reclaimed = {}
+        with transaction.atomic():
+            animals = Animal.objects.select_for_update(skip_locked=True).filter(
+                Q(lease_heartbeat_at__lt=expired_before)
+                | Q(lease_heartbeat_at__isnull=True, updated_at__lt=legacy_before),
+                status=AnimalStatus.PROCESSING,
+            )
+            for animal in animals:
+                attempts = animal.attempts + 1
+                values = {**RenderLease.release_values(), 'attempts': attempts, 'updated_at': now}
+                if attempts >= settings.VIDEO_LEASE_MAX_ATTEMPTS:
+                    values.update(status=AnimalStatus.ERROR, retry_after=None)
+                    logger.warning(f'render_lease - {animal.pk} of {animal.lease_owner or "unknown"} expired, '
+                                   f'giving up after {attempts} attempts')
+                else:
+                    values.update(status=AnimalStatus.UNPROCESSED, retry_after=now + RenderLease.backoff(attempts))
+                    logger.warning(f'render_lease - {animal.pk} of {animal.lease_owner or "unknown"} expired, '
+                                   f'retrying after {values["retry_after"]} (attempt {attempts})')
+                Animal.objects.filter(pk=animal.pk).update(**values)
+                reclaimed[animal.pk] = values['retry_after']
+            jobs = RenderJob.objects.filter(animal_id__in=reclaimed, status=RenderJobStatus.RUNNING)
+            input_bytes = jobs.aggregate(input_bytes=Sum('input_bytes'))['input_bytes']
+            abandoned = jobs.update(
+                status=RenderJobStatus.ABANDONED, finished_at=now, error='Lease expired, the worker stopped responding.'
+            )
+            if abandoned:
+                transaction.on_commit(lambda: RenderCounters.record_abandoned(abandoned, input_bytes))
+        return reclaimed
@@ -0,0 +1,51 @@
+"""
+Django Command to compare serial and chunked parallel encoding of the MoviePy engine
+"""
+import os
+import time
+import tempfile
+from pathlib import Path
+
+from django.core.management import BaseCommand
+
+from core.planner import RenderPlanner
+from core.probe import ProbeService
+from core.services import VideoConcatenationService
+from core.synthetic import SyntheticMedia
+from core.utils import cpu_quota
+
+
+class Command(BaseCommand):
+    """Django command to render a synthetic clip with 1, 2, 4 and 8 workers and report the speedup"""
+    help = 'Renders a synthetic clip with the MoviePy engine at several worker counts.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--width', type=int, default=1920)
+        parser.add_argument('--height', type=int, default=1080)
+        parser.add_argument('--duration', type=int, default=20)
+        parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8])
+
+    def handle(self, *args, **options):
+        with tempfile.TemporaryDirectory() as directory:
+            video_path = str(Path(directory) / 'clip.mp4')
+            SyntheticMedia.create_video(video_path, options['width'], options['height'], options['duration'])
+            plan = RenderPlanner.plan(video_path)
+            self.stdout.write(f'{plan.width}x{plan.height}, {options["duration"]}s, CPU quota: {cpu_quota()}')
+
+            baseline, frames = None, None
+            for workers in options['workers']:
+                started = time.perf_counter()
+                django_file, temp_video_path = VideoConcatenationService.concatenate_sacrifice_clips(
+                    video_path, None, None, None, None, None, None, None, 0, 0, 0, 0, plan=plan, workers=workers)
+                elapsed = time.perf_counter() - started
+                django_file.close()
+                count = ProbeService.frame_count(temp_video_path)
+                os.remove(temp_video_path)
+
+                baseline = baseline or elapsed
+                frames = frames or count
+                line = f'{workers} workers: {elapsed:7.2f}s {count} frames, speedup {baseline / elapsed:.2f}x'
+                if count != frames:
+                    self.stdout.write(self.style.ERROR(f'{line} (frame count differs from {frames})'))
+                else:
+                    self.stdout.write(line)
@@ -0,0 +1,65 @@
+"""
+Django Command to compare the overlay compositor against the composite_image chain
+"""
+import time
+import tempfile
+from pathlib import Path
+
+import numpy as np
+from django.core.management import BaseCommand
+from moviepy.editor import VideoClip
+
+from core.compositor import OverlayCompositor
+from core.overlays import OverlayService
+from core.services import VideoConcatenationService
+from core.synthetic import SyntheticMedia
+
+
+class Command(BaseCommand):
+    """Django command to measure frames per second of both overlay paths on a synthetic clip"""
+    help = 'Compares OverlayCompositor with the composite_image chain on a synthetic clip.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--width', type=int, default=1920)
+        parser.add_argument('--height', type=int, default=1080)
+        parser.add_argument('--frames', type=int, default=120)
+        parser.add_argument('--logo-height', type=int, default=100)
+
+    @staticmethod
+    def measure(get_frame, frames, fps=30):
+        started = time.perf_counter()
+        for index in range(frames):
+            get_frame(index / fps)
+        return frames / (time.perf_counter() - started)
+
+    def handle(self, *args, **options):
+        width, height, frames = options['width'], options['height'], options['frames']
+        noise = np.random.default_rng(0).integers(0, 256, size=(height, width, 3), dtype=np.uint8)
+        clip = VideoClip(lambda t: np.roll(noise, int(t * 30), axis=1), duration=frames / 30)
+        position = ('left', 'top')
+        margins = dict(mt=20, mr=0, mb=0, ml=20)
+
+        with tempfile.TemporaryDirectory() as directory:
+            frame_path, logo_path = str(Path(directory) / 'frame.png'), str(Path(directory) / 'logo.png')
+            SyntheticMedia.create_frame(frame_path, width, height)
+            SyntheticMedia.create_logo(logo_path)
+
+            chain = VideoConcatenationService.composite_image(clip, frame_path)
+            chain = VideoConcatenationService.composite_image(
+                chain, logo_path, height=options['logo_height'], position=position, **margins)
+            chain_fps = self.measure(chain.get_frame, frames)
+
+            overlay = OverlayService.render_overlay(
+                (width, height), frame_path, logo_path, options['logo_height'], position,
+                margins['mt'], margins['mr'], margins['mb'], margins['ml'])
+            overlay_path = Path(directory) / 'overlay.png'
+            overlay.save(overlay_path)
+            compositor = OverlayCompositor(*OverlayService.load_premultiplied(overlay_path))
+            compositor_fps = self.measure(lambda t: compositor(clip.get_frame(t)), frames)
+            base_fps = self.measure(clip.get_frame, frames)
+
+        self.stdout.write(f'{width}x{height}, {frames} frames')
+        self.stdout.write(f'source only:           {base_fps:8.1f} fps')
+        self.stdout.write(f'composite_image chain: {chain_fps:8.1f} fps')
+        self.stdout.write(f'OverlayCompositor:     {compositor_fps:8.1f} fps')
+        self.stdout.write(self.style.SUCCESS(f'speedup: {compositor_fps / chain_fps:.2f}x'))
@@ -0,0 +1,339 @@
+"""
+Django Command to benchmark the render pipeline end to end on synthetic fixtures
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import hashlib
+import platform
+import resource
+import statistics
+import subprocess
+import tempfile
+import threading
+import traceback
+import multiprocessing
+from pathlib import Path
+
+from django.conf import settings
+from django.core.files import File
+from django.core.management import BaseCommand
+from django.db import connections
+from django.test import override_settings
+from django.utils import timezone
+
+from core.chunks import ChunkedEncodingService
+from core.enums import AnimalStatus, LogoPosition, RenderEngine
+from core.models import Season, Animal
+from core.planner import RenderPlanner
+from core.services import AnimalServices, RENDER_ENGINES
+from core.synthetic import SyntheticMedia, RESOLUTIONS
+from core.tracing import RenderTrace
+from core.utils import cpu_quota, memory_limit
+
+ORIENTATIONS = ('landscape', 'portrait')
+MODES = ('concatenate', 'process')
+LOGO = dict(logo_height=100, logo_position='right-top', mt=40, mr=40, mb=0, ml=0)
+
+
+class Command(BaseCommand):
+    """
+    Django command to render every resolution, orientation, engine and mode combination of synthetic fixtures
+    and save wall time, frames per second, peak RSS and output size as JSON
+
+    Fixtures are generated by SyntheticMedia, so every run renders the same inputs, their digests are saved with
+    the results. The concatenate mode runs the engine's
+    concatenate_sacrifice_clips on a plan made beforehand, the process mode runs AnimalServices.process_animal on a
+    temporary season and animal, probing and planning included. Every configuration runs in its own process and
+    starts with an empty segment cache. Peak RSS is that of the render process. The tree peak adds its ffmpeg and
+    chunk processes, it is sampled every 100ms as PSS so memory shared by forked chunk processes is counted once.
+    Nothing is published, the rows and files are removed at the end.
+    """
+    help = 'Benchmarks the render pipeline on synthetic fixtures and saves the results as JSON.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--resolutions', nargs='+', choices=RESOLUTIONS, default=list(RESOLUTIONS))
+        parser.add_argument('--orientations', nargs='+', choices=ORIENTATIONS, default=list(ORIENTATIONS))
+        parser.add_argument('--engines', nargs='+', choices=RenderEngine.values, default=RenderEngine.values)
+        parser.add_argument('--modes', nargs='+', choices=MODES, default=list(MODES))
+        parser.add_argument('--duration', type=int, default=5, help='Seconds of the original video.')
+        parser.add_argument('--branding-duration', type=int, default=2, help='Seconds of the intro and outro.')
+        parser.add_argument('--workers', type=int, help='Chunk processes of MoviePy renders, default as configured.')
+        parser.add_argument('--repeat', type=int, default=1, help='Runs per configuration, the median is reported.')
+        parser.add_argument('--fixtures', help='Directory to keep the fixtures in and reuse them on the next run.')
+        parser.add_argument('--output', help='JSON file to write, default benchmarks/pipeline-<commit>-<time>.json')
+        parser.add_argument('--compare', help='JSON file of an earlier run to compare the results with.')
+
+    @staticmethod
+    def digest(path) -> str:
+        sha256 = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b''):
+                sha256.update(block)
+        return sha256.hexdigest()
+
+    def create_fixtures(self, directory, options) -> dict[str, Path]:
+        """Season assets per resolution and an original per resolution and orientation, existing ones are kept."""
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        branding, duration = options['branding_duration'], options['duration']
+        fixtures = {'logo': directory / 'logo.png'}
+        if not fixtures['logo'].exists():
+            SyntheticMedia.create_logo(fixtures['logo'])
+        for resolution in options['resolutions']:
+            width, height = RESOLUTIONS[resolution]
+            # Videos of other lengths are different fixtures, the name has to say so
+            intro = directory / f'intro-{resolution}-{branding}s.mp4'
+            outro = directory / f'outro-{resolution}-{branding}s.mp4'
+            frame = directory / f'frame-{resolution}.png'
+            for path, create in (
+                    (intro, lambda p: SyntheticMedia.create_video(p, width, height, branding)),
+                    (outro, lambda p: SyntheticMedia.create_video(p, width, height, branding, 'testsrc', 880)),
+                    (frame, lambda p: SyntheticMedia.create_frame(p, width, height))):
+                if not path.exists():
+                    self.stdout.write(f'Creating {path.name}')
+                    create(path)
+            fixtures.update({f'intro-{resolution}': intro, f'outro-{resolution}': outro, f'frame-{resolution}': frame})
+
+            for orientation in options['orientations']:
+                size = (width, height) if orientation == 'landscape' else (height, width)
+                video = directory / f'video-{resolution}-{orientation}-{duration}s.mp4'
+                if not video.exists():
+                    self.stdout.write(f'Creating {video.name}')
+                    SyntheticMedia.create_video(video, *size, duration)
+                fixtures[f'video-{resolution}-{orientation}'] = video
+        return fixtures
+
+    @staticmethod
+    def tree_pss(pid) -> int:
+        """Proportional set size in bytes of the process and all of its descendants."""
+        children = {}
+        for stat_path in Path('/proc').glob('[0-9]*/stat'):
+            try:
+                stat = stat_path.read_text()
+            except OSError:
+                continue
+            children.setdefault(int(stat[stat.rindex(')') + 2:].split()[1]), []).append(int(stat_path.parent.name))
+        pss, pids = 0, [pid]
+        while pids:
+            current = pids.pop()
+            pids.extend(children.get(current, []))
+            try:
+                rollup = Path(f'/proc/{current}/smaps_rollup').read_text()
+            except OSError:
+                continue
+            pss += next((int(line.split()[1]) * 1024 for line in rollup.splitlines() if line.startswith('Pss:')), 0)
+        return pss
+
+    @staticmethod
+    def isolated(function, *args) -> dict:
+        """Runs function in a forked process, returns its result with the peak RSS of the process and its tree."""
+        context = multiprocessing.get_context('fork')
+        receiver, sender = context.Pipe(duplex=False)
+
+        def target():
+            try:
+                result = function(*args)
+            except Exception:
+                result = {'error': traceback.format_exc()}
+            finally:
+                connections.close_all()
+            # ru_maxrss is in kilobytes on Linux
+            result['peak_rss_bytes'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+            sender.send(result)
+
+        # The child opens its own database connection
+        connections.close_all()
+        process = context.Process(target=target)
+        process.start()
+        sender.close()
+
+        peak_tree_pss = 0
+        finished = threading.Event()
+
+        def sample():
+            nonlocal peak_tree_pss
+            while not finished.wait(0.1):
+                peak_tree_pss = max(peak_tree_pss, Command.tree_pss(process.pid))
+
+        sampler = threading.Thread(target=sample, daemon=True)
+        sampler.start()
+        try:
+            result = receiver.recv()
+        except EOFError:
+            result = {'error': 'The render process died without a result, it may have been killed for memory.'}
+        finished.set()
+        sampler.join()
+        process.join()
+        result['peak_tree_pss_bytes'] = peak_tree_pss
+        return result
+
+    @staticmethod
+    def render_paths(fixtures, resolution, orientation) -> dict:
+        return {
+            'video_path': str(fixtures[f'video-{resolution}-{orientation}']),
+            'intro_path': str(fixtures[f'intro-{resolution}']),
+            'outro_path': str(fixtures[f'outro-{resolution}']),
+            'frame_path': str(fixtures[f'frame-{resolution}']),
+            'logo_path': str(fixtures['logo']),
+        }
+
+    @staticmethod
+    def run_concatenate(engine, paths, workers, repeat) -> dict:
+        plan = RenderPlanner.plan(**paths)
+        runs, output_bytes = [], None
+        for _ in range(repeat):
+            started = time.perf_counter()
+            django_file, temp_video_path = RENDER_ENGINES[engine].concatenate_sacrifice_clips(
+                paths['video_path'], None, paths['intro_path'], paths['outro_path'], paths['frame_path'],
+                paths['logo_path'], LOGO['logo_height'], LogoPosition.convert_for_moviepy(LOGO['logo_position']),
+                LOGO['mt'], LOGO['mr'], LOGO['mb'], LOGO['ml'], plan=plan, workers=workers)
+            runs.append(time.perf_counter() - started)
+            django_file.close()
+            output_bytes = os.path.getsize(temp_video_path)
+            os.remove(temp_video_path)
+        return {'runs': runs, 'frames': plan.frames, 'size': plan.size, 'output_bytes': output_bytes}
+
+    @staticmethod
+    def run_process(animal_id, repeat) -> dict:
+        runs, stages, output_bytes, frames, size = [], [], None, None, None
+        for _ in range(repeat):
+            animal = Animal.objects.select_related('season').get(pk=animal_id)
+            started = time.perf_counter()
+            with RenderTrace(f'benchmark-{animal_id}', profiler=None) as trace:
+                processed_video_file, temp_video_path, status, _render_key = AnimalServices.process_animal(animal)
+            runs.append(time.perf_counter() - started)
+            if status != AnimalStatus.PROCESSED:
+                return {'runs': runs, 'error': f'process_animal finished with status {AnimalStatus(status).label}'}
+            processed_video_file.close()
+            output_bytes = os.path.getsize(temp_video_path)
+            os.remove(temp_video_path)
+            stages.append({span.name: span.duration for span in trace.root.children})
+            plan = Animal.objects.values_list('render_plan', flat=True).get(pk=animal_id)
+            frames, size = plan['frames'], (plan['width'], plan['height'])
+        # Stage times of the median run
+        median_index = runs.index(sorted(runs)[(len(runs) - 1) // 2])
+        return {'runs': runs, 'frames': frames, 'size': size, 'output_bytes': output_bytes,
+                'stages': stages[median_index]}
+
+    @staticmethod
+    def create_animal(engine, paths) -> Animal:
+        season = Season(name=f'Benchmark {engine}', auto_process=False, render_engine=engine,
+                        logo_height=LOGO['logo_height'], logo_position=LOGO['logo_position'],
+                        logo_margin_top=LOGO['mt'], logo_margin_right=LOGO['mr'])
+        for field, role in (('intro', 'intro_path'), ('outro', 'outro_path'), ('frame', 'frame_path'),
+                            ('logo', 'logo_path')):
+            with open(paths[role], 'rb') as f:
+                getattr(season, field).save(os.path.basename(paths[role]), File(f), save=False)
+        season.save()
+        animal = Animal(season=season, code='BENCHMARK', status=AnimalStatus.UNPROCESSED)
+        with open(paths['video_path'], 'rb') as f:
+            animal.original_video.save(os.path.basename(paths['video_path']), File(f), save=False)
+        animal.save()
+        return animal
+
+    @staticmethod
+    def environment() -> dict:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=settings.BASE_DIR, capture_output=True, text=True)
+        ffmpeg = subprocess.run([settings.FFMPEG_BINARY, '-version'], capture_output=True, text=True)
+        return {
+            'created_at': timezone.now().isoformat(),
+            'commit': commit.stdout.strip() if commit.returncode == 0 else '',
+            'python': sys.version.split()[0],
+            'platform': platform.platform(),
+            'cpu_quota': cpu_quota(),
+            'memory_limit_bytes': memory_limit(),
+            'ffmpeg': ffmpeg.stdout.splitlines()[0] if ffmpeg.returncode == 0 else '',
+            'encoder_profile': dict(settings.VIDEO_ENCODER_PROFILE),
+        }
+
+    @staticmethod
+    def summarize(configuration, result) -> dict:
+        runs = result.pop('runs', [])
+        if runs:
+            wall_seconds = statistics.median(runs)
+            result.update(wall_seconds=round(wall_seconds, 3), cold_wall_seconds=round(runs[0], 3),
+                          runs=[round(run, 3) for run in runs])
+            if result.get('frames'):
+                result['fps'] = round(result['frames'] / wall_seconds, 2)
+        if 'stages' in result:
+            result['stages'] = {name: round(seconds, 3) for name, seconds in result['stages'].items()}
+        return {**configuration, **result}
+
+    @staticmethod
+    def key(result) -> tuple:
+        return result['mode'], result['engine'], result['resolution'], result['orientation']
+
+    def write_result(self, result, previous):
+        name = ' '.join(self.key(result))
+        if 'error' in result:
+            self.stdout.write(self.style.ERROR(f'{name:<36} failed: {result["error"].strip().splitlines()[-1]}'))
+            return
+        line = (f'{name:<36} {result["wall_seconds"]:8.2f}s {result["fps"]:8.1f} fps '
+                f'{result["peak_rss_bytes"] / 1024 ** 2:8.0f} MiB {result["peak_tree_pss_bytes"] / 1024 ** 2:8.0f} MiB '
+                f'{result["output_bytes"] / 1024 ** 2:7.1f} MiB')
+        before = previous.get(self.key(result))
+        if before and before.get('wall_seconds'):
+            change = (result['wall_seconds'] - before['wall_seconds']) / before['wall_seconds'] * 100
+            line += f'  {change:+6.1f}% wall'
+            style = self.style.SUCCESS if change < 0 else self.style.WARNING
+            line = style(line)
+        self.stdout.write(line)
+
+    def handle(self, *args, **options):
+        previous = {}
+        if options['compare']:
+            with open(options['compare']) as f:
+                previous = {self.key(result): result for result in json.load(f)['results']}
+
+        workers = options['workers'] or ChunkedEncodingService.workers()
+        fixtures_directory = options['fixtures']
+        with tempfile.TemporaryDirectory() as directory:
+            fixtures = self.create_fixtures(fixtures_directory or Path(directory) / 'fixtures', options)
+            report = {
+                'environment': self.environment(),
+                'options': {name: options[name] for name in (
+                    'resolutions', 'orientations', 'engines', 'modes', 'duration', 'branding_duration', 'repeat')},
+                'fixtures': {name: self.digest(path) for name, path in fixtures.items()},
+                'results': [],
+            }
+            report['options']['workers'] = workers
+            self.stdout.write(
+                f'{"configuration":<36} {"wall":>9} {"fps":>12} {"peak RSS":>12} {"tree PSS":>12} {"output":>11}')
+
+            for mode in options['modes']:
+                for engine in options['engines']:
+                    for resolution in options['resolutions']:
+                        for orientation in options['orientations']:
+                            configuration = {'mode': mode, 'engine': engine, 'resolution': resolution,
+                                             'orientation': orientation, 'workers': workers}
+                            paths = self.render_paths(fixtures, resolution, orientation)
+                            run_directory = Path(directory) / 'run'
+                            with override_settings(MEDIA_ROOT=str(run_directory / 'media'),
+                                                   VIDEO_CACHE_ROOT=str(run_directory / 'cache'),
+                                                   VIDEO_SCRATCH_ROOT=str(run_directory / 'scratch'),
+                                                   VIDEO_PARALLEL_WORKERS=workers):
+                                if mode == 'concatenate':
+                                    result = self.isolated(
+                                        self.run_concatenate, engine, paths, workers, options['repeat'])
+                                else:
+                                    animal = self.create_animal(engine, paths)
+                                    try:
+                                        result = self.isolated(self.run_process, animal.id, options['repeat'])
+                                    finally:
+                                        season = animal.season
+                                        animal.delete()
+                                        season.delete()
+                            shutil.rmtree(run_directory, ignore_errors=True)
+                            result = self.summarize(configuration, result)
+                            report['results'].append(result)
+                            self.write_result(result, previous)
+
+        commit = report['environment']['commit'][:8] or 'unknown'
+        output = Path(options['output'] or Path('benchmarks') / (
+            f'pipeline-{commit}-{time.strftime("%Y%m%d-%H%M%S")}.json'))
+        output.parent.mkdir(parents=True, exist_ok=True)
+        output.write_text(json.dumps(report, indent=2))
+        self.stdout.write(self.style.SUCCESS(f'Results are saved to {output}'))
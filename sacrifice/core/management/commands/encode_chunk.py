@@ -0,0 +1,17 @@
+"""
+Django Command to encode one chunk of a parallel MoviePy render
+"""
+from django.core.management import BaseCommand
+
+from core.chunks import ChunkedEncodingService
+
+
+class Command(BaseCommand):
+    """Django command started by ChunkedEncodingService for every chunk, not meant to be run by hand"""
+    help = 'Encodes one chunk of a parallel render from the payload written by ChunkedEncodingService.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('payload', help='Pickled settings, render function and arguments of the chunk.')
+
+    def handle(self, *args, **options):
+        ChunkedEncodingService.run(options['payload'])
@@ -0,0 +1,35 @@
+"""
+Django Command to export the render metrics to a file or stdout
+"""
+import os
+import tempfile
+
+from django.core.management import BaseCommand
+
+from core.metrics import RenderMetrics
+
+
+class Command(BaseCommand):
+    """Django command to write the /metrics output for a node_exporter textfile collector or a push gateway"""
+    help = 'Prints the render metrics in the Prometheus text format or writes them to a file.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--textfile', help='Write to this .prom file instead of stdout, replacing it atomically.')
+
+    def handle(self, *args, **options):
+        output = RenderMetrics.expose()
+        path = options['textfile']
+        if not path:
+            self.stdout.write(output, ending='')
+            return
+
+        # The collector must never read a half written file
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write(output)
+            os.chmod(temp_path, 0o644)
+            os.replace(temp_path, path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
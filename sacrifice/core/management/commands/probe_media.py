@@ -0,0 +1,47 @@
+"""
+Django Command to probe stored media and fill the metadata columns
+"""
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management import BaseCommand
+
+from core.metadata import MediaMetadataService
+from core.models import Animal, Season
+
+
+class Command(BaseCommand):
+    """Django command to backfill media metadata of existing seasons and animals"""
+    help = 'Probes existing uploads in parallel and stores their media metadata.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4, help='Number of parallel ffprobe processes.')
+        parser.add_argument('--all', action='store_true', help='Probe every row, not only the stale ones.')
+
+    def sync(self, instance, force):
+        field_names = instance.media_fields if force else MediaMetadataService.stale_fields(
+            instance, instance.media_fields)
+        if not field_names:
+            return instance, None
+        return instance, MediaMetadataService.collect(instance, field_names)
+
+    def handle(self, *args, **options):
+        instances = [*Season.objects.all(), *Animal.objects.select_related('season')]
+        self.stdout.write(f'Probing {len(instances)} rows with {options["workers"]} workers...')
+
+        updated = failed = 0
+        # ffprobe runs in subprocesses, threads are enough to keep them busy
+        with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+            results = executor.map(lambda instance: self.sync(instance, options['all']), instances)
+            for instance, metadata in results:
+                if metadata is None:
+                    continue
+                instance.media_metadata = metadata
+                values = {'media_metadata': metadata, **instance.get_media_columns()}
+                type(instance).objects.filter(pk=instance.pk).update(**values)
+                updated += 1
+                errors = [name for name, data in metadata.items() if 'error' in data]
+                if errors:
+                    failed += 1
+                    self.stdout.write(self.style.WARNING(f'{instance}: unreadable {", ".join(errors)}'))
+
+        self.stdout.write(self.style.SUCCESS(f'{updated} rows updated, {failed} with unreadable files'))
@@ -0,0 +1,45 @@
+"""
+Django Command to summarize render times from the render jobs
+"""
+from datetime import timedelta
+
+from django.core.management import BaseCommand
+from django.utils import timezone
+
+from core.enums import RenderJobStatus
+from core.models import RenderJob
+from core.utils import percentile
+
+
+class Command(BaseCommand):
+    """Django command to print render time percentiles per season and the slowest renders"""
+    help = 'Prints p50/p95 render times per season and the slowest inputs of the last days.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=7, help='Only renders finished in the last days.')
+        parser.add_argument('--slowest', type=int, default=10, help='Number of slowest renders to list.')
+
+    def handle(self, *args, **options):
+        jobs = RenderJob.objects.filter(
+            status=RenderJobStatus.SUCCEEDED,
+            finished_at__gte=timezone.now() - timedelta(days=options['days'])
+        )
+
+        durations = {}
+        for season, duration in jobs.values_list('season__name', 'duration_seconds').order_by('duration_seconds'):
+            durations.setdefault(season, []).append(duration)
+
+        self.stdout.write(f'{"season":<24} {"renders":>8} {"p50":>8} {"p95":>8} {"max":>8}')
+        for season, values in durations.items():
+            self.stdout.write(
+                f'{season or "-":<24} {len(values):>8} {percentile(values, 0.5):>7.1f}s '
+                f'{percentile(values, 0.95):>7.1f}s {values[-1]:>7.1f}s'
+            )
+
+        self.stdout.write('')
+        self.stdout.write(f'{"slowest":<24} {"total":>8} {"encode":>8} {"input MB":>9} {"engine":>8}')
+        for job in jobs.select_related('animal__season').order_by('-duration_seconds')[:options['slowest']]:
+            self.stdout.write(
+                f'{str(job.animal):<24} {job.duration_seconds:>7.1f}s {job.encode_seconds or 0:>7.1f}s '
+                f'{(job.input_bytes or 0) / 1024 ** 2:>9.1f} {job.engine:>8}'
+            )
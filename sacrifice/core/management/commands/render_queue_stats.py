@@ -0,0 +1,32 @@
+"""
+Django Command to show the depth and wait time of the render queues
+"""
+from django.core.management import BaseCommand
+
+from core.queue import RenderQueueService
+
+
+class Command(BaseCommand):
+    """Django command to print per queue depth and wait time metrics of the render queues"""
+    help = 'Prints how many renders wait in each queue and how long started renders waited.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', help='Reset the wait time counters after printing.')
+
+    def handle(self, *args, **options):
+        depths = RenderQueueService.queue_depths()
+        waits = RenderQueueService.wait_stats()
+        self.stdout.write(
+            f'{"queue":<16} {"depth":>6} {"started":>8} {"avg wait":>9} {"last wait":>10} {"max wait":>9}'
+        )
+        for queue, depth in depths.items():
+            wait = waits[queue]
+            average = wait['total_ms'] / wait['count'] / 1000 if wait['count'] else 0
+            self.stdout.write(
+                f'{queue:<16} {depth:>6} {wait["count"]:>8} {average:>8.1f}s {wait["last_ms"] / 1000:>9.1f}s '
+                f'{wait["max_ms"] / 1000:>8.1f}s'
+            )
+
+        if options['reset']:
+            RenderQueueService.reset_wait_stats()
+            self.stdout.write(self.style.SUCCESS('Wait time counters are reset.'))
@@ -0,0 +1,350 @@
+"""
+Django Command to replay an Eid day workload against the running render stack
+"""
+import json
+import time
+import random
+import tempfile
+import threading
+from pathlib import Path
+
+from celery import current_app
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.files import File
+from django.core.management import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Count
+from django.test import Client
+from django.urls import reverse
+from django.utils import timezone
+
+from core.enums import AnimalStatus, RenderEngine, RenderJobStatus, RenderQueue, ShareType
+from core.models import Season, Animal, Share, RenderJob
+from core.queue import RenderQueueService
+from core.synthetic import SyntheticMedia, RESOLUTIONS
+from core.tasks import send_forced_renders
+from core.utils import get_random_string, percentile
+
+FIRST_NAMES = ('Ahmet', 'Mehmet', 'Ayşe', 'Fatma', 'Mustafa', 'Zeynep', 'Ali', 'Emine', 'Hüseyin', 'Hatice',
+               'İbrahim', 'Elif', 'Yusuf', 'Meryem', 'Ömer', 'Hasan')
+LAST_NAMES = ('Yılmaz', 'Kaya', 'Demir', 'Şahin', 'Çelik', 'Yıldız', 'Aydın', 'Öztürk', 'Arslan', 'Doğan')
+PERCENTILES = (0.5, 0.9, 0.95, 0.99)
+
+
+class Command(BaseCommand):
+    """
+    Django command to generate a synthetic season, replay uploads and admin actions on a compressed schedule and
+    report how the real Celery pipeline kept up
+
+    Animals arrive over --hours with a late morning peak, each with its shares, the way the admin saves them. Some
+    videos are uploaded again later and admin users queue forced renders and poll the animal list and the progress
+    endpoint. The schedule runs --speedup times faster than real time, renders take as long as they take.
+    Workers, beat, the broker and the database are the ones in the settings, run it against the local compose
+    stack with nothing else rendering. Upload to processed latency, queue depths over time and worker utilization
+    are printed and saved as JSON. The season, its animals, shares and files are removed at the end.
+    """
+    help = 'Simulates an Eid day of uploads and admin actions against the running workers and reports latencies.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--animals', type=int, default=300)
+        parser.add_argument('--shares', type=int, default=7, help='Shares per animal.')
+        parser.add_argument('--hours', type=float, default=4, help='Hours the uploads arrive over.')
+        parser.add_argument('--speedup', type=float, default=60, help='Schedule time runs this many times faster.')
+        parser.add_argument('--reuploads', type=float, default=0.05, help='Share of videos uploaded again later.')
+        parser.add_argument('--force-renders', type=int, default=10, help='Admin actions that queue forced renders.')
+        parser.add_argument('--admins', type=int, default=5, help='Admin users polling the animal list.')
+        parser.add_argument('--admin-interval', type=float, default=5, help='Seconds between the polls of an admin.')
+        parser.add_argument('--resolution', choices=RESOLUTIONS, default='1080p')
+        parser.add_argument('--portrait', type=float, default=0.3, help='Share of portrait videos.')
+        parser.add_argument('--duration', type=int, default=20, help='Seconds of the uploaded videos.')
+        parser.add_argument('--engine', choices=RenderEngine.values, default=RenderEngine.MOVIEPY)
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--sample-interval', type=float, default=5, help='Seconds between queue samples.')
+        parser.add_argument('--timeout', type=float, default=3600,
+                            help='Seconds to wait for the renders after the last upload.')
+        parser.add_argument('--output', help='JSON file to write, default simulations/eid-<time>.json')
+        parser.add_argument('--keep', action='store_true', help='Keep the season and its animals.')
+        parser.add_argument('--force', action='store_true', help='Run even if DEBUG is off.')
+
+    def create_media(self, directory, options) -> tuple[dict, list[Path]]:
+        width, height = RESOLUTIONS[options['resolution']]
+        directory = Path(directory)
+        self.stdout.write('Creating the fixture videos')
+        branding = {'intro': directory / 'intro.mp4', 'outro': directory / 'outro.mp4',
+                    'frame': directory / 'frame.png', 'logo': directory / 'logo.png'}
+        SyntheticMedia.create_video(branding['intro'], width, height, 3)
+        SyntheticMedia.create_video(branding['outro'], width, height, 3, 'testsrc', 880)
+        SyntheticMedia.create_frame(branding['frame'], width, height)
+        SyntheticMedia.create_logo(branding['logo'])
+
+        videos = []
+        for index, (size, frequency) in enumerate((((width, height), 440), ((width, height), 660),
+                                                   ((height, width), 550), ((height, width), 770))):
+            path = directory / f'video-{index}-{size[0]}x{size[1]}.mp4'
+            SyntheticMedia.create_video(path, *size, options['duration'], frequency=frequency)
+            videos.append(path)
+        return branding, videos
+
+    def create_season(self, branding, options) -> Season:
+        season = Season(name=f'Simulation {self.run_id}', auto_process=True, render_engine=options['engine'])
+        for field, path in branding.items():
+            with open(path, 'rb') as f:
+                getattr(season, field).save(path.name, File(f), save=False)
+        season.save()
+        return season
+
+    def schedule(self, options) -> list[tuple[float, str, int]]:
+        """(seconds from the start, event, animal index) in schedule time."""
+        window = options['hours'] * 3600
+        # Uploads start with the first sacrifices after the prayer and peak in the late morning
+        uploads = [self.random.triangular(0, window, window * 0.35) for _ in range(options['animals'])]
+        events = [(at, 'upload', index) for index, at in enumerate(uploads)]
+        for index in self.random.sample(range(options['animals']), round(options['animals'] * options['reuploads'])):
+            events.append((min(window, uploads[index] + self.random.uniform(600, 3600)), 'reupload', index))
+        events += [(self.random.uniform(0, window), 'force_render', 0) for _ in range(options['force_renders'])]
+        return sorted(events)
+
+    def video_for(self, options) -> Path:
+        portrait = self.random.random() < options['portrait']
+        return self.random.choice(self.videos[2:] if portrait else self.videos[:2])
+
+    def upload(self, index, options):
+        video = self.video_for(options)
+        # Taken before the save, the render it queues on commit may start before this returns
+        uploaded_at = timezone.now()
+        # The admin saves the animal and its share inlines in one transaction, the render is queued on commit
+        with transaction.atomic():
+            animal = Animal(season=self.season, code=f'S{self.run_id}{index:05d}')
+            with open(video, 'rb') as f:
+                animal.original_video.save(video.name, File(f), save=False)
+            animal.save()
+            for _ in range(options['shares']):
+                Share.objects.create(
+                    animal=animal,
+                    name=f'{self.random.choice(FIRST_NAMES)} {self.random.choice(LAST_NAMES)}',
+                    phone=f'+90532{self.random.randint(1000000, 9999999)}',
+                    type=self.random.choice(ShareType.values),
+                    by=self.random.choice(LAST_NAMES),
+                )
+        self.animal_ids[index] = animal.id
+        self.uploads.append((animal.id, uploaded_at))
+
+    def reupload(self, index, options):
+        video = self.video_for(options)
+        uploaded_at = timezone.now()
+        with transaction.atomic():
+            animal = Animal.objects.get(pk=self.animal_ids[index])
+            with open(video, 'rb') as f:
+                animal.original_video.save(video.name, File(f), save=False)
+            animal.save()
+        self.uploads.append((animal.id, uploaded_at))
+
+    def force_render(self, index, options):
+        uploaded = list(self.animal_ids.values())
+        if uploaded:
+            animal_ids = self.random.sample(uploaded, min(10, len(uploaded)))
+            send_forced_renders(animal_ids)
+            self.forced_renders += len(animal_ids)
+
+    def poll_admin(self, user, options):
+        # Errors are counted instead of stopping the admin
+        client = Client(raise_request_exception=False)
+        client.force_login(user)
+        urls = {
+            'changelist': reverse('admin:core_animal_changelist'),
+            'progress': reverse('admin:core_animal_progress'),
+        }
+        try:
+            while not self.stopped.wait(options['admin_interval']):
+                for name, url in urls.items():
+                    started = time.perf_counter()
+                    response = client.get(url)
+                    self.admin_requests[name].append((time.perf_counter() - started, response.status_code))
+        finally:
+            connection.close()
+
+    def sample(self, options):
+        queues = [*RenderQueue.values, current_app.conf.task_default_queue]
+        try:
+            while True:
+                statuses = dict(
+                    Animal.objects.filter(season=self.season).values_list('status').annotate(count=Count('id'))
+                    .order_by()
+                )
+                try:
+                    depths = RenderQueueService.queue_depths(queues)
+                except Exception as e:
+                    self.stderr.write(f'Queue depths are not available: {e}')
+                    depths = {}
+                self.samples.append({
+                    'at': round(time.monotonic() - self.started, 1),
+                    'queues': depths,
+                    'statuses': {AnimalStatus(status).name.lower(): count for status, count in statuses.items()},
+                })
+                if self.stopped.wait(options['sample_interval']):
+                    return
+        finally:
+            connection.close()
+
+    def finished(self) -> bool:
+        return self.season.animals.filter(
+            status__in=(AnimalStatus.UNPROCESSED, AnimalStatus.PROCESSING)
+        ).count() == 0 and not any(sum(sample['queues'].values()) for sample in self.samples[-1:])
+
+    def latencies(self) -> tuple[list[float], int]:
+        """Seconds from every upload to the end of the first render that started after it and published a video."""
+        renders = {}
+        # A video uploaded again with the same content is skipped, its processed video is already current
+        jobs = RenderJob.objects.filter(
+            season=self.season, status__in=(RenderJobStatus.SUCCEEDED, RenderJobStatus.SKIPPED))
+        for animal_id, started_at, finished_at in jobs.values_list('animal_id', 'started_at', 'finished_at'):
+            renders.setdefault(animal_id, []).append((started_at, finished_at))
+        latencies, pending = [], 0
+        for animal_id, uploaded_at in self.uploads:
+            finished_at = min((finished for started, finished in renders.get(animal_id, []) if started >= uploaded_at),
+                              default=None)
+            if finished_at is None:
+                pending += 1
+            else:
+                latencies.append((finished_at - uploaded_at).total_seconds())
+        return sorted(latencies), pending
+
+    def utilization(self, slots, started_at, finished_at) -> float | None:
+        """Share of the worker slots' time spent rendering this season."""
+        if not slots:
+            return None
+        busy = 0.0
+        for job_started, job_finished in RenderJob.objects.filter(season=self.season).values_list(
+                'started_at', 'finished_at'):
+            busy += (min(job_finished or finished_at, finished_at) - max(job_started, started_at)).total_seconds()
+        return busy / (slots * (finished_at - started_at).total_seconds())
+
+    @staticmethod
+    def summary(values) -> dict:
+        values = sorted(values)
+        summary = {f'p{round(fraction * 100)}': percentile(values, fraction) for fraction in PERCENTILES}
+        return {'count': len(values), **summary, 'max': values[-1] if values else None}
+
+    def cleanup(self, user):
+        user.delete()
+        if self.season is None:
+            return
+        Share.objects.filter(animal__season=self.season).delete()
+        # Rows are deleted one by one so that django_cleanup removes their files
+        for animal in self.season.animals.all():
+            animal.delete()
+        self.season.delete()
+
+    def handle(self, *args, **options):
+        if not settings.DEBUG and not options['force']:
+            raise CommandError('This creates hundreds of animals and loads the workers, use --force outside DEBUG.')
+        workers = current_app.control.ping(timeout=2.0)
+        if not workers:
+            raise CommandError('No Celery worker answered, start the worker and beat first.')
+        slots = RenderQueueService.worker_slots()
+        self.stdout.write(f'{len(workers)} workers, {slots} slots on the bulk queue')
+
+        self.random = random.Random(options['seed'])
+        self.run_id = get_random_string(3)
+        self.season = None
+        self.animal_ids, self.uploads, self.samples = {}, [], []
+        self.admin_requests = {'changelist': [], 'progress': []}
+        self.forced_renders = 0
+        self.stopped = threading.Event()
+        user = get_user_model().objects.create_superuser(f'simulation-{self.run_id}', password=None)
+        threads, started_at, finished_at, uploads_finished = [], None, None, None
+        try:
+            with tempfile.TemporaryDirectory() as directory:
+                branding, self.videos = self.create_media(directory, options)
+                self.season = self.create_season(branding, options)
+                events = self.schedule(options)
+
+                self.started = time.monotonic()
+                started_at = timezone.now()
+                threads = [threading.Thread(target=self.sample, args=(options,), daemon=True)]
+                threads += [threading.Thread(target=self.poll_admin, args=(user, options), daemon=True)
+                            for _ in range(options['admins'])]
+                for thread in threads:
+                    thread.start()
+
+                self.stdout.write(f'Replaying {len(events)} events over {options["hours"]}h at {options["speedup"]}x')
+                for at, event, index in events:
+                    delay = self.started + at / options['speedup'] - time.monotonic()
+                    if delay > 0:
+                        time.sleep(delay)
+                    getattr(self, event)(index, options)
+                uploads_finished = time.monotonic() - self.started
+                self.stdout.write(f'All uploads are done in {uploads_finished:.0f}s, waiting for the renders')
+
+                deadline = time.monotonic() + options['timeout']
+                while time.monotonic() < deadline and not self.finished():
+                    time.sleep(options['sample_interval'])
+                finished_at = timezone.now()
+        finally:
+            self.stopped.set()
+            for thread in threads:
+                thread.join()
+            # An interrupted run still reports what it got so far
+            if started_at is not None:
+                self.report(options, slots, len(workers), started_at, finished_at or timezone.now(), uploads_finished)
+            if not options['keep']:
+                self.cleanup(user)
+
+    def report(self, options, slots, workers, started_at, finished_at, uploads_finished):
+        latencies, pending = self.latencies()
+        statuses = dict(
+            self.season.animals.values_list('status').annotate(count=Count('id')).order_by()
+        )
+        jobs = dict(
+            RenderJob.objects.filter(season=self.season).values_list('status').annotate(count=Count('id')).order_by()
+        )
+        elapsed = (finished_at - started_at).total_seconds()
+        processed = statuses.get(AnimalStatus.PROCESSED, 0)
+        report = {
+            'options': {name: value for name, value in options.items()
+                        if name not in ('verbosity', 'settings', 'pythonpath', 'traceback', 'no_color',
+                                        'force_color', 'skip_checks')},
+            'workers': workers,
+            'slots': slots,
+            'elapsed_seconds': round(elapsed, 1),
+            'uploads_seconds': round(uploads_finished, 1) if uploads_finished is not None else None,
+            'uploads': len(self.uploads),
+            'forced_renders': self.forced_renders,
+            'animals': {AnimalStatus(status).name.lower(): count for status, count in statuses.items()},
+            'render_jobs': {RenderJobStatus(status).name.lower(): count for status, count in jobs.items()},
+            'latency_seconds': {**self.summary(latencies), 'pending': pending},
+            'processed_per_hour': round(processed / elapsed * 3600, 1) if elapsed else None,
+            'worker_utilization': self.utilization(slots, started_at, finished_at),
+            'max_queue_depths': {
+                queue: max(sample['queues'].get(queue, 0) for sample in self.samples)
+                for queue in {queue for sample in self.samples for queue in sample['queues']}
+            },
+            'admin_seconds': {
+                name: {**self.summary([elapsed for elapsed, _status in requests]),
+                       'errors': sum(1 for _elapsed, status in requests if status >= 400)}
+                for name, requests in self.admin_requests.items()
+            },
+            'timeline': self.samples,
+        }
+
+        latency = report['latency_seconds']
+        self.stdout.write(f'{report["uploads"]} uploads, {processed} animals processed in {elapsed:.0f}s, '
+                          f'{report["processed_per_hour"]}/h')
+        if latency['count']:
+            self.stdout.write(f'upload to processed: p50 {latency["p50"]:.1f}s p90 {latency["p90"]:.1f}s '
+                              f'p95 {latency["p95"]:.1f}s p99 {latency["p99"]:.1f}s max {latency["max"]:.1f}s')
+        if pending:
+            self.stdout.write(self.style.WARNING(f'{pending} uploads were not rendered before the timeout'))
+        if report['worker_utilization'] is not None:
+            self.stdout.write(f'worker utilization: {report["worker_utilization"] * 100:.0f}% of {slots} slots')
+        self.stdout.write(f'max queue depths: {report["max_queue_depths"]}')
+        for name, summary in report['admin_seconds'].items():
+            if summary['count']:
+                self.stdout.write(f'admin {name}: p50 {summary["p50"] * 1000:.0f}ms p95 {summary["p95"] * 1000:.0f}ms '
+                                  f'errors {summary["errors"]}')
+
+        output = Path(options['output'] or Path('simulations') / f'eid-{time.strftime("%Y%m%d-%H%M%S")}.json')
+        output.parent.mkdir(parents=True, exist_ok=True)
+        output.write_text(json.dumps(report, indent=2, default=str))
+        self.stdout.write(self.style.SUCCESS(f'Results are saved to {output}'))
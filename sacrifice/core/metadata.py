@@ -0,0 +1,84 @@
+import os
+import shutil
+import logging
+import tempfile
+
+from .probe import ProbeService, ProbeError
+
+logger = logging.getLogger(__name__)
+
+VIDEO_FIELDS = ('original_video', 'intro', 'outro')
+
+
+class MediaMetadataService:
+    """
+    Probes uploaded assets once and keeps the result next to the file name it belongs to,
+    so later readers can trust the stored facts as long as the name matches.
+    """
+    @staticmethod
+    def probe_path(path, field_name) -> dict:
+        if field_name in VIDEO_FIELDS:
+            return ProbeService.probe(path)
+        width, height = ProbeService.image_size(path)
+        return {'width': width, 'height': height}
+
+    @staticmethod
+    def probe_upload(upload, field_name) -> dict:
+        if hasattr(upload, 'temporary_file_path'):
+            return MediaMetadataService.probe_path(upload.temporary_file_path(), field_name)
+
+        # Small uploads stay in memory, ffprobe needs a seekable file on disk
+        extension = os.path.splitext(upload.name or '')[1]
+        with tempfile.NamedTemporaryFile(suffix=extension) as f:
+            upload.seek(0)
+            shutil.copyfileobj(upload, f)
+            f.flush()
+            upload.seek(0)
+            return MediaMetadataService.probe_path(f.name, field_name)
+
+    @staticmethod
+    def stale_fields(instance, field_names) -> list[str]:
+        metadata = instance.media_metadata or {}
+        return [
+            name for name in field_names
+            if (getattr(instance, name).name or None) != metadata.get(name, {}).get('name')
+        ]
+
+    @staticmethod
+    def probed_uploads(instance, field_names) -> dict:
+        """Results of MediaProbeValidator for the fields holding a fresh upload, read before the upload is stored."""
+        probed = {}
+        for name in field_names:
+            field_file = getattr(instance, name)
+            if not field_file or field_file._committed:
+                continue
+            data = getattr(field_file.file, 'probed_metadata', None)
+            if data is not None:
+                probed[name] = data
+        return probed
+
+    @staticmethod
+    def collect(instance, field_names, probed=None) -> dict:
+        metadata = dict(instance.media_metadata or {})
+        probed = probed or {}
+        for name in field_names:
+            field_file = getattr(instance, name)
+            if not field_file:
+                metadata.pop(name, None)
+                continue
+            try:
+                data = probed.get(name) or MediaMetadataService.probe_path(field_file.path, name)
+            except ProbeError as e:
+                logger.warning(f'media_metadata - {instance}: {e}')
+                data = {'error': str(e)}
+            metadata[name] = {'name': field_file.name, **data}
+        return metadata
+
+    @staticmethod
+    def known_metadata(instance, field_name) -> dict | None:
+        """Stored metadata of the field, None when missing, stale or unreadable."""
+        data = (instance.media_metadata or {}).get(field_name)
+        field_file = getattr(instance, field_name)
+        if not data or 'error' in data or not field_file or data.get('name') != field_file.name:
+            return None
+        return data
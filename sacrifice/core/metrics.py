@@ -0,0 +1,178 @@
+import math
+import logging
+
+from celery import current_app
+from django.conf import settings
+from django.db.models import Count
+
+from .counters import RenderCounters
+from .enums import AnimalStatus, RenderJobStatus, RenderQueue
+from .jobs import RenderJobRecorder
+from .models import Animal
+from .progress import RenderProgress
+from .queue import RenderQueueService
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class MetricFamily:
+    """One metric in the Prometheus text exposition format."""
+    def __init__(self, name, kind, help_text):
+        self.name = name
+        self.kind = kind
+        self.help_text = help_text
+        self.samples = []
+
+    def add(self, value, suffix='', **labels):
+        self.samples.append((suffix, labels, value))
+
+    @staticmethod
+    def escape(value) -> str:
+        return str(value).replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+    @staticmethod
+    def format_value(value) -> str:
+        if isinstance(value, float):
+            if math.isinf(value):
+                return '+Inf' if value > 0 else '-Inf'
+            return repr(value)
+        return str(value)
+
+    def expose(self) -> str:
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} {self.kind}']
+        for suffix, labels, value in self.samples:
+            label_text = ','.join(
+                f'{name}="{MetricFamily.escape(MetricFamily.format_value(label))}"' for name, label in labels.items())
+            label_text = f'{{{label_text}}}' if label_text else ''
+            lines.append(f'{self.name}{suffix}{label_text} {MetricFamily.format_value(value)}')
+        return '\n'.join(lines)
+
+
+class RenderMetrics:
+    """
+    Render throughput and queue health for /metrics and the export_metrics command.
+    Everything is read from shared state when scraped: RenderCounters in the cache for the counters and histograms,
+    the broker for queue depths, the cache for live progress and animal rows for the gauges. A scrape of any web
+    or worker process sees the whole cluster, so no process has to keep or push metrics of its own.
+    """
+    prefix = 'sacrifice'
+
+    @staticmethod
+    def collect() -> list[MetricFamily]:
+        return [
+            *RenderMetrics.stage_durations(),
+            *RenderMetrics.render_totals(),
+            *RenderMetrics.encode_fps(),
+            *RenderMetrics.queues(),
+            *RenderMetrics.animals(),
+        ]
+
+    @staticmethod
+    def expose() -> str:
+        return '\n'.join(family.expose() for family in RenderMetrics.collect()) + '\n'
+
+    @staticmethod
+    def stage_durations() -> list[MetricFamily]:
+        family = MetricFamily(f'{RenderMetrics.prefix}_render_stage_seconds', 'histogram',
+                              'Duration of finished renders per stage, total is the whole render.')
+        try:
+            histograms = {stage: RenderCounters.histogram(stage) for stage in ('total', *RenderJobRecorder.stages)}
+        except Exception as e:
+            logger.warning(f'render_metrics - render counters are not available: {e}')
+            return []
+        for stage, (buckets, count, total) in histograms.items():
+            for bound, cumulative in buckets:
+                family.add(cumulative, '_bucket', stage=stage, le=bound)
+            family.add(count, '_count', stage=stage)
+            family.add(float(total), '_sum', stage=stage)
+        return [family]
+
+    @staticmethod
+    def render_totals() -> list[MetricFamily]:
+        try:
+            counts, failed, totals = RenderCounters.jobs(), RenderCounters.failures(), RenderCounters.totals()
+        except Exception as e:
+            logger.warning(f'render_metrics - render counters are not available: {e}')
+            return []
+
+        statuses = MetricFamily(f'{RenderMetrics.prefix}_render_jobs_total', 'counter',
+                                'Finished renders by outcome.')
+        for status in RenderJobStatus:
+            if status != RenderJobStatus.RUNNING:
+                statuses.add(counts[status], status=status.name.lower())
+
+        failures = MetricFamily(f'{RenderMetrics.prefix}_render_failures_total', 'counter',
+                                'Failed renders by exception type.')
+        for error_type, count in failed.items():
+            failures.add(count, error_type=error_type)
+
+        expiries = MetricFamily(f'{RenderMetrics.prefix}_render_lease_expiries_total', 'counter',
+                                'Renders abandoned because their worker stopped renewing the lease.')
+        expiries.add(counts[RenderJobStatus.ABANDONED])
+
+        frames = MetricFamily(f'{RenderMetrics.prefix}_render_frames_total', 'counter',
+                              'Frames encoded by successful renders, divide by the encode seconds for fps.')
+        frames.add(totals['frames'])
+        input_bytes = MetricFamily(f'{RenderMetrics.prefix}_render_input_bytes_total', 'counter',
+                                   'Bytes of the media read by finished renders.')
+        input_bytes.add(totals['input_bytes'])
+        output_bytes = MetricFamily(f'{RenderMetrics.prefix}_render_output_bytes_total', 'counter',
+                                    'Bytes of the videos written by finished renders.')
+        output_bytes.add(totals['output_bytes'])
+        return [statuses, failures, expiries, frames, input_bytes, output_bytes]
+
+    @staticmethod
+    def encode_fps() -> list[MetricFamily]:
+        family = MetricFamily(f'{RenderMetrics.prefix}_render_encode_fps', 'gauge',
+                              'Frames per second encoded right now by all running renders.')
+        animal_ids = list(Animal.objects.filter(status=AnimalStatus.PROCESSING).values_list('id', flat=True))
+        try:
+            progress = RenderProgress.get_many(animal_ids) if animal_ids else {}
+        except Exception as e:
+            logger.warning(f'render_metrics - progress is not available: {e}')
+            return []
+        family.add(float(sum(item['fps'] or 0 for item in progress.values())))
+        return [family]
+
+    @staticmethod
+    def queues() -> list[MetricFamily]:
+        broker_up = MetricFamily(f'{RenderMetrics.prefix}_broker_up', 'gauge',
+                                 'Whether the broker answered the queue depth query.')
+        depth = MetricFamily(f'{RenderMetrics.prefix}_queue_depth', 'gauge',
+                             'Messages waiting in each Celery queue, reserved and running ones excluded.')
+        try:
+            depths = RenderQueueService.queue_depths([*RenderQueue.values, current_app.conf.task_default_queue])
+        except Exception as e:
+            logger.warning(f'render_metrics - queue depths are not available: {e}')
+            broker_up.add(0)
+            depths = {}
+        else:
+            broker_up.add(1)
+        for queue, messages in depths.items():
+            depth.add(messages, queue=queue)
+
+        wait = MetricFamily(f'{RenderMetrics.prefix}_queue_wait_seconds', 'summary',
+                            'Time render tasks waited in their queue, reset by render_queue_stats --reset.')
+        try:
+            stats = RenderQueueService.wait_stats()
+        except Exception as e:
+            logger.warning(f'render_metrics - queue wait times are not available: {e}')
+            stats = {}
+        for queue, stat in stats.items():
+            wait.add(stat['count'], '_count', queue=queue)
+            wait.add(stat['total_ms'] / 1000, '_sum', queue=queue)
+        return [broker_up, depth, wait]
+
+    @staticmethod
+    def animals() -> list[MetricFamily]:
+        family = MetricFamily(f'{RenderMetrics.prefix}_animals', 'gauge', 'Animals per season and status.')
+        counts = {}
+        rows = Animal.objects.values_list('season__year', 'season__name', 'status').annotate(count=Count('id'))
+        for year, name, status, count in rows.order_by('season__year', 'season__name'):
+            counts.setdefault((year, name), {})[status] = count
+        for (year, name), by_status in counts.items():
+            for status in AnimalStatus:
+                family.add(by_status.get(status, 0), year=year, season=name, status=status.name.lower())
+        return [family]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.8 on 2026-10-18 10:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_alter_animal_cover_alter_animal_original_video_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='season',
+            name='render_engine',
+            field=models.CharField(choices=[('moviepy', 'MoviePy'), ('ffmpeg', 'FFmpeg')], default='moviepy', help_text='Videoların işlenmesinde kullanılacak motor. FFmpeg tek bir ffmpeg işlemiyle çok daha hızlı işler.', max_length=15, verbose_name='İşleme Motoru'),
+        ),
+    ]
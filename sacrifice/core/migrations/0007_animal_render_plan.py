@@ -0,0 +1,18 @@
+# Generated by Django 5.0.8 on 2026-10-18 12:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_season_render_engine'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='animal',
+            name='render_plan',
+            field=models.JSONField(blank=True, editable=False, help_text='Son işlemede girdilerin incelenmesiyle oluşturulan çıktı çözünürlüğü, süre ve uyarılar.', null=True, verbose_name='İşleme Planı'),
+        ),
+    ]
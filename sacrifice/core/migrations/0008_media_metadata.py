@@ -0,0 +1,81 @@
+# Generated by Django 5.0.8 on 2026-10-18 13:05
+
+import core.utils
+import core.validators
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_animal_render_plan'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='animal',
+            name='audio_codec',
+            field=models.CharField(blank=True, default='', editable=False, max_length=31, verbose_name='Ses Codec'),
+        ),
+        migrations.AddField(
+            model_name='animal',
+            name='media_metadata',
+            field=models.JSONField(blank=True, default=dict, editable=False, help_text='Yüklenen dosyaların süre, çözünürlük, fps, codec, rotasyon ve bitrate bilgileri.', verbose_name='Medya Bilgileri'),
+        ),
+        migrations.AddField(
+            model_name='animal',
+            name='video_bitrate',
+            field=models.PositiveBigIntegerField(blank=True, editable=False, null=True, verbose_name='Video Bitrate'),
+        ),
+        migrations.AddField(
+            model_name='animal',
+            name='video_codec',
+            field=models.CharField(blank=True, default='', editable=False, max_length=31, verbose_name='Video Codec'),
+        ),
+        migrations.AddField(
+            model_name='animal',
+            name='video_duration',
+            field=models.FloatField(blank=True, editable=False, null=True, verbose_name='Video Süresi'),
+        ),
+        migrations.AddField(
+            model_name='animal',
+            name='video_fps',
+            field=models.FloatField(blank=True, editable=False, null=True, verbose_name='Video FPS'),
+        ),
+        migrations.AddField(
+            model_name='animal',
+            name='video_height',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True, verbose_name='Video Yüksekliği'),
+        ),
+        migrations.AddField(
+            model_name='animal',
+            name='video_rotation',
+            field=models.PositiveSmallIntegerField(blank=True, editable=False, null=True, verbose_name='Video Rotasyonu'),
+        ),
+        migrations.AddField(
+            model_name='animal',
+            name='video_width',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True, verbose_name='Video Genişliği'),
+        ),
+        migrations.AddField(
+            model_name='season',
+            name='media_metadata',
+            field=models.JSONField(blank=True, default=dict, editable=False, help_text='Yüklenen dosyaların süre, çözünürlük, fps, codec, rotasyon ve bitrate bilgileri.', verbose_name='Medya Bilgileri'),
+        ),
+        migrations.AlterField(
+            model_name='animal',
+            name='original_video',
+            field=models.FileField(blank=True, help_text='Orijinal kurban kesim videosu. Maksimum dosya boyutu 100 MB.', null=True, upload_to=core.utils.animal_video_path_original, validators=[django.core.validators.FileExtensionValidator(allowed_extensions=['mp4', 'mov']), core.validators.FileSizeValidator(100), core.validators.MediaProbeValidator('original_video')], verbose_name='Orjinal Video'),
+        ),
+        migrations.AlterField(
+            model_name='season',
+            name='intro',
+            field=models.FileField(blank=True, help_text='Giriş videosu. Maksimum dosya boyutu 100 MB.', null=True, upload_to='intros', validators=[django.core.validators.FileExtensionValidator(allowed_extensions=['MOV', 'avi', 'mp4', 'webm']), core.validators.FileSizeValidator(100), core.validators.MediaProbeValidator('intro')], verbose_name='Giriş'),
+        ),
+        migrations.AlterField(
+            model_name='season',
+            name='outro',
+            field=models.FileField(blank=True, help_text='Çıkış videosu. Maksimum dosya boyutu 100 MB.', null=True, upload_to='outros', validators=[django.core.validators.FileExtensionValidator(allowed_extensions=['MOV', 'avi', 'mp4', 'webm']), core.validators.FileSizeValidator(100), core.validators.MediaProbeValidator('outro')], verbose_name='Çıkış'),
+        ),
+    ]
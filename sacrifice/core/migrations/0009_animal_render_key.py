@@ -0,0 +1,23 @@
+# Generated by Django 5.0.8 on 2026-10-18 13:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_media_metadata'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='animal',
+            name='render_key',
+            field=models.CharField(blank=True, default='', editable=False, help_text='İşlenmiş videoyu üreten girdilerin ve ayarların özeti. Değişmediyse video yeniden işlenmez.', max_length=64, verbose_name='İşleme Anahtarı'),
+        ),
+        migrations.AddField(
+            model_name='animal',
+            name='render_key_parts',
+            field=models.JSONField(blank=True, default=dict, editable=False, verbose_name='İşleme Anahtarı Girdileri'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.8 on 2026-10-18 11:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_animal_render_key'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='animal',
+            name='queued_at',
+            field=models.DateTimeField(blank=True, editable=False, help_text='Video işleme kuyruğuna alındığı an. Bir işçi videoyu almadan tekrar kuyruğa eklenmez.', null=True, verbose_name='Kuyruğa Alınma Tarihi'),
+        ),
+    ]
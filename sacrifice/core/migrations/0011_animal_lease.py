@@ -0,0 +1,38 @@
+# Generated by Django 5.0.8 on 2026-10-18 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_animal_queued_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='animal',
+            name='attempts',
+            field=models.PositiveSmallIntegerField(default=0, editable=False, help_text='İşçisi yanıt vermeyi bıraktığı için geri alınan işleme sayısı.', verbose_name='Yarım Kalan Deneme'),
+        ),
+        migrations.AddField(
+            model_name='animal',
+            name='lease_heartbeat_at',
+            field=models.DateTimeField(blank=True, editable=False, help_text='İşçinin işlemeye devam ettiğini bildirdiği son an. Sinyal kesilirse video tekrar kuyruğa alınır.', null=True, verbose_name='Son Sinyal'),
+        ),
+        migrations.AddField(
+            model_name='animal',
+            name='lease_owner',
+            field=models.CharField(blank=True, default='', editable=False, help_text='Videoyu işlemekte olan işçi.', max_length=255, verbose_name='İşleyen İşçi'),
+        ),
+        migrations.AddField(
+            model_name='animal',
+            name='lease_started_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True, verbose_name='İşleme Başlangıcı'),
+        ),
+        migrations.AddField(
+            model_name='animal',
+            name='retry_after',
+            field=models.DateTimeField(blank=True, editable=False, help_text='Geri alınan video bu andan önce otomatik olarak işlenmez.', null=True, verbose_name='Tekrar Deneme Zamanı'),
+        ),
+    ]
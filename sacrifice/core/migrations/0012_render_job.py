@@ -0,0 +1,52 @@
+# Generated by Django 5.0.8 on 2026-10-18 12:04
+
+import django.db.models.deletion
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_animal_lease'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RenderJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('uuid', models.UUIDField(db_index=True, default=uuid.uuid4, editable=False, unique=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('status', models.PositiveSmallIntegerField(choices=[(1, 'Çalışıyor'), (2, 'Başarılı'), (3, 'Hata'), (4, 'Atlandı'), (5, 'Ertelendi'), (6, 'Yarım Kaldı')], default=1, verbose_name='Durum')),
+                ('attempt', models.PositiveSmallIntegerField(default=1, verbose_name='Deneme')),
+                ('queue', models.CharField(blank=True, default='', max_length=63, verbose_name='Kuyruk')),
+                ('worker', models.CharField(blank=True, default='', max_length=255, verbose_name='İşçi')),
+                ('engine', models.CharField(blank=True, choices=[('moviepy', 'MoviePy'), ('ffmpeg', 'FFmpeg')], default='', max_length=15, verbose_name='İşleme Motoru')),
+                ('encoder_profile', models.JSONField(blank=True, default=dict, verbose_name='Kodlama Profili')),
+                ('queued_at', models.DateTimeField(blank=True, null=True, verbose_name='Kuyruğa Alınma')),
+                ('started_at', models.DateTimeField(verbose_name='Başlangıç')),
+                ('finished_at', models.DateTimeField(blank=True, null=True, verbose_name='Bitiş')),
+                ('wait_seconds', models.FloatField(blank=True, null=True, verbose_name='Kuyrukta Bekleme (sn)')),
+                ('duration_seconds', models.FloatField(blank=True, null=True, verbose_name='Toplam Süre (sn)')),
+                ('probe_seconds', models.FloatField(blank=True, null=True, verbose_name='İnceleme (sn)')),
+                ('load_seconds', models.FloatField(blank=True, null=True, verbose_name='Yükleme (sn)')),
+                ('composite_seconds', models.FloatField(blank=True, null=True, verbose_name='Birleştirme (sn)')),
+                ('encode_seconds', models.FloatField(blank=True, null=True, verbose_name='Kodlama (sn)')),
+                ('publish_seconds', models.FloatField(blank=True, null=True, verbose_name='Yayınlama (sn)')),
+                ('input_bytes', models.PositiveBigIntegerField(blank=True, null=True, verbose_name='Girdi Boyutu')),
+                ('output_bytes', models.PositiveBigIntegerField(blank=True, null=True, verbose_name='Çıktı Boyutu')),
+                ('error', models.TextField(blank=True, default='', verbose_name='Hata')),
+                ('animal', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='render_jobs', to='core.animal', verbose_name='Hayvan')),
+                ('season', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='render_jobs', to='core.season', verbose_name='Sezon')),
+            ],
+            options={
+                'verbose_name': 'İşleme Kaydı',
+                'verbose_name_plural': 'İşleme Kayıtları',
+                'ordering': ['-started_at'],
+                'abstract': False,
+                'indexes': [models.Index(fields=['season', 'status', 'finished_at'], name='render_job_season_finished'), models.Index(fields=['status', 'finished_at'], name='render_job_status_finished'), models.Index(fields=['animal', 'started_at'], name='render_job_animal_started')],
+            },
+        ),
+    ]
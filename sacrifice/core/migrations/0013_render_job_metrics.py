@@ -0,0 +1,23 @@
+# Generated by Django 5.0.8 on 2026-10-18 12:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0012_render_job'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='renderjob',
+            name='error_type',
+            field=models.CharField(blank=True, default='', max_length=127, verbose_name='Hata Türü'),
+        ),
+        migrations.AddField(
+            model_name='renderjob',
+            name='frames',
+            field=models.PositiveIntegerField(blank=True, null=True, verbose_name='Kare Sayısı'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.8 on 2026-10-18 12:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0013_render_job_metrics'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='animal',
+            name='media_changed_at',
+            field=models.DateTimeField(blank=True, editable=False, help_text='Video veya kapak işlenirken değiştiyse işleme bittiğinde video tekrar kuyruğa alınır.', null=True, verbose_name='İşlenirken Değişme Tarihi'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.8 on 2026-10-18 13:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0014_animal_media_changed_at'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='renderjob',
+            name='status',
+            field=models.PositiveSmallIntegerField(choices=[(1, 'Çalışıyor'), (2, 'Başarılı'), (3, 'Hata'), (4, 'Atlandı'), (5, 'Ertelendi'), (6, 'Yarım Kaldı'), (7, 'Yenisi Kuyrukta')], default=1, verbose_name='Durum'),
+        ),
+    ]
@@ -9,8 +9,9 @@ from django.core.files import File
 from PIL import Image, ImageCms
 from phonenumber_field.modelfields import PhoneNumberField
 
-from .enums import ShareType, LogoPosition, AnimalStatus
-from .validators import FileSizeValidator
+from .enums import ShareType, LogoPosition, AnimalStatus, RenderEngine, RenderJobStatus
+from .validators import FileSizeValidator, MediaProbeValidator
+from .metadata import MediaMetadataService
 from .utils import (year_choices, current_year, animal_video_path_original, animal_video_path_processed,
                     animal_video_path_cover)
 
@@ -25,6 +26,35 @@ class BaseModel(models.Model):
         ordering = ['-created_at']
 
 
+class MediaMetadataMixin(models.Model):
+    media_fields = ()
+
+    media_metadata = models.JSONField(
+        _('Medya Bilgileri'),
+        default=dict,
+        blank=True,
+        editable=False,
+        help_text=_('Yüklenen dosyaların süre, çözünürlük, fps, codec, rotasyon ve bitrate bilgileri.')
+    )
+
+    class Meta:
+        abstract = True
+
+    def get_media_columns(self) -> dict:
+        return {}
+
+    def sync_media_metadata(self, probed=None):
+        """Probes the files whose name changed, probed holds the results MediaProbeValidator already has."""
+        stale_fields = MediaMetadataService.stale_fields(self, self.media_fields)
+        if not stale_fields:
+            return
+        self.media_metadata = MediaMetadataService.collect(self, stale_fields, probed)
+        values = {'media_metadata': self.media_metadata, **self.get_media_columns()}
+        for name, value in values.items():
+            setattr(self, name, value)
+        type(self).objects.filter(pk=self.pk).update(**values)
+
+
 class ProcessingSettings(models.Model):
     auto_process = models.BooleanField(
         _('Otomatik İşleme'),
@@ -39,7 +69,8 @@ class ProcessingSettings(models.Model):
         null=True,
         validators=[
             FileExtensionValidator(allowed_extensions=['MOV', 'avi', 'mp4', 'webm']),
-            FileSizeValidator(100)
+            FileSizeValidator(100),
+            MediaProbeValidator('intro')
         ],
         help_text=_('Giriş videosu. Maksimum dosya boyutu 100 MB.')
     )
@@ -50,7 +81,8 @@ class ProcessingSettings(models.Model):
         null=True,
         validators=[
             FileExtensionValidator(allowed_extensions=['MOV', 'avi', 'mp4', 'webm']),
-            FileSizeValidator(100)
+            FileSizeValidator(100),
+            MediaProbeValidator('outro')
         ],
         help_text=_('Çıkış videosu. Maksimum dosya boyutu 100 MB.')
     )
@@ -108,24 +140,41 @@ class ProcessingSettings(models.Model):
         default=20,
         help_text=_('Logo üst kenar boşluğu')
     )
+    render_engine = models.CharField(
+        _('İşleme Motoru'),
+        max_length=15,
+        choices=RenderEngine,
+        default=RenderEngine.MOVIEPY,
+        help_text=_('Videoların işlenmesinde kullanılacak motor. '
+                    'FFmpeg tek bir ffmpeg işlemiyle çok daha hızlı işler.')
+    )
 
     class Meta:
         abstract = True
 
 
-class Season(BaseModel, ProcessingSettings):
+class Season(BaseModel, ProcessingSettings, MediaMetadataMixin):
+    media_fields = ('intro', 'outro', 'frame', 'logo')
+
     name = models.CharField(_('İsim'), max_length=127)
     year = models.PositiveIntegerField(_('Yıl'), choices=year_choices(), default=current_year)
 
     def __str__(self):
         return f'{self.year} ({self.name})'
 
+    def save(self, *args, **kwargs):
+        probed = MediaMetadataService.probed_uploads(self, self.media_fields)
+        super().save(*args, **kwargs)
+        self.sync_media_metadata(probed)
+
     class Meta(BaseModel.Meta):
         verbose_name = _('Sezon')
         verbose_name_plural = _('Sezonlar')
 
 
-class Animal(BaseModel):
+class Animal(BaseModel, MediaMetadataMixin):
+    media_fields = ('original_video', 'cover')
+
     season = models.ForeignKey(
         Season,
         on_delete=models.PROTECT,
@@ -162,7 +211,8 @@ class Animal(BaseModel):
         null=True,
         validators=[
             FileExtensionValidator(allowed_extensions=['mp4', 'mov']),
-            FileSizeValidator(100)
+            FileSizeValidator(100),
+            MediaProbeValidator('original_video')
         ],
         help_text=_('Orijinal kurban kesim videosu. Maksimum dosya boyutu 100 MB.'),
     )
@@ -178,6 +228,78 @@ class Animal(BaseModel):
         ],
         help_text=_('İşlenmiş kurban kesim videosu. Maksimum dosya boyutu 100 MB.')
     )
+    render_key = models.CharField(
+        _('İşleme Anahtarı'),
+        max_length=64,
+        blank=True,
+        default='',
+        editable=False,
+        help_text=_('İşlenmiş videoyu üreten girdilerin ve ayarların özeti. Değişmediyse video yeniden işlenmez.')
+    )
+    render_key_parts = models.JSONField(
+        _('İşleme Anahtarı Girdileri'),
+        default=dict,
+        blank=True,
+        editable=False,
+    )
+    video_duration = models.FloatField(_('Video Süresi'), blank=True, null=True, editable=False)
+    video_width = models.PositiveIntegerField(_('Video Genişliği'), blank=True, null=True, editable=False)
+    video_height = models.PositiveIntegerField(_('Video Yüksekliği'), blank=True, null=True, editable=False)
+    video_fps = models.FloatField(_('Video FPS'), blank=True, null=True, editable=False)
+    video_codec = models.CharField(_('Video Codec'), max_length=31, blank=True, default='', editable=False)
+    audio_codec = models.CharField(_('Ses Codec'), max_length=31, blank=True, default='', editable=False)
+    video_rotation = models.PositiveSmallIntegerField(_('Video Rotasyonu'), blank=True, null=True, editable=False)
+    video_bitrate = models.PositiveBigIntegerField(_('Video Bitrate'), blank=True, null=True, editable=False)
+    render_plan = models.JSONField(
+        _('İşleme Planı'),
+        blank=True,
+        null=True,
+        editable=False,
+        help_text=_('Son işlemede girdilerin incelenmesiyle oluşturulan çıktı çözünürlüğü, süre ve uyarılar.')
+    )
+    queued_at = models.DateTimeField(
+        _('Kuyruğa Alınma Tarihi'),
+        blank=True,
+        null=True,
+        editable=False,
+        help_text=_('Video işleme kuyruğuna alındığı an. Bir işçi videoyu almadan tekrar kuyruğa eklenmez.')
+    )
+    lease_owner = models.CharField(
+        _('İşleyen İşçi'),
+        max_length=255,
+        blank=True,
+        default='',
+        editable=False,
+        help_text=_('Videoyu işlemekte olan işçi.')
+    )
+    lease_started_at = models.DateTimeField(_('İşleme Başlangıcı'), blank=True, null=True, editable=False)
+    lease_heartbeat_at = models.DateTimeField(
+        _('Son Sinyal'),
+        blank=True,
+        null=True,
+        editable=False,
+        help_text=_('İşçinin işlemeye devam ettiğini bildirdiği son an. Sinyal kesilirse video tekrar kuyruğa alınır.')
+    )
+    attempts = models.PositiveSmallIntegerField(
+        _('Yarım Kalan Deneme'),
+        default=0,
+        editable=False,
+        help_text=_('İşçisi yanıt vermeyi bıraktığı için geri alınan işleme sayısı.')
+    )
+    retry_after = models.DateTimeField(
+        _('Tekrar Deneme Zamanı'),
+        blank=True,
+        null=True,
+        editable=False,
+        help_text=_('Geri alınan video bu andan önce otomatik olarak işlenmez.')
+    )
+    media_changed_at = models.DateTimeField(
+        _('İşlenirken Değişme Tarihi'),
+        blank=True,
+        null=True,
+        editable=False,
+        help_text=_('Video veya kapak işlenirken değiştiyse işleme bittiğinde video tekrar kuyruğa alınır.')
+    )
 
     def __str__(self):
         return f'{self.season.year}/{self.code}'
@@ -190,9 +312,24 @@ class Animal(BaseModel):
         ]
 
     def save(self, *args, **kwargs):
+        probed = MediaMetadataService.probed_uploads(self, self.media_fields)
         if self.cover:
             self.cover = self.convert_image_to_srgb(self.cover)
         super().save(*args, **kwargs)
+        self.sync_media_metadata(probed)
+
+    def get_media_columns(self) -> dict:
+        video = MediaMetadataService.known_metadata(self, 'original_video') or {}
+        return {
+            'video_duration': video.get('duration'),
+            'video_width': video.get('width'),
+            'video_height': video.get('height'),
+            'video_fps': video.get('fps'),
+            'video_codec': video.get('video_codec') or '',
+            'audio_codec': video.get('audio_codec') or '',
+            'video_rotation': video.get('rotation'),
+            'video_bitrate': video.get('bitrate'),
+        }
 
     @staticmethod
     def convert_image_to_srgb(image_field):
@@ -225,3 +362,52 @@ class Share(BaseModel):
     class Meta(BaseModel.Meta):
         verbose_name = _('Hisse')
         verbose_name_plural = _('Hisseler')
+
+
+class RenderJob(BaseModel):
+    animal = models.ForeignKey(Animal, on_delete=models.CASCADE, related_name='render_jobs', verbose_name=_('Hayvan'))
+    season = models.ForeignKey(
+        Season,
+        on_delete=models.SET_NULL,
+        null=True,
+        related_name='render_jobs',
+        verbose_name=_('Sezon')
+    )
+    status = models.PositiveSmallIntegerField(
+        default=RenderJobStatus.RUNNING,
+        choices=RenderJobStatus,
+        verbose_name=_('Durum')
+    )
+    attempt = models.PositiveSmallIntegerField(_('Deneme'), default=1)
+    queue = models.CharField(_('Kuyruk'), max_length=63, blank=True, default='')
+    worker = models.CharField(_('İşçi'), max_length=255, blank=True, default='')
+    engine = models.CharField(_('İşleme Motoru'), max_length=15, choices=RenderEngine, blank=True, default='')
+    encoder_profile = models.JSONField(_('Kodlama Profili'), default=dict, blank=True)
+    queued_at = models.DateTimeField(_('Kuyruğa Alınma'), blank=True, null=True)
+    started_at = models.DateTimeField(_('Başlangıç'))
+    finished_at = models.DateTimeField(_('Bitiş'), blank=True, null=True)
+    wait_seconds = models.FloatField(_('Kuyrukta Bekleme (sn)'), blank=True, null=True)
+    duration_seconds = models.FloatField(_('Toplam Süre (sn)'), blank=True, null=True)
+    probe_seconds = models.FloatField(_('İnceleme (sn)'), blank=True, null=True)
+    load_seconds = models.FloatField(_('Yükleme (sn)'), blank=True, null=True)
+    composite_seconds = models.FloatField(_('Birleştirme (sn)'), blank=True, null=True)
+    encode_seconds = models.FloatField(_('Kodlama (sn)'), blank=True, null=True)
+    publish_seconds = models.FloatField(_('Yayınlama (sn)'), blank=True, null=True)
+    input_bytes = models.PositiveBigIntegerField(_('Girdi Boyutu'), blank=True, null=True)
+    output_bytes = models.PositiveBigIntegerField(_('Çıktı Boyutu'), blank=True, null=True)
+    frames = models.PositiveIntegerField(_('Kare Sayısı'), blank=True, null=True)
+    error = models.TextField(_('Hata'), blank=True, default='')
+    error_type = models.CharField(_('Hata Türü'), max_length=127, blank=True, default='')
+
+    def __str__(self):
+        return f'{self.animal} #{self.attempt}'
+
+    class Meta(BaseModel.Meta):
+        verbose_name = _('İşleme Kaydı')
+        verbose_name_plural = _('İşleme Kayıtları')
+        ordering = ['-started_at']
+        indexes = [
+            models.Index(fields=['season', 'status', 'finished_at'], name='render_job_season_finished'),
+            models.Index(fields=['status', 'finished_at'], name='render_job_status_finished'),
+            models.Index(fields=['animal', 'started_at'], name='render_job_animal_started'),
+        ]
@@ -0,0 +1,110 @@
+import os
+import json
+import hashlib
+import logging
+from pathlib import Path
+
+import numpy as np
+from django.conf import settings
+from PIL import Image
+
+from .utils import create_temp_video_path, file_digest
+
+logger = logging.getLogger(__name__)
+
+
+class OverlayService:
+    """
+    Flattens the season frame and logo into a single RGBA layer at the clip size.
+    The layer is rasterized once per season and clip size, so rendering needs one blend per frame
+    and never resizes the images again.
+    """
+    @staticmethod
+    def cache_dir() -> Path:
+        return Path(settings.VIDEO_CACHE_ROOT) / 'overlays'
+
+    @staticmethod
+    def overlay_key(size, frame_path, logo_path, logo_height, logo_position, logo_margin_top, logo_margin_right,
+                    logo_margin_bottom, logo_margin_left) -> str:
+        key = json.dumps([
+            list(size),
+            file_digest(frame_path) if frame_path else None,
+            file_digest(logo_path) if logo_path else None,
+            logo_height,
+            list(logo_position) if isinstance(logo_position, (tuple, list)) else logo_position,
+            logo_margin_top, logo_margin_right, logo_margin_bottom, logo_margin_left,
+        ])
+        return hashlib.sha256(key.encode()).hexdigest()[:32]
+
+    @staticmethod
+    def position(position, size, content_size) -> tuple[int, int]:
+        # Mirrors how MoviePy places a clip with a string position
+        horizontal, vertical = position if isinstance(position, (tuple, list)) else (position, position)
+        x = {'left': 0, 'right': size[0] - content_size[0], 'center': (size[0] - content_size[0]) // 2}[horizontal]
+        y = {'top': 0, 'bottom': size[1] - content_size[1], 'center': (size[1] - content_size[1]) // 2}[vertical]
+        return x, y
+
+    @staticmethod
+    def resize_to_height(image, height) -> Image.Image:
+        width = max(1, round(image.width * height / image.height))
+        return image.resize((width, height), Image.LANCZOS)
+
+    @staticmethod
+    def render_overlay(size, frame_path, logo_path, logo_height, logo_position, logo_margin_top, logo_margin_right,
+                       logo_margin_bottom, logo_margin_left) -> Image.Image:
+        overlay = Image.new('RGBA', size, (0, 0, 0, 0))
+
+        if frame_path:
+            with Image.open(frame_path) as image:
+                frame = OverlayService.resize_to_height(image.convert('RGBA'), size[1])
+            layer = Image.new('RGBA', size, (0, 0, 0, 0))
+            layer.paste(frame, OverlayService.position('center', size, frame.size))
+            overlay = Image.alpha_composite(overlay, layer)
+
+        if logo_path:
+            with Image.open(logo_path) as image:
+                logo = OverlayService.resize_to_height(image.convert('RGBA'), logo_height or size[1])
+            margined_size = (
+                logo.width + logo_margin_left + logo_margin_right,
+                logo.height + logo_margin_top + logo_margin_bottom
+            )
+            x, y = OverlayService.position(logo_position, size, margined_size)
+            layer = Image.new('RGBA', size, (0, 0, 0, 0))
+            layer.paste(logo, (x + logo_margin_left, y + logo_margin_top))
+            overlay = Image.alpha_composite(overlay, layer)
+
+        return overlay
+
+    @staticmethod
+    def get_overlay(size, frame_path, logo_path, logo_height, logo_position, logo_margin_top, logo_margin_right,
+                    logo_margin_bottom, logo_margin_left) -> str | None:
+        """Returns the path of the cached overlay PNG, rendering it on the first use."""
+        if not frame_path and not logo_path:
+            return None
+
+        args = (frame_path, logo_path, logo_height, logo_position, logo_margin_top, logo_margin_right,
+                logo_margin_bottom, logo_margin_left)
+        cache_dir = OverlayService.cache_dir()
+        overlay_path = cache_dir / f'{OverlayService.overlay_key(size, *args)}.png'
+        if overlay_path.exists():
+            logger.info(f'overlay_cache - hit: {overlay_path}')
+            return str(overlay_path)
+
+        logger.info(f'overlay_cache - miss: {overlay_path}')
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        partial_path = create_temp_video_path('.png', directory=cache_dir)
+        try:
+            OverlayService.render_overlay(size, *args).save(partial_path, format='PNG')
+            os.replace(partial_path, overlay_path)
+        finally:
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
+        return str(overlay_path)
+
+    @staticmethod
+    def load_premultiplied(overlay_path) -> tuple[np.ndarray, np.ndarray]:
+        """Returns the overlay as premultiplied RGB and alpha, both float32 in the 0-255 and 0-1 ranges."""
+        with Image.open(overlay_path) as image:
+            rgba = np.asarray(image.convert('RGBA'), dtype=np.float32)
+        alpha = rgba[:, :, 3:] / 255
+        return rgba[:, :, :3] * alpha, alpha
@@ -0,0 +1,192 @@
+import logging
+from dataclasses import dataclass, asdict
+
+from django.conf import settings
+
+from .probe import ProbeService, ProbeError
+from .utils import fit_size
+
+logger = logging.getLogger(__name__)
+
+COVER_DURATION = 2
+
+
+class RenderPlanError(Exception):
+    pass
+
+
+class RenderBudgetError(RenderPlanError):
+    """The render needs more memory than a job of this worker may ever use."""
+
+
+class RenderDeferredError(Exception):
+    """The render fits the job budget but not the memory that is free right now."""
+
+
+@dataclass(frozen=True)
+class InputPlan:
+    role: str
+    path: str
+    width: int
+    height: int
+    duration: float | None = None
+    fps: float | None = None
+    has_audio: bool = False
+    # none, scale, pad or overlay
+    action: str = 'none'
+
+    @property
+    def size(self) -> tuple[int, int]:
+        return self.width, self.height
+
+    def frames(self, fps) -> int:
+        """Frames of the segment in the output, both engines trim or pad the segment to exactly this many."""
+        return round(self.duration * fps)
+
+
+@dataclass(frozen=True)
+class RenderPlan:
+    width: int
+    height: int
+    fps: int
+    sample_rate: int
+    duration: float
+    inputs: tuple[InputPlan, ...]
+    warnings: tuple[str, ...] = ()
+
+    @property
+    def size(self) -> tuple[int, int]:
+        return self.width, self.height
+
+    @property
+    def frames(self) -> int:
+        # Segments are rounded one by one, a segment boundary never gains or loses a frame
+        return sum(item.frames(self.fps) for item in self.inputs if item.role in RenderPlanner.segment_roles)
+
+    def input(self, role) -> InputPlan | None:
+        return next((item for item in self.inputs if item.role == role), None)
+
+    def to_dict(self) -> dict:
+        return {**asdict(self), 'frames': self.frames}
+
+
+class RenderPlanner:
+    """
+    Probes every input of a render up front and decides the output before any clip is opened.
+    The canvas follows the season intro/outro so the branding keeps its shape, inputs with another
+    aspect ratio are scaled to fit and padded instead of being stretched.
+    """
+    segment_roles = ('intro', 'cover', 'video', 'outro')
+    video_roles = ('intro', 'video', 'outro')
+
+    @staticmethod
+    def even(value) -> int:
+        return max(2, int(value) // 2 * 2)
+
+    @staticmethod
+    def canvas_size(reference_size) -> tuple[int, int]:
+        max_width, max_height = settings.VIDEO_MAX_SIZE
+        width, height = reference_size
+        if width > max_width or height > max_height:
+            width, height = fit_size(reference_size, (max_width, max_height))
+        return RenderPlanner.even(width), RenderPlanner.even(height)
+
+    @staticmethod
+    def action(source_size, size) -> str:
+        if tuple(source_size) == tuple(size):
+            return 'none'
+        return 'scale' if fit_size(source_size, size) == tuple(size) else 'pad'
+
+    @staticmethod
+    def probe_video(role, path, warnings, known=None) -> InputPlan:
+        try:
+            media = known or ProbeService.probe(path)
+        except ProbeError as e:
+            raise RenderPlanError(f'{role}: {e}') from e
+        if media['duration'] <= 0:
+            raise RenderPlanError(f'{role}: {path} has no duration')
+        if not media['width'] or not media['height']:
+            raise RenderPlanError(f'{role}: {path} has no picture size')
+        if media['fps'] <= 0:
+            warnings.append(f'{role}: frame rate is unknown')
+        return InputPlan(role, str(path), media['width'], media['height'], media['duration'], media['fps'],
+                         media['has_audio'])
+
+    @staticmethod
+    def probe_image(role, path, duration=None, known=None) -> InputPlan:
+        try:
+            width, height = (known['width'], known['height']) if known else ProbeService.image_size(path)
+        except ProbeError as e:
+            raise RenderPlanError(f'{role}: {e}') from e
+        return InputPlan(role, str(path), width, height, duration)
+
+    @staticmethod
+    def plan(video_path, cover_path=None, intro_path=None, outro_path=None, frame_path=None,
+             logo_path=None, known=None) -> RenderPlan:
+        """known maps roles to metadata stored at upload time, those inputs are not probed again."""
+        profile = settings.VIDEO_ENCODER_PROFILE
+        known = known or {}
+        warnings = []
+        paths = {
+            'intro': intro_path,
+            'cover': cover_path,
+            'video': video_path,
+            'outro': outro_path,
+            'frame': frame_path,
+            'logo': logo_path,
+        }
+        probed = {}
+        for role, path in paths.items():
+            if not path and role != 'video':
+                continue
+            if role in RenderPlanner.video_roles:
+                probed[role] = RenderPlanner.probe_video(role, path, warnings, known.get(role))
+            else:
+                duration = COVER_DURATION if role == 'cover' else None
+                probed[role] = RenderPlanner.probe_image(role, path, duration, known.get(role))
+
+        reference = probed.get('intro') or probed.get('outro') or probed['video']
+        size = RenderPlanner.canvas_size(reference.size)
+
+        inputs = []
+        for role, item in probed.items():
+            if item is None:
+                continue
+            if role in RenderPlanner.segment_roles:
+                action = RenderPlanner.action(item.size, size)
+                inner_size = fit_size(item.size, size)
+                if inner_size[0] > item.width * 2 or inner_size[1] > item.height * 2:
+                    warnings.append(f'{role}: {item.width}x{item.height} is upscaled to {size[0]}x{size[1]}')
+            else:
+                action = 'overlay'
+            inputs.append(InputPlan(**{**asdict(item), 'action': action}))
+
+        duration = sum(item.duration for item in inputs if item.role in RenderPlanner.segment_roles)
+        plan = RenderPlan(
+            width=size[0],
+            height=size[1],
+            fps=profile['fps'],
+            sample_rate=profile['audio_sample_rate'],
+            duration=round(duration, 3),
+            inputs=tuple(inputs),
+            warnings=tuple(warnings),
+        )
+        logger.info(f'render_plan - {plan.width}x{plan.height} {plan.duration}s {plan.frames} frames '
+                    f'warnings: {list(plan.warnings)}')
+        return plan
+
+    @staticmethod
+    def estimate_memory(plan: RenderPlan, workers=1) -> int:
+        """
+        Rough peak memory of a render in bytes.
+        Every render process pays the interpreter and library cost and keeps a number of decoded frames of the
+        largest input or the canvas in reader buffers, resize and overlay copies and the encoder lookahead.
+        Longer clips split into more chunks, up to the given number of chunk processes.
+        """
+        largest = max([plan.width * plan.height] + [item.width * item.height for item in plan.inputs])
+        per_process = settings.VIDEO_JOB_BASE_MEMORY_BYTES + largest * 3 * settings.VIDEO_JOB_MEMORY_FRAMES
+        gop = settings.VIDEO_ENCODER_PROFILE['gop']
+        chunks = min(workers, -(-plan.frames // gop))
+        # The parent keeps its own readers open while the chunks encode
+        processes = 1 + chunks if chunks > 1 else 1
+        return per_process * processes
@@ -0,0 +1,83 @@
+import json
+import logging
+import subprocess
+
+from django.conf import settings
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+
+class ProbeError(Exception):
+    pass
+
+
+class ProbeService:
+    """Reads media facts from the file headers with ffprobe and PIL, without decoding any frame."""
+    @staticmethod
+    def frame_rate(value) -> float:
+        numerator, _, denominator = (value or '0/0').partition('/')
+        if not denominator:
+            return float(numerator)
+        return float(numerator) / float(denominator) if float(denominator) else 0.0
+
+    @staticmethod
+    def rotation(stream) -> int:
+        rotation = stream.get('tags', {}).get('rotate')
+        for side_data in stream.get('side_data_list', []):
+            if 'rotation' in side_data:
+                rotation = side_data['rotation']
+        return int(float(rotation or 0)) % 360
+
+    @staticmethod
+    def run(path, *args) -> str:
+        """ffprobe output for the file, the only place this project starts ffprobe."""
+        command = [settings.FFPROBE_BINARY, '-v', 'error', *args, str(path)]
+        result = subprocess.run(command, capture_output=True, text=True)
+        if result.returncode != 0:
+            raise ProbeError(f'{path} could not be read: {result.stderr.strip()}')
+        return result.stdout
+
+    @staticmethod
+    def probe(path) -> dict:
+        data = json.loads(ProbeService.run(path, '-print_format', 'json', '-show_format', '-show_streams') or '{}')
+        streams = data.get('streams', [])
+        video = next((s for s in streams if s.get('codec_type') == 'video'), None)
+        audio = next((s for s in streams if s.get('codec_type') == 'audio'), None)
+        if video is None:
+            raise ProbeError(f'No video stream found in {path}')
+
+        rotation = ProbeService.rotation(video)
+        width, height = int(video.get('width', 0)), int(video.get('height', 0))
+        if rotation % 180:
+            # ffmpeg and MoviePy rotate on decode, so the displayed size is what the renderer will see
+            width, height = height, width
+
+        container = data.get('format', {})
+        return {
+            'width': width,
+            'height': height,
+            'duration': float(video.get('duration') or container.get('duration') or 0),
+            'fps': ProbeService.frame_rate(video.get('avg_frame_rate') or video.get('r_frame_rate')),
+            'rotation': rotation,
+            'video_codec': video.get('codec_name'),
+            'audio_codec': audio.get('codec_name') if audio else None,
+            'sample_rate': int(audio['sample_rate']) if audio and audio.get('sample_rate') else None,
+            'bitrate': int(container['bit_rate']) if container.get('bit_rate') else None,
+            'has_audio': audio is not None,
+        }
+
+    @staticmethod
+    def frame_count(path) -> int:
+        """Number of video frames in the file, counted from the packets instead of trusting the header."""
+        output = ProbeService.run(path, '-select_streams', 'v:0', '-count_packets',
+                                  '-show_entries', 'stream=nb_read_packets', '-of', 'csv=p=0')
+        return int(output.strip() or 0)
+
+    @staticmethod
+    def image_size(path) -> tuple[int, int]:
+        try:
+            with Image.open(path) as image:
+                return image.size
+        except (OSError, ValueError) as e:
+            raise ProbeError(f'{path} could not be read: {e}') from e
@@ -0,0 +1,135 @@
+import time
+import logging
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+from proglog import ProgressBarLogger
+
+logger = logging.getLogger(__name__)
+
+render_progress = ContextVar('render_progress', default=None)
+
+
+class FrameReporter:
+    """
+    Adds encoded frames to the shared counter of a render, at most once per VIDEO_PROGRESS_INTERVAL.
+    It only holds the animal id, so it can be handed to the chunk processes of a parallel render.
+    """
+    def __init__(self, animal_id):
+        self.animal_id = animal_id
+        self.pending = 0
+        self.flushed_at = time.monotonic()
+
+    def add(self, frames):
+        self.pending += frames
+        if time.monotonic() - self.flushed_at >= settings.VIDEO_PROGRESS_INTERVAL:
+            self.flush()
+
+    def flush(self):
+        if self.pending:
+            try:
+                RenderProgress.add_frames(self.animal_id, self.pending)
+            except Exception as e:
+                # Progress is informational, a cache outage must not fail the render
+                logger.warning(f'render_progress - {self.animal_id}: {e}')
+        self.pending = 0
+        self.flushed_at = time.monotonic()
+
+
+class MoviePyProgressLogger(ProgressBarLogger):
+    """proglog logger that reports the frames MoviePy writes, the audio bar is ignored."""
+    def __init__(self, reporter: FrameReporter):
+        super().__init__(ignored_bars=('chunk',), logged_bars=False,
+                         min_time_interval=settings.VIDEO_PROGRESS_INTERVAL)
+        self.reporter = reporter
+
+    def bars_callback(self, bar, attr, value, old_value=None):
+        if bar == 't' and attr == 'index':
+            self.reporter.add(max(value, 0) - max(old_value, 0))
+
+
+class RenderProgress:
+    """
+    Live progress of a running render in the cache, read by the admin and the progress endpoint.
+    The render sets its stage and the number of frames it will encode, engines report encoded frames through a
+    FrameReporter. Encode fps and ETA are derived from the counter when it is read. Entries expire like leases,
+    so a dead worker's progress disappears on its own.
+    """
+    def __init__(self, animal_id):
+        self.animal_id = animal_id
+        self.token = None
+
+    @staticmethod
+    def state_key(animal_id) -> str:
+        return f'render_progress:{animal_id}'
+
+    @staticmethod
+    def frames_key(animal_id) -> str:
+        return f'render_progress:{animal_id}:frames'
+
+    @staticmethod
+    def current():
+        return render_progress.get()
+
+    def __enter__(self):
+        # A worker that died rendering the same animal may have left its entry behind
+        cache.delete(RenderProgress.state_key(self.animal_id))
+        self.stage('preparing')
+        self.token = render_progress.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        render_progress.reset(self.token)
+        cache.delete_many([RenderProgress.state_key(self.animal_id), RenderProgress.frames_key(self.animal_id)])
+
+    def stage(self, name, total_frames=None):
+        now = time.time()
+        previous = cache.get(RenderProgress.state_key(self.animal_id)) or {}
+        state = {'stage': name, 'total_frames': total_frames, 'started_at': previous.get('started_at', now),
+                 'stage_started_at': now}
+        values = {RenderProgress.state_key(self.animal_id): state, RenderProgress.frames_key(self.animal_id): 0}
+        cache.set_many(values, timeout=settings.VIDEO_LEASE_TIMEOUT)
+
+    def reporter(self) -> FrameReporter:
+        return FrameReporter(self.animal_id)
+
+    @staticmethod
+    def add_frames(animal_id, frames):
+        try:
+            cache.incr(RenderProgress.frames_key(animal_id), frames)
+        except ValueError:
+            # The render already finished or its entry expired
+            return
+        cache.touch(RenderProgress.state_key(animal_id), settings.VIDEO_LEASE_TIMEOUT)
+        cache.touch(RenderProgress.frames_key(animal_id), settings.VIDEO_LEASE_TIMEOUT)
+
+    @staticmethod
+    def get_many(animal_ids) -> dict[int, dict]:
+        keys = [key for animal_id in animal_ids
+                for key in (RenderProgress.state_key(animal_id), RenderProgress.frames_key(animal_id))]
+        values = cache.get_many(keys)
+        now = time.time()
+        progress = {}
+        for animal_id in animal_ids:
+            state = values.get(RenderProgress.state_key(animal_id))
+            if state is None:
+                continue
+            frames = values.get(RenderProgress.frames_key(animal_id)) or 0
+            total_frames = state['total_frames']
+            elapsed = now - state['stage_started_at']
+            fps = frames / elapsed if elapsed > 0 and frames else None
+            progress[animal_id] = {
+                'stage': state['stage'],
+                'frames': frames,
+                'total_frames': total_frames,
+                'percent': round(min(100.0, frames * 100 / total_frames), 1) if total_frames else None,
+                'fps': round(fps, 2) if fps else None,
+                'eta': round(max(0, total_frames - frames) / fps) if fps and total_frames else None,
+                'elapsed': round(now - state['started_at']),
+            }
+        return progress
+
+    @staticmethod
+    def get(animal_id) -> dict | None:
+        return RenderProgress.get_many([animal_id]).get(animal_id)
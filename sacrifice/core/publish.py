@@ -0,0 +1,89 @@
+import os
+import errno
+import shutil
+import logging
+from pathlib import Path
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+
+from .utils import create_temp_video_path, temp_directory
+
+logger = logging.getLogger(__name__)
+
+
+class PublishService:
+    """
+    Moves a rendered video to its final storage name without holding any database lock.
+    Engines render into VIDEO_SCRATCH_ROOT, which sits on the same filesystem as MEDIA_ROOT, so on local storage
+    the file is hardlinked into place without copying a byte. A copy next to the target and an atomic link
+    is the fallback across filesystems, remote storages get a regular storage.save().
+    """
+    @staticmethod
+    def scratch_dir() -> Path:
+        # The workspace of the running job when there is one, it lives under VIDEO_SCRATCH_ROOT as well
+        scratch_dir = Path(temp_directory.get() or settings.VIDEO_SCRATCH_ROOT)
+        scratch_dir.mkdir(parents=True, exist_ok=True)
+        return scratch_dir
+
+    @staticmethod
+    def file_mode(storage) -> int:
+        if storage.file_permissions_mode is not None:
+            return storage.file_permissions_mode
+        # Same mode Django gives to uploaded files, rendered temp files are created 0600
+        umask = os.umask(0)
+        os.umask(umask)
+        return 0o666 & ~umask
+
+    @staticmethod
+    def link_or_copy(source_path, target_path) -> int:
+        """Returns the number of bytes copied, 0 when the file was linked."""
+        try:
+            os.link(source_path, target_path)
+            return 0
+        except OSError as e:
+            if e.errno == errno.EEXIST:
+                raise
+            logger.info(f'publish - hardlink is not possible ({e.strerror}), copying {source_path}')
+
+        partial_path = create_temp_video_path(directory=os.path.dirname(target_path))
+        try:
+            shutil.copyfile(source_path, partial_path)
+            # link instead of replace, so a name taken in the meantime is never overwritten
+            os.link(partial_path, target_path)
+        finally:
+            os.remove(partial_path)
+        return os.path.getsize(target_path)
+
+    @staticmethod
+    def publish(field_file, source_path, filename='processed_video.mp4') -> tuple[str, int]:
+        """Stores source_path under the field's upload_to name, returns the stored name and the bytes copied."""
+        field, storage = field_file.field, field_file.storage
+        name = field.generate_filename(field_file.instance, filename)
+
+        if not isinstance(storage, FileSystemStorage):
+            with open(source_path, 'rb') as f:
+                return storage.save(name, File(f), max_length=field.max_length), os.path.getsize(source_path)
+
+        while True:
+            name = storage.get_available_name(name, max_length=field.max_length)
+            target_path = storage.path(name)
+            os.makedirs(os.path.dirname(target_path), exist_ok=True)
+            try:
+                copied_bytes = PublishService.link_or_copy(source_path, target_path)
+                break
+            except FileExistsError:
+                # Another worker took the name between get_available_name and link
+                continue
+
+        os.chmod(target_path, PublishService.file_mode(storage))
+        logger.info(f'publish - {source_path} -> {name} ({copied_bytes} bytes copied)')
+        return name, copied_bytes
+
+    @staticmethod
+    def delete(storage, name):
+        try:
+            storage.delete(name)
+        except OSError as e:
+            logger.warning(f'publish - old file {name} could not be deleted: {e}')
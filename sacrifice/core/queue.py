@@ -0,0 +1,124 @@
+import logging
+from datetime import timedelta
+
+from celery import current_app
+from kombu.exceptions import ChannelError
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .enums import AnimalStatus, RenderQueue
+from .models import Animal
+
+logger = logging.getLogger(__name__)
+
+WAIT_STATS = ('count', 'total_ms', 'last_ms', 'max_ms')
+
+
+class RenderQueueService:
+    """
+    Enqueue ledger of the auto processing poller.
+    Animal.queued_at is set when an animal is sent to the broker and cleared when a worker claims it, so an animal
+    waiting in the queue is never sent again. Every tick only tops the queue up to what the workers can take,
+    a batch per worker slot. A mark older than VIDEO_QUEUE_TTL belongs to a lost message and is ignored.
+    It also keeps the depth and wait time metrics of the render queues.
+    """
+    @staticmethod
+    def worker_slots() -> int:
+        """Worker processes consuming the bulk queue, the poller's share of the workers."""
+        if settings.VIDEO_QUEUE_SLOTS:
+            return settings.VIDEO_QUEUE_SLOTS
+        inspect = current_app.control.inspect(timeout=1.0)
+        stats, active_queues = inspect.stats() or {}, inspect.active_queues() or {}
+        return sum(
+            worker.get('pool', {}).get('max-concurrency', 0)
+            for name, worker in stats.items()
+            if any(queue['name'] == RenderQueue.BULK for queue in active_queues.get(name, []))
+        )
+
+    @staticmethod
+    def stale_before():
+        return timezone.now() - timedelta(seconds=settings.VIDEO_QUEUE_TTL)
+
+    @staticmethod
+    def in_flight() -> int:
+        """Animals waiting in the broker or being rendered."""
+        return Animal.objects.filter(
+            Q(queued_at__gte=RenderQueueService.stale_before()) | Q(status=AnimalStatus.PROCESSING)
+        ).count()
+
+    @staticmethod
+    def free_capacity() -> int:
+        capacity = RenderQueueService.worker_slots() * settings.VIDEO_BATCH_SIZE
+        in_flight = RenderQueueService.in_flight()
+        logger.info(f'render_queue - capacity {capacity}, in flight {in_flight}')
+        return max(0, capacity - in_flight)
+
+    @staticmethod
+    def claimable(queryset):
+        """
+        Animals of the queryset that are not queued yet, locked for the claiming transaction.
+        A concurrent tick skips the rows this one is marking instead of queueing them again. Only the animal rows
+        are locked, a season joined by the queryset stays free for admin saves and keeps its animals claimable.
+        """
+        return queryset.filter(Q(queued_at__isnull=True) | Q(queued_at__lt=RenderQueueService.stale_before()))\
+            .select_for_update(skip_locked=True, of=('self',))
+
+    @staticmethod
+    def claim(queryset, limit) -> list[int]:
+        """Marks up to limit animals of the queryset that are not queued yet as queued, returns their ids."""
+        if limit <= 0:
+            return []
+        with transaction.atomic():
+            ids = list(RenderQueueService.claimable(queryset).values_list('id', flat=True)[:limit])
+            Animal.objects.filter(id__in=ids).update(queued_at=timezone.now())
+        return ids
+
+    @staticmethod
+    def release(animal_ids):
+        Animal.objects.filter(id__in=animal_ids).update(queued_at=None)
+
+    @staticmethod
+    def queue_depths(queues=None) -> dict[str, int]:
+        """Messages waiting in each render queue or the given queues, reserved and running ones excluded."""
+        depths = {}
+        with current_app.connection_for_read() as connection:
+            channel = connection.default_channel
+            for queue in queues or RenderQueue.values:
+                try:
+                    depths[queue] = channel.queue_declare(queue, passive=True).message_count
+                except ChannelError:
+                    # The broker drops an empty queue
+                    depths[queue] = 0
+        return depths
+
+    @staticmethod
+    def record_wait(queue, seconds):
+        milliseconds = int(seconds * 1000)
+        prefix = f'render_queue:{queue}:wait'
+        for name, value in (('count', 1), ('total_ms', milliseconds)):
+            cache.add(f'{prefix}:{name}', 0, timeout=None)
+            cache.incr(f'{prefix}:{name}', value)
+        cache.set(f'{prefix}:last_ms', milliseconds, timeout=None)
+        if milliseconds > (cache.get(f'{prefix}:max_ms') or 0):
+            cache.set(f'{prefix}:max_ms', milliseconds, timeout=None)
+        logger.info(f'render_queue - {queue} task waited {seconds:.1f}s')
+
+    @staticmethod
+    def wait_stats() -> dict[str, dict]:
+        """Tasks started from each render queue and their wait in milliseconds since the counters were reset."""
+        stats = {}
+        for queue in RenderQueue.values:
+            prefix = f'render_queue:{queue}:wait'
+            values = cache.get_many([f'{prefix}:{name}' for name in WAIT_STATS])
+            stats[queue] = {name: values.get(f'{prefix}:{name}', 0) for name in WAIT_STATS}
+        return stats
+
+    @staticmethod
+    def reset_wait_stats():
+        cache.delete_many([
+            f'render_queue:{queue}:wait:{name}'
+            for queue in RenderQueue.values for name in WAIT_STATS
+        ])
@@ -0,0 +1,63 @@
+import json
+import hashlib
+import logging
+from dataclasses import dataclass
+
+from django.conf import settings
+
+from .utils import file_digest
+from .ffmpeg import SegmentCacheService
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class RenderKey:
+    key: str
+    parts: dict
+
+
+class RenderKeyService:
+    """
+    Deterministic key of everything that decides how a processed video looks.
+    Two renders with the same key produce the same output, so a forced re-render of an unchanged
+    animal can reuse the stored video instead of encoding it again.
+    """
+    @staticmethod
+    def field_digest(field_file) -> str | None:
+        return file_digest(field_file.path) if field_file else None
+
+    @staticmethod
+    def build(animal, engine) -> RenderKey:
+        season = animal.season
+        parts = {
+            'original_video': RenderKeyService.field_digest(animal.original_video),
+            'cover': RenderKeyService.field_digest(animal.cover),
+            'intro': RenderKeyService.field_digest(season.intro),
+            'outro': RenderKeyService.field_digest(season.outro),
+            'frame': RenderKeyService.field_digest(season.frame),
+            'logo': RenderKeyService.field_digest(season.logo),
+            'logo_geometry': [season.logo_height, season.logo_position, season.logo_margin_top,
+                              season.logo_margin_right, season.logo_margin_bottom, season.logo_margin_left],
+            'encoder_profile': SegmentCacheService.profile_digest(),
+            'canvas': [list(settings.VIDEO_MAX_SIZE), settings.VIDEO_RESIZE_INTERPOLATION],
+            'engine': f'{season.render_engine}:{engine.version}',
+        }
+        key = hashlib.sha256(json.dumps(parts, sort_keys=True).encode()).hexdigest()
+        return RenderKey(key, parts)
+
+    @staticmethod
+    def changed_parts(previous_parts, parts) -> list[str]:
+        previous_parts = previous_parts or {}
+        return [name for name, value in parts.items() if previous_parts.get(name) != value]
+
+    @staticmethod
+    def is_current(animal, render_key: RenderKey) -> bool:
+        """True when the stored processed video was rendered from exactly these inputs."""
+        if not animal.render_key or not animal.processed_video:
+            return False
+        if animal.render_key != render_key.key:
+            changed = RenderKeyService.changed_parts(animal.render_key_parts, render_key.parts)
+            logger.info(f'render_key - {animal} changed inputs: {", ".join(changed) or "unknown"}')
+            return False
+        return animal.processed_video.storage.exists(animal.processed_video.name)
@@ -0,0 +1,75 @@
+import cv2
+from django.conf import settings
+
+from .utils import fit_size
+from .tracing import RenderTrace
+
+INTERPOLATIONS = {
+    'nearest': cv2.INTER_NEAREST,
+    'linear': cv2.INTER_LINEAR,
+    'cubic': cv2.INTER_CUBIC,
+    'area': cv2.INTER_AREA,
+    'lanczos': cv2.INTER_LANCZOS4,
+}
+
+
+class ResizeService:
+    """
+    Resizes MoviePy clips with cv2.resize.
+    Clips already at the target size are returned untouched and ImageClips are resized once, not per frame.
+    """
+    @staticmethod
+    def interpolation(source_size, target_size) -> int:
+        name = settings.VIDEO_RESIZE_INTERPOLATION
+        if name == 'auto':
+            # Area averaging avoids aliasing when shrinking, linear is enough when enlarging
+            shrinking = target_size[0] <= source_size[0] and target_size[1] <= source_size[1]
+            return cv2.INTER_AREA if shrinking else cv2.INTER_LINEAR
+        return INTERPOLATIONS[name]
+
+    @staticmethod
+    def target_size(source_size, size=None, height=None) -> tuple[int, int]:
+        if size is not None:
+            return int(size[0]), int(size[1])
+        width, source_height = source_size
+        return max(1, round(width * height / source_height)), int(height)
+
+    @staticmethod
+    def resize_frame(frame, size, interpolation):
+        return cv2.resize(frame, size, interpolation=interpolation)
+
+    @staticmethod
+    def resize_clip(clip, size=None, height=None):
+        size = ResizeService.target_size(clip.size, size, height)
+        if tuple(clip.size) == size:
+            return clip
+
+        interpolation = ResizeService.interpolation(clip.size, size)
+        # ImageClip.fl_image applies the function once, VideoClip.fl_image on every frame
+        resized_clip = clip.fl_image(
+            RenderTrace.timed('resize', lambda frame: ResizeService.resize_frame(frame, size, interpolation)))
+        if resized_clip.mask is not None and tuple(resized_clip.mask.size) != size:
+            resized_clip.mask = ResizeService.resize_clip(resized_clip.mask, size)
+        return resized_clip
+
+    @staticmethod
+    def fit_frame(frame, inner_size, size, interpolation):
+        if frame.shape[1] != inner_size[0] or frame.shape[0] != inner_size[1]:
+            frame = cv2.resize(frame, inner_size, interpolation=interpolation)
+        dx, dy = size[0] - inner_size[0], size[1] - inner_size[1]
+        return cv2.copyMakeBorder(frame, dy // 2, dy - dy // 2, dx // 2, dx - dx // 2, cv2.BORDER_CONSTANT, value=0)
+
+    @staticmethod
+    def fit_clip(clip, size):
+        """Scales the clip into size keeping its aspect ratio and pads the rest with black."""
+        size = (int(size[0]), int(size[1]))
+        inner_size = fit_size(clip.size, size)
+        if inner_size == size:
+            return ResizeService.resize_clip(clip, size)
+
+        interpolation = ResizeService.interpolation(clip.size, inner_size)
+        fitted_clip = clip.fl_image(
+            RenderTrace.timed('resize', lambda frame: ResizeService.fit_frame(frame, inner_size, size, interpolation)))
+        if fitted_clip.mask is not None and tuple(fitted_clip.mask.size) != size:
+            fitted_clip.mask = ResizeService.fit_clip(fitted_clip.mask, size)
+        return fitted_clip
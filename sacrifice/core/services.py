@@ -1,18 +1,37 @@
 import os
 import logging
 import traceback
-import tempfile
 
+from celery.exceptions import SoftTimeLimitExceeded
+from django.conf import settings
 from django.db import transaction
-from django.db.models import Q
+from django.db.models import Q, QuerySet
+from django.utils import timezone
 from django.core.files import File
 
-from moviepy.editor import VideoFileClip, concatenate_videoclips, ImageClip, CompositeVideoClip
-
-
-from .models import Animal
-from .enums import AnimalStatus, LogoPosition
-from .utils import get_random_string
+import numpy as np
+from moviepy.editor import concatenate_videoclips, AudioClip, ImageClip, CompositeVideoClip
+
+
+from .models import Animal, RenderJob
+from .enums import AnimalStatus, LogoPosition, RenderEngine, RenderJobStatus
+from .utils import create_temp_video_path, memory_limit, memory_usage
+from .ffmpeg import FFmpegConcatenationService, FFmpegService, SegmentCacheService
+from .overlays import OverlayService
+from .compositor import OverlayCompositor
+from .resize import ResizeService
+from .planner import RenderPlanner, RenderPlan, RenderBudgetError, RenderDeferredError
+from .metadata import MediaMetadataService
+from .chunks import ChunkedEncodingService
+from .clips import ClipScope
+from .render_key import RenderKeyService, RenderKey
+from .publish import PublishService
+from .workspace import RenderWorkspace, WorkspaceQuotaError
+from .iostats import IOCounter
+from .lease import RenderLease
+from .progress import RenderProgress, FrameReporter, MoviePyProgressLogger
+from .jobs import RenderJobRecorder
+from .tracing import RenderTrace
 
 logger = logging.getLogger(__name__)
 
@@ -20,78 +39,247 @@ non_video_query = Q(original_video='') | Q(original_video__isnull=True)
 
 
 class VideoConcatenationService:
+    # Bump when a change alters the rendered output, it is part of the render key
+    version = 3
+
     @staticmethod
     def composite_image(clip, content_path, height=None, position='center', mt=0, mr=0, mb=0, ml=0):
         logger.info(f'composite_image - content_path: {content_path} {position}')
+        image = ImageClip(content_path).set_duration(clip.duration)
         frame = (
-            ImageClip(content_path)
-            .set_duration(clip.duration)
-            .resize(height=height if height else clip.h)
+            ResizeService.resize_clip(image, height=height if height else clip.h)
             .margin(top=mt, right=mr, bottom=mb, left=ml, opacity=0)
             .set_position(position)
         )
         return CompositeVideoClip([clip, frame])
 
     @staticmethod
-    def concatenate_clips(clips, method="chain"):
+    def apply_overlay(clip, overlay_path, context=None):
+        logger.info(f'apply_overlay - overlay_path: {overlay_path}')
+        with RenderTrace.span('overlay'):
+            if context:
+                compositor = context.compositor(overlay_path)
+            else:
+                compositor = OverlayCompositor(*OverlayService.load_premultiplied(overlay_path))
+        return clip.fl_image(RenderJobRecorder.timed('composite', compositor))
+
+    @staticmethod
+    def silence(duration):
+        channels = settings.VIDEO_ENCODER_PROFILE['audio_channels']
+        return AudioClip(lambda t: np.zeros((len(t), channels)) if isinstance(t, np.ndarray) else np.zeros(channels),
+                         duration=duration, fps=settings.VIDEO_ENCODER_PROFILE['audio_sample_rate'])
+
+    @staticmethod
+    def join_clips(clips, method="chain", size=None):
         if method not in ["chain", "compose"]:
             raise ValueError('Invalid method. Must be one of "chain" or "compose"')
 
         if method == "chain":
-            min_height = min([c.h for c in clips])
-            min_width = min([c.w for c in clips])
-            logger.info(f'Clips will be resized to {min_width}x{min_height}')
-            clips = [c.resize((min_width, min_height)) for c in clips]
+            size = size or (min([c.w for c in clips]), min([c.h for c in clips]))
+            logger.info(f'Clips will be fitted to {size[0]}x{size[1]}')
+            clips = [ResizeService.fit_clip(c, size) for c in clips]
 
         final_clip = concatenate_videoclips(clips, method)
+        # Like the ffmpeg engine every video has an audio track, a silent body still joins the cached segments
+        if final_clip.audio is None:
+            final_clip = final_clip.set_audio(VideoConcatenationService.silence(final_clip.duration))
+        # Half a frame short of the last frame's end, so the floating point frame times of write_videofile never
+        # yield an extra frame
+        fps = settings.VIDEO_ENCODER_PROFILE['fps']
+        final_clip = final_clip.set_duration((round(final_clip.duration * fps) - 0.5) / fps)
+        return final_clip, clips
 
-        # Geçici bir dosya oluştur
-        temp_video = tempfile.NamedTemporaryFile(suffix='.mp4', delete=False)
-        temp_video_path = temp_video.name
-        temp_video.close()  # Dosyayı kapatmadan önce yolu al ve ardından dosyayı kapat
+    @staticmethod
+    def write_kwargs(threads=None) -> dict:
+        profile = settings.VIDEO_ENCODER_PROFILE
+        # Same stream layout as FFmpegService.encoder_args, the output can be joined with the cached segments
+        ffmpeg_params = ['-crf', str(profile['crf']), *FFmpegService.gop_args(), '-vf', 'setsar=1']
+        return dict(fps=profile['fps'], threads=threads or profile['threads'], preset=profile['preset'],
+                    codec=profile['video_codec'], audio_codec=profile['audio_codec'],
+                    audio_fps=profile['audio_sample_rate'], ffmpeg_params=ffmpeg_params)
+
+    @staticmethod
+    def concatenate_clips(clips, method="chain", size=None):
+        """Writes the joined clips, closing the readers is left to the ClipScope that opened them."""
+        final_clip, clips = VideoConcatenationService.join_clips(clips, method, size)
+
+        # Geçici bir dosya oluştur, MEDIA_ROOT ile aynı dosya sisteminde olduğu için kopyalanmadan yayınlanır
+        temp_video_path = create_temp_video_path(directory=PublishService.scratch_dir())
+
+        progress = RenderProgress.current()
+        reporter = None
+        if progress:
+            progress.stage('encoding', VideoConcatenationService.frame_count(final_clip))
+            reporter = progress.reporter()
 
         # Videoyu geçici dosyaya yaz
-        final_clip.write_videofile(temp_video_path, fps=30, threads=8, preset='ultrafast',
-                                   audio_codec='aac', ffmpeg_params=['-crf', '23'])
+        try:
+            with RenderJobRecorder.measure('encode'):
+                final_clip.write_videofile(temp_video_path, temp_audiofile=create_temp_video_path('.m4a'),
+                                           logger=MoviePyProgressLogger(reporter) if reporter else 'bar',
+                                           **VideoConcatenationService.write_kwargs())
+            if reporter:
+                reporter.flush()
+        except Exception:
+            os.remove(temp_video_path)
+            raise
 
         # Geçici dosyayı Django'nun FileField'ına yüklemek için aç
         f = open(temp_video_path, 'rb')
         django_file = File(f, name='processed_video.mp4')
 
-        for clip in clips:
-            clip.close()
-
         return django_file, temp_video_path
 
     @staticmethod
-    def concatenate_sacrifice_clips(video_path, cover_path, intro_path, outro_path, frame_path, logo_path, logo_height,
-                                    logo_position, logo_margin_top, logo_margin_right, logo_margin_bottom,
-                                    logo_margin_left):
+    def load_sacrifice_clips(plan: RenderPlan, scope: ClipScope, overlay_path=None, context=None,
+                             roles=RenderPlanner.segment_roles) -> list:
+        intro, cover, video, outro = (
+            plan.input(role) if role in roles else None for role in RenderPlanner.segment_roles)
+
+        def fit_frames(clip, item):
+            # Like the ffmpeg engine every segment lasts exactly its planned frames
+            return clip.set_duration(item.frames(plan.fps) / plan.fps)
+
+        def load_season_clip(item):
+            if item is None:
+                return None
+            # Shared season clips belong to the batch context and outlive this render
+            return fit_frames(context.clip(item.path, plan.size) if context else scope.video(item.path), item)
+
         # Intro
-        intro_clip = VideoFileClip(intro_path) if intro_path else None
+        intro_clip = load_season_clip(intro)
 
         # Cover
-        cover_image = ImageClip(cover_path).set_duration(2) if cover_path else None
+        cover_image = fit_frames(ImageClip(cover.path), cover) if cover else None
 
         # Clip
-        sacrifice_clip = VideoFileClip(video_path)
-        if frame_path:
-            sacrifice_clip = VideoConcatenationService.composite_image(sacrifice_clip, frame_path)
-        if logo_path:
-            sacrifice_clip = VideoConcatenationService.composite_image(
-                sacrifice_clip, logo_path, height=logo_height, position=logo_position,
-                mt=logo_margin_top, mr=logo_margin_right, mb=logo_margin_bottom, ml=logo_margin_left)
+        sacrifice_clip = fit_frames(scope.video(video.path), video)
+        if overlay_path:
+            sacrifice_clip = VideoConcatenationService.apply_overlay(sacrifice_clip, overlay_path, context)
 
         # Outro
-        outro_clip = VideoFileClip(outro_path) if outro_path else None
+        outro_clip = load_season_clip(outro)
 
         clips = [intro_clip, cover_image, sacrifice_clip, outro_clip]
-        clips = [clip for clip in clips if clip is not None]
+        return [clip for clip in clips if clip is not None]
+
+    @staticmethod
+    def frame_count(clip) -> int:
+        # Same frame count as the write_videofile loop
+        return len(np.arange(0, clip.duration, 1.0 / settings.VIDEO_ENCODER_PROFILE['fps']))
+
+    @staticmethod
+    def render_chunk(plan: RenderPlan, overlay_path, roles, reporter: FrameReporter | None, start_frame,
+                     frame_count, output_path, threads):
+        """Runs in an encode_chunk process. Encodes frame_count frames of the final clip without audio."""
+        with ClipScope() as scope:
+            clips = VideoConcatenationService.load_sacrifice_clips(plan, scope, overlay_path, roles=roles)
+            final_clip, clips = VideoConcatenationService.join_clips(clips, size=plan.size)
+            fps = settings.VIDEO_ENCODER_PROFILE['fps']
+            # Half a frame short of the range end, so iter_frames yields exactly frame_count frames
+            chunk = final_clip.subclip(start_frame / fps, (start_frame + frame_count - 0.5) / fps)
+            chunk.write_videofile(output_path, audio=False,
+                                  logger=MoviePyProgressLogger(reporter) if reporter else None,
+                                  **VideoConcatenationService.write_kwargs(threads))
+            if reporter:
+                reporter.flush()
 
-        processed_video_file, temp_video_path = VideoConcatenationService.concatenate_clips(clips)
+    @staticmethod
+    def render_parallel(plan: RenderPlan, overlay_path, workers, roles=RenderPlanner.segment_roles, context=None):
+        """
+        The batch context serves the clips loaded here for the frame count and the audio. Chunk processes cannot
+        share its readers and compositors, each one opens the inputs of its own frame range.
+        """
+        profile = settings.VIDEO_ENCODER_PROFILE
+        with ClipScope() as scope:
+            with RenderJobRecorder.measure('load'):
+                clips = VideoConcatenationService.load_sacrifice_clips(plan, scope, overlay_path, context, roles)
+                final_clip, clips = VideoConcatenationService.join_clips(clips, size=plan.size)
+            total_frames = VideoConcatenationService.frame_count(final_clip)
+
+            # Audio is cheap, it is encoded once here before the chunk processes encode the frames
+            audio_path = create_temp_video_path('.m4a') if final_clip.audio else None
+            if audio_path:
+                with RenderJobRecorder.measure('encode'):
+                    final_clip.audio.write_audiofile(audio_path, fps=profile['audio_sample_rate'],
+                                                     codec=profile['audio_codec'], logger=None)
+
+        progress = RenderProgress.current()
+        if progress:
+            progress.stage('encoding', total_frames)
+        ranges = ChunkedEncodingService.split(total_frames, workers)
+        logger.info(f'render_parallel - {total_frames} frames in {len(ranges)} chunks with {workers} workers')
+        temp_video_path = create_temp_video_path(directory=PublishService.scratch_dir())
+        chunk_paths = []
+        try:
+            # Chunk processes composite their own frames, for parallel renders the encode stage includes it
+            with RenderJobRecorder.measure('encode'):
+                chunk_paths = ChunkedEncodingService.encode(
+                    VideoConcatenationService.render_chunk,
+                    (plan, overlay_path, roles, progress and progress.reporter()), ranges, workers)
+                ChunkedEncodingService.join(chunk_paths, temp_video_path, audio_path)
+        except Exception:
+            os.remove(temp_video_path)
+            raise
+        finally:
+            ChunkedEncodingService.cleanup([*chunk_paths, audio_path])
 
+        f = open(temp_video_path, 'rb')
+        django_file = File(f, name='processed_video.mp4')
+        return django_file, temp_video_path
+
+    @staticmethod
+    def concatenate_sacrifice_clips(video_path, cover_path, intro_path, outro_path, frame_path, logo_path, logo_height,
+                                    logo_position, logo_margin_top, logo_margin_right, logo_margin_bottom,
+                                    logo_margin_left, plan=None, workers=None, context=None):
+        plan = plan or RenderPlanner.plan(video_path, cover_path, intro_path, outro_path, frame_path, logo_path)
+        get_overlay = context.get_overlay if context else OverlayService.get_overlay
+        overlay_path = get_overlay(
+            plan.input('video').size, frame_path, logo_path, logo_height, logo_position,
+            logo_margin_top, logo_margin_right, logo_margin_bottom, logo_margin_left)
+
+        # Intro and outro come from the segment cache, only the cover and the animal clip are composited here
+        cached = SegmentCacheService.enabled(plan)
+        roles = SegmentCacheService.body_roles if cached else RenderPlanner.segment_roles
+
+        workers = workers or ChunkedEncodingService.workers()
+        if workers > 1:
+            processed_video_file, temp_video_path = VideoConcatenationService.render_parallel(
+                plan, overlay_path, workers, roles, context)
+        else:
+            with ClipScope() as scope:
+                with RenderJobRecorder.measure('load'):
+                    clips = VideoConcatenationService.load_sacrifice_clips(plan, scope, overlay_path, context, roles)
+                processed_video_file, temp_video_path = VideoConcatenationService.concatenate_clips(
+                    clips, size=plan.size)
+
+        if cached:
+            processed_video_file.close()
+            processed_video_file, temp_video_path = VideoConcatenationService.join_segments(plan, temp_video_path)
         return processed_video_file, temp_video_path
 
+    @staticmethod
+    def join_segments(plan: RenderPlan, body_path):
+        temp_video_path = create_temp_video_path(directory=PublishService.scratch_dir())
+        try:
+            with RenderJobRecorder.measure('encode'):
+                SegmentCacheService.join(plan, body_path, temp_video_path)
+        except Exception:
+            os.remove(temp_video_path)
+            raise
+        finally:
+            os.remove(body_path)
+
+        f = open(temp_video_path, 'rb')
+        django_file = File(f, name='processed_video.mp4')
+        return django_file, temp_video_path
+
+
+RENDER_ENGINES = {
+    RenderEngine.MOVIEPY: VideoConcatenationService,
+    RenderEngine.FFMPEG: FFmpegConcatenationService,
+}
+
 
 class AnimalServices:
     @staticmethod
@@ -108,64 +296,307 @@ class AnimalServices:
                 .first()
 
             if animal is None:
+                # Whatever took the animal out of the queue, it is not waiting in the broker anymore
+                Animal.objects.filter(id=animal_id, queued_at__isnull=False).update(queued_at=None)
                 return None
 
-            animal.status = AnimalStatus.PROCESSING
-            animal.save()
+            # update() keeps Animal.save(), its media probes and image conversion out of the row lock
+            values = {'status': AnimalStatus.PROCESSING, 'queued_at': None, 'media_changed_at': None,
+                      'updated_at': timezone.now(), **RenderLease.acquire_values()}
+            Animal.objects.filter(pk=animal.pk).update(**values)
+            for name, value in values.items():
+                setattr(animal, name, value)
             return animal
 
     @staticmethod
-    def finnish_animal_processing(animal_id, processed_video_file, temp_video_path, processing_status):
-        with transaction.atomic():
-            animal = Animal.objects.select_for_update().get(pk=animal_id)
-            animal.status = processing_status
+    def publish_processed_video(animal_id, temp_video_path) -> tuple[str, int]:
+        animal = Animal.objects.select_related('season').get(pk=animal_id)
+        return PublishService.publish(animal.processed_video, temp_video_path)
+
+    @staticmethod
+    def media_names(animal: Animal) -> dict:
+        return {field_name: getattr(animal, field_name).name or '' for field_name in Animal.media_fields}
+
+    @staticmethod
+    def enqueue_changed_animal(animal_id):
+        from .tasks import enqueue_changed_animals
+        enqueue_changed_animals([animal_id])
+
+    @staticmethod
+    def finnish_animal_processing(animal_id, processed_video_file, temp_video_path, processing_status,
+                                  render_key: RenderKey | None = None, retry_after=None, media=None):
+        """
+        Publishes the rendered video and releases the animal.
+        media holds the names of the media the render used, see media_names.
+        """
+        # 1. Copying the video into storage happens before the row is locked
+        published_name = None
+        try:
             if processed_video_file:
-                animal.processed_video.save('processed_video.mp4', processed_video_file, save=False)
                 processed_video_file.close()
-            if temp_video_path:
+                rendered_bytes = os.path.getsize(temp_video_path)
+                with RenderTrace.span('store', bytes=rendered_bytes):
+                    published_name, copied_bytes = AnimalServices.publish_processed_video(animal_id, temp_video_path)
+                logger.info(f'make_animal_video - io {animal_id}: rendered {rendered_bytes} bytes, '
+                            f'copied {copied_bytes} bytes on publish')
+        except Exception as e:
+            logger.info(f'make_animal_video - publish error {e} {animal_id}:')
+            traceback.print_exc()
+            RenderJobRecorder.fail(traceback.format_exc(), e)
+            processing_status = AnimalStatus.ERROR
+        finally:
+            if temp_video_path and os.path.exists(temp_video_path):
                 os.remove(temp_video_path)
-            animal.save()
+
+        # 2. Only the field and status swap runs under the lock
+        storage = Animal._meta.get_field('processed_video').storage
+        values = {'status': processing_status, 'updated_at': timezone.now(), **RenderLease.release_values()}
+        if processing_status == AnimalStatus.PROCESSED:
+            values.update(attempts=0, retry_after=None)
+        if retry_after:
+            values.update(retry_after=retry_after)
+        if published_name:
+            values.update(
+                processed_video=published_name,
+                render_key=render_key.key if render_key else '',
+                render_key_parts=render_key.parts if render_key else {},
+            )
+        try:
+            with RenderTrace.span('swap'), transaction.atomic():
+                current = Animal.objects.select_for_update()\
+                    .values('processed_video', 'media_changed_at', *Animal.media_fields)\
+                    .get(pk=animal_id)
+                old_name = current['processed_video']
+                # Media saved while rendering is rendered next, whatever became of the old one
+                if current['media_changed_at'] or (media and any(
+                        (current[field_name] or '') != name for field_name, name in media.items())):
+                    logger.info(f'make_animal_video - media of {animal_id} changed while rendering, queued again')
+                    RenderJobRecorder.supersede()
+                    values.update(status=AnimalStatus.UNPROCESSED, media_changed_at=None, attempts=0,
+                                  retry_after=None)
+                    transaction.on_commit(lambda: AnimalServices.enqueue_changed_animal(animal_id), robust=True)
+                Animal.objects.filter(pk=animal_id).update(**values)
+
+                # 3. The replaced file is removed once the new name is committed
+                if published_name and old_name and old_name != published_name:
+                    transaction.on_commit(lambda: PublishService.delete(storage, old_name))
+        except Exception:
+            if published_name:
+                PublishService.delete(storage, published_name)
+            raise
+        return processing_status
 
     @staticmethod
-    def fetch_animals_for_auto_processing() -> list[int]:
-        ids = Animal.objects.filter(
+    def fetch_animals_for_auto_processing() -> QuerySet:
+        return Animal.objects.filter(
             Q(status=AnimalStatus.UNPROCESSED, season__auto_process=True)
         ).exclude(
             non_video_query
+        ).exclude(
+            retry_after__gt=timezone.now()
         ).values_list(
             'id',
             flat=True
         ).order_by(
             '-created_at'
         )
-        return list(ids)
 
     @staticmethod
-    def process_animal(animal: Animal):
+    def fetch_season_batches(animal_ids, batch_size=None) -> list[tuple[int, list[int]]]:
+        """Groups the animals by season in chunks of VIDEO_BATCH_SIZE, keeping the given order inside a season."""
+        batch_size = batch_size or settings.VIDEO_BATCH_SIZE
+        season_ids = dict(Animal.objects.filter(id__in=animal_ids).values_list('id', 'season_id'))
+        by_season = {}
+        for animal_id in animal_ids:
+            if animal_id in season_ids:
+                by_season.setdefault(season_ids[animal_id], []).append(animal_id)
+        return [
+            (season_id, ids[index:index + batch_size])
+            for season_id, ids in by_season.items()
+            for index in range(0, len(ids), batch_size)
+        ]
+
+    @staticmethod
+    def get_render_paths(animal: Animal) -> dict:
+        return {
+            'video_path': animal.original_video.path,
+            'cover_path': animal.cover.path if animal.cover else None,
+            'intro_path': animal.season.intro.path if animal.season.intro else None,
+            'outro_path': animal.season.outro.path if animal.season.outro else None,
+            'frame_path': animal.season.frame.path if animal.season.frame else None,
+            'logo_path': animal.season.logo.path if animal.season.logo else None,
+        }
+
+    @staticmethod
+    def get_known_metadata(animal: Animal) -> dict:
+        known = {
+            'video': MediaMetadataService.known_metadata(animal, 'original_video'),
+            'cover': MediaMetadataService.known_metadata(animal, 'cover'),
+            'intro': MediaMetadataService.known_metadata(animal.season, 'intro'),
+            'outro': MediaMetadataService.known_metadata(animal.season, 'outro'),
+            'frame': MediaMetadataService.known_metadata(animal.season, 'frame'),
+            'logo': MediaMetadataService.known_metadata(animal.season, 'logo'),
+        }
+        return {role: data for role, data in known.items() if data}
+
+    @staticmethod
+    def save_render_plan(animal_id, plan: RenderPlan):
+        # update() keeps the plan write away from Animal.save() and the row lock
+        Animal.objects.filter(pk=animal_id).update(render_plan=plan.to_dict())
+        for warning in plan.warnings:
+            logger.warning(f'make_animal_video - plan warning for {animal_id}: {warning}')
+
+    @staticmethod
+    def input_bytes(animal: Animal, field_files=None) -> int:
+        input_bytes = 0
+        field_files = field_files or (animal.original_video, animal.cover, animal.season.intro, animal.season.outro)
+        for field_file in field_files:
+            try:
+                input_bytes += field_file.size if field_file else 0
+            except OSError:
+                # A missing input fails the render itself, with a proper error status
+                pass
+        return input_bytes
+
+    @staticmethod
+    def estimate_scratch_bytes(animal: Animal) -> int:
+        videos = (animal.original_video, animal.season.intro, animal.season.outro)
+        return AnimalServices.input_bytes(animal, videos) * settings.VIDEO_SCRATCH_INPUT_FACTOR
+
+    @staticmethod
+    def deferral_retry_after(animal_id):
+        """
+        When a deferred render is tried again. Like a reclaimed lease it backs off exponentially, with every
+        deferral in a row, so a worker short of memory or scratch space does not claim the animal in a loop.
+        A render superseded by new media ends the run, an editor's upload is not a reason to wait longer.
+        """
+        statuses = RenderJob.objects.filter(animal_id=animal_id).exclude(status=RenderJobStatus.RUNNING)\
+            .order_by('-started_at').values_list('status', flat=True)[:10]
+        deferrals = next((index for index, status in enumerate(statuses) if status != RenderJobStatus.DEFERRED),
+                         len(statuses))
+        return timezone.now() + RenderLease.backoff(deferrals + 1)
+
+    @staticmethod
+    def render_animal(animal: Animal, context=None, profiler=None):
+        """
+        Renders and publishes an animal prepared for processing inside its own scratch workspace.
+        profiler is 'cprofile' or 'pyinstrument' to profile this render, see RenderTrace.
+        Returns the time a deferred render is tried again, None otherwise.
+        """
+        io_counter = IOCounter()
+        retry_after = None
+        media = AnimalServices.media_names(animal)
+        with RenderJobRecorder(animal, AnimalServices.input_bytes(animal)) as recorder, \
+                RenderTrace(f'job-{recorder.job.id}', profiler):
+            workspace = RenderWorkspace(
+                f'animal-{animal.id}', AnimalServices.estimate_scratch_bytes(animal), recorder.job.id)
+            try:
+                with RenderLease(animal.id, animal.lease_owner), RenderProgress(animal.id) as progress, workspace:
+                    processed_video_file, temp_video_path, processing_status, render_key = \
+                        AnimalServices.process_animal(animal, context)
+                    output_bytes = os.path.getsize(temp_video_path) if temp_video_path else None
+                    if processing_status == AnimalStatus.UNPROCESSED:
+                        retry_after = AnimalServices.deferral_retry_after(animal.id)
+                    progress.stage('publishing')
+                    with RenderJobRecorder.measure('publish'):
+                        processing_status = AnimalServices.finnish_animal_processing(
+                            animal.id, processed_video_file, temp_video_path, processing_status, render_key,
+                            retry_after, media)
+                    recorder.finish(RenderJobRecorder.job_status(processing_status, output_bytes), output_bytes)
+                    if recorder.superseded:
+                        # Queued again right away, a deferral backoff does not apply to the new media
+                        retry_after = None
+            except WorkspaceQuotaError as e:
+                logger.warning(f'make_animal_video - {e}, {animal} is put back in the queue')
+                retry_after = AnimalServices.deferral_retry_after(animal.id)
+                AnimalServices.finnish_animal_processing(
+                    animal.id, None, None, AnimalStatus.UNPROCESSED, retry_after=retry_after, media=media)
+                RenderJobRecorder.fail(str(e), e)
+                recorder.finish(RenderJobStatus.DEFERRED)
+                return None if recorder.superseded else retry_after
+            except SoftTimeLimitExceeded:
+                # The task is killed soon, the animal must not stay in PROCESSING until the lease reaper runs
+                logger.warning(f'make_animal_video - time limit exceeded while rendering {animal}')
+                AnimalServices.finnish_animal_processing(animal.id, None, None, AnimalStatus.ERROR, media=media)
+                raise
+        logger.info(f'make_animal_video - processing is finished: {animal}, {io_counter.written_bytes} bytes written')
+        return retry_after
+
+    @staticmethod
+    def fit_memory_budget(plan: RenderPlan) -> int:
+        """Number of chunk processes the render may use within the job's memory budget."""
+        workers = ChunkedEncodingService.workers()
+        budget = settings.VIDEO_JOB_MEMORY_BUDGET
+        if budget is None:
+            return workers
+
+        while workers > 1 and RenderPlanner.estimate_memory(plan, workers) > budget:
+            workers //= 2
+        needed = RenderPlanner.estimate_memory(plan, workers)
+        if needed > budget:
+            raise RenderBudgetError(f'Render needs about {needed} bytes of memory, the job budget is {budget} bytes')
+
+        # This process already holds the base cost, only the frames are still to be allocated
+        available = memory_limit() - (memory_usage() or 0)
+        if needed - settings.VIDEO_JOB_BASE_MEMORY_BYTES > available:
+            raise RenderDeferredError(f'Render needs about {needed} bytes of memory, {available} bytes are free')
+        return workers
+
+    @staticmethod
+    def process_animal(animal: Animal, context=None):
         processed_video_file: File | None = None
         temp_video_path: str | None = None
+        render_key: RenderKey | None = None
         try:
-            logger.info(f'make_animal_video - processing: {animal}')
-
-            processed_video_file, temp_video_path = VideoConcatenationService.concatenate_sacrifice_clips(
-                animal.original_video.path,
-                animal.cover.path if animal.cover else None,
-                animal.season.intro.path if animal.season.intro else None,
-                animal.season.outro.path if animal.season.outro else None,
-                animal.season.frame.path if animal.season.frame else None,
-                animal.season.logo.path if animal.season.logo else None,
+            logger.info(f'make_animal_video - processing: {animal} ({animal.season.render_engine})')
+
+            engine = RENDER_ENGINES[animal.season.render_engine]
+            with RenderTrace.span('render_key'):
+                render_key = RenderKeyService.build(animal, engine)
+            if RenderKeyService.is_current(animal, render_key):
+                logger.info(f'make_animal_video - render key unchanged, keeping the processed video: {animal}')
+                return None, None, AnimalStatus.PROCESSED, render_key
+
+            paths = AnimalServices.get_render_paths(animal)
+            with RenderJobRecorder.measure('probe'):
+                plan = RenderPlanner.plan(**paths, known=AnimalServices.get_known_metadata(animal))
+            AnimalServices.save_render_plan(animal.id, plan)
+            RenderJobRecorder.count_frames(plan.frames)
+            with RenderTrace.span('budget') as span:
+                workers = AnimalServices.fit_memory_budget(plan)
+                if span:
+                    span.attributes['workers'] = workers
+
+            processed_video_file, temp_video_path = engine.concatenate_sacrifice_clips(
+                paths['video_path'],
+                paths['cover_path'],
+                paths['intro_path'],
+                paths['outro_path'],
+                paths['frame_path'],
+                paths['logo_path'],
                 animal.season.logo_height,
                 LogoPosition.convert_for_moviepy(animal.season.logo_position),
                 animal.season.logo_margin_top,
                 animal.season.logo_margin_right,
                 animal.season.logo_margin_bottom,
-                animal.season.logo_margin_left
+                animal.season.logo_margin_left,
+                plan=plan,
+                workers=workers,
+                context=context
             )
+        except RenderDeferredError as e:
+            logger.warning(f'make_animal_video - {e}, {animal} is put back in the queue')
+            RenderJobRecorder.fail(str(e), e)
+            return None, None, AnimalStatus.UNPROCESSED, None
+        except SoftTimeLimitExceeded:
+            # The whole task has to stop, render_animal releases the animal
+            raise
         except Exception as e:
             logger.info(f'make_animal_video - error {e} {animal}:')
             traceback.print_exc()
+            RenderJobRecorder.fail(traceback.format_exc(), e)
             processing_status = AnimalStatus.ERROR
         else:
             processing_status = AnimalStatus.PROCESSED
 
-        return processed_video_file, temp_video_path, processing_status
+        return processed_video_file, temp_video_path, processing_status, render_key
@@ -0,0 +1,71 @@
+import threading
+from functools import partial, update_wrapper
+
+from django.db import transaction
+from django.db.models.signals import pre_save, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .enums import AnimalStatus
+from .models import Season, Animal
+from .ffmpeg import SegmentCacheService
+
+# on_commit callback of the running transaction, collecting the animals whose media changed
+pending_animals = threading.local()
+
+
+@receiver(pre_save, sender=Season)
+def invalidate_season_segments(sender, instance, **kwargs):
+    if not instance.pk:
+        return
+    previous = Season.objects.filter(pk=instance.pk).first()
+    if previous is None:
+        return
+    for field_name in ('intro', 'outro'):
+        previous_file = getattr(previous, field_name)
+        if previous_file and previous_file.name != getattr(instance, field_name).name:
+            SegmentCacheService.invalidate(previous_file.path)
+
+
+@receiver(pre_save, sender=Animal)
+def track_animal_media_changes(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    previous = Animal.objects.filter(pk=instance.pk).values('original_video', 'cover').first() if instance.pk else {}
+    previous = previous or {}
+    instance.media_changed = any(
+        (getattr(instance, field_name).name or '') != (previous.get(field_name) or '')
+        for field_name in ('original_video', 'cover')
+    )
+    # The processed video no longer matches the new media, a running render is left alone
+    if instance.media_changed and previous and instance.status in (AnimalStatus.PROCESSED, AnimalStatus.ERROR):
+        instance.status = AnimalStatus.UNPROCESSED
+    # The running render uses the old media, finnish_animal_processing queues the animal again when it ends
+    if instance.media_changed and previous and instance.status == AnimalStatus.PROCESSING:
+        instance.media_changed_at = timezone.now()
+    # New media deserves a fresh start, attempts of the old one do not count
+    if instance.media_changed and previous and instance.status == AnimalStatus.UNPROCESSED:
+        instance.attempts = 0
+        instance.retry_after = None
+
+
+@receiver(post_save, sender=Animal)
+def enqueue_animal_on_media_change(sender, instance, raw=False, **kwargs):
+    if raw or not getattr(instance, 'media_changed', False) or not instance.season.auto_process:
+        return
+
+    # Saves of a bulk admin edit share one transaction and are sent as season batches after it commits
+    callback = getattr(pending_animals, 'callback', None)
+    connection = transaction.get_connection()
+    if callback is not None and any(func is callback for _, func, _ in connection.run_on_commit):
+        callback.args[0].add(instance.pk)
+        return
+    # A rolled back transaction drops its callback, the next save starts a new set. Django logs a failing robust
+    # callback by its __qualname__, which a bare partial does not have
+    pending_animals.callback = update_wrapper(partial(enqueue_pending_animals, {instance.pk}), enqueue_pending_animals)
+    transaction.on_commit(pending_animals.callback, robust=True)
+
+
+def enqueue_pending_animals(animal_ids):
+    from .tasks import enqueue_changed_animals
+    enqueue_changed_animals(list(animal_ids))
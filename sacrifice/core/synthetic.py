@@ -0,0 +1,38 @@
+from PIL import Image, ImageDraw
+
+from .ffmpeg import FFmpegService
+
+RESOLUTIONS = {'720p': (1280, 720), '1080p': (1920, 1080), '4k': (3840, 2160)}
+
+
+class SyntheticMedia:
+    """
+    Deterministic inputs for benchmarks and load simulations.
+    Videos come from the ffmpeg test sources, overlays are drawn with PIL, so the same arguments give the same
+    bytes on every machine.
+    """
+    @staticmethod
+    def create_video(path, width, height, duration, pattern='testsrc2', frequency=440):
+        FFmpegService.run([
+            '-f', 'lavfi', '-i', f'{pattern}=size={width}x{height}:rate=30:duration={duration}',
+            '-f', 'lavfi', '-i', f'sine=frequency={frequency}:sample_rate=44100:duration={duration}',
+            # One encoder thread and bitexact muxing give the same bytes on every machine
+            '-c:v', 'libx264', '-preset', 'veryfast', '-pix_fmt', 'yuv420p', '-threads', '1',
+            '-c:a', 'aac', '-shortest', '-map_metadata', '-1',
+            '-fflags', '+bitexact', '-flags:v', '+bitexact', '-flags:a', '+bitexact', str(path)
+        ])
+
+    @staticmethod
+    def create_frame(path, width, height):
+        frame = Image.new('RGBA', (width, height), (0, 0, 0, 0))
+        draw = ImageDraw.Draw(frame)
+        border = height // 20
+        draw.rectangle((0, 0, width, border), fill=(200, 160, 40, 255))
+        draw.rectangle((0, height - border, width, height), fill=(200, 160, 40, 255))
+        frame.save(path)
+
+    @staticmethod
+    def create_logo(path):
+        logo = Image.new('RGBA', (400, 200), (0, 0, 0, 0))
+        ImageDraw.Draw(logo).ellipse((0, 0, 400, 200), fill=(255, 255, 255, 180))
+        logo.save(path)
@@ -1,7 +1,17 @@
+import time
 import logging
 
 from celery import shared_task
+from celery.exceptions import SoftTimeLimitExceeded
+from celery.signals import worker_ready, before_task_publish, task_prerun
+from django.conf import settings
 
+from .batch import SeasonRenderContext
+from .workspace import RenderWorkspace
+from .enums import RenderQueue
+from .lease import RenderLease
+from .models import Season
+from .queue import RenderQueueService
 from .services import AnimalServices
 
 logger = logging.getLogger(__name__)
@@ -9,28 +19,146 @@ animal_service = AnimalServices()
 
 
 @shared_task
-def make_animal_video(animal_id: int, force: bool = False):
+def make_animal_video(animal_id: int, force: bool = False, profiler: str | None = None):
     logger.info('make_animal_video - started')
     animal = animal_service.prepare_animal_for_processing(animal_id, force)
     if not animal:
         return
 
     logger.info(f'make_animal_video - animal: {animal}')
-    processed_video_file, temp_video_path, processing_status = animal_service.process_animal(animal)
-    logger.info(f'make_animal_video - processing is finished: {animal}')
+    retry_after = animal_service.render_animal(animal, profiler=profiler)
+    if retry_after:
+        schedule_auto_process(retry_after)
 
-    animal_service.finnish_animal_processing(animal_id, processed_video_file, temp_video_path, processing_status)
+
+@shared_task
+def make_season_videos(season_id: int, animal_ids: list[int], force: bool = False, profiler: str | None = None):
+    logger.info(f'make_season_videos - started: season {season_id}, {len(animal_ids)} animals')
+    reached = 0
+    try:
+        season = Season.objects.get(pk=season_id)
+        with SeasonRenderContext(season) as context:
+            for reached, animal_id in enumerate(animal_ids, 1):
+                try:
+                    animal = animal_service.prepare_animal_for_processing(animal_id, force)
+                    if not animal:
+                        continue
+
+                    # An animal moved to another season after it was queued is rendered without the shared assets
+                    same_season = animal.season_id == season.id
+                    if same_season:
+                        animal.season = season
+                    retry_after = animal_service.render_animal(
+                        animal, context=context if same_season else None, profiler=profiler)
+                    if retry_after:
+                        schedule_auto_process(retry_after)
+                except SoftTimeLimitExceeded:
+                    logger.warning(f'make_season_videos - time limit exceeded at {animal_id}, stopping the batch')
+                    raise
+                except Exception as e:
+                    # One animal must never stop the rest of the batch
+                    logger.exception(f'make_season_videos - error {e} {animal_id}')
+        logger.info(f'make_season_videos - finished: season {season_id}')
+    finally:
+        # Animals the batch did not reach are no longer in the broker, they must not wait for VIDEO_QUEUE_TTL
+        RenderQueueService.release(animal_ids[reached:])
+        # The batch freed a worker slot, top the queue up without waiting for the next beat tick
+        auto_process_animals.delay()
 
 
 @shared_task
 def auto_process_animals():
     logger.info('auto_process_animals - started')
-    animal_ids = animal_service.fetch_animals_for_auto_processing()
+    capacity = RenderQueueService.free_capacity()
+    if not capacity:
+        logger.info('auto_process_animals - workers have no free capacity')
+        return
+
+    animal_ids = RenderQueueService.claim(animal_service.fetch_animals_for_auto_processing(), capacity)
     if not animal_ids:
         logger.info('auto_process_animals - no available animals found')
         return
 
     logger.info(f'auto_process_animals - animals: {animal_ids}')
-    for animal_id in animal_ids:
-        make_animal_video.delay(animal_id)
+    send_season_batches(animal_ids, RenderQueue.BULK)
     logger.info('auto_process_animals - finished')
+
+
+def schedule_auto_process(retry_after):
+    # The poller runs rarely, queue animals that were put back with a backoff as soon as it passes
+    auto_process_animals.apply_async(eta=retry_after)
+
+
+def enqueue_changed_animals(animal_ids):
+    """Queues animals whose media changed right away, the ledger drops the ones that are already queued."""
+    queryset = animal_service.fetch_animals_for_auto_processing().filter(id__in=animal_ids)
+    animal_ids = RenderQueueService.claim(queryset, len(animal_ids))
+    if animal_ids:
+        logger.info(f'enqueue_changed_animals - animals: {animal_ids}')
+        send_season_batches(animal_ids, RenderQueue.UPLOADS)
+
+
+def batch_time_limits(size) -> dict:
+    """Time limits of a make_season_videos task, the batch gets the time of a single render for every animal."""
+    time_limit = settings.CELERY_TASK_TIME_LIMIT * size
+    # The soft limit keeps the margin a single render has to clean up before it is killed
+    return {
+        'time_limit': time_limit,
+        'soft_time_limit': time_limit - (settings.CELERY_TASK_TIME_LIMIT - settings.CELERY_TASK_SOFT_TIME_LIMIT),
+    }
+
+
+def send_forced_renders(animal_ids):
+    """
+    Queues the animals on the urgent queue, processed ones are rendered again.
+    One task per animal, a batch would render them one after another on a single urgent worker.
+    """
+    for animal_id in animal_ids:
+        make_animal_video.apply_async((animal_id,), {'force': True}, queue=RenderQueue.URGENT)
+
+
+def send_season_batches(animal_ids, queue):
+    batches = animal_service.fetch_season_batches(animal_ids)
+    for index, (season_id, batch) in enumerate(batches):
+        try:
+            make_season_videos.apply_async((season_id, batch), queue=queue, **batch_time_limits(len(batch)))
+        except Exception:
+            # Unsent animals must not wait for their ledger mark to expire
+            RenderQueueService.release([animal_id for _, unsent in batches[index:] for animal_id in unsent])
+            raise
+
+
+@shared_task
+def sweep_render_workspaces():
+    reclaimed = RenderWorkspace.sweep()
+    logger.info(f'sweep_render_workspaces - {reclaimed} bytes reclaimed')
+
+
+@shared_task
+def reclaim_expired_leases():
+    reclaimed = RenderLease.reclaim()
+    if not reclaimed:
+        return
+
+    logger.info(f'reclaim_expired_leases - animals reclaimed: {list(reclaimed)}')
+    for retry_after in set(filter(None, reclaimed.values())):
+        schedule_auto_process(retry_after)
+
+
+@worker_ready.connect
+def sweep_render_workspaces_on_startup(**kwargs):
+    # Workspaces of a worker that was killed are orphaned as soon as it restarts
+    sweep_render_workspaces.delay()
+
+
+@before_task_publish.connect
+def stamp_enqueue_time(headers=None, **kwargs):
+    headers.setdefault('enqueued_at', time.time())
+
+
+@task_prerun.connect
+def record_queue_wait(task=None, **kwargs):
+    queue = (task.request.delivery_info or {}).get('routing_key')
+    enqueued_at = task.request.get('enqueued_at')
+    if queue in RenderQueue.values and enqueued_at:
+        RenderQueueService.record_wait(queue, time.time() - enqueued_at)
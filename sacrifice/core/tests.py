@@ -1,3 +1,1012 @@
-from django.test import TestCase
+import io
+import os
+import re
+import json
+import time
+import random
+import shutil
+import tempfile
+import contextlib
+import multiprocessing
+from datetime import timedelta
+from pathlib import Path
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from celery import current_app
+from celery.exceptions import SoftTimeLimitExceeded
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.db.backends.postgresql.base import DatabaseWrapper as PostgresDatabaseWrapper
+from django.forms import modelform_factory
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
+
+from .batch import SeasonRenderContext
+from .chunks import ChunkedEncodingService
+from .counters import RenderCounters
+from .enums import AnimalStatus, RenderEngine, RenderJobStatus, RenderQueue
+from .ffmpeg import FFmpegService, FFmpegConcatenationService
+from .jobs import RenderJobRecorder
+from .management.commands.simulate_eid_load import Command as SimulateEidLoadCommand
+from .lease import RenderLease
+from .metadata import MediaMetadataService
+from .models import Season, Animal, RenderJob
+from .planner import RenderPlan, RenderPlanner, InputPlan
+from .probe import ProbeService
+from .progress import RenderProgress
+from .publish import PublishService
+from .queue import RenderQueueService
+from .render_key import RenderKeyService
+from .services import RENDER_ENGINES, AnimalServices, VideoConcatenationService
+from .utils import temp_directory
+from .workspace import RenderWorkspace, WorkspaceQuotaError
+from .tasks import (auto_process_animals, make_animal_video, make_season_videos, send_forced_renders,
+                    send_season_batches)
+from .tracing import RenderTrace
+
+
+class FinnishAnimalProcessingLockTests(TransactionTestCase):
+    video_size = 64 * 1024 * 1024
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(
+            MEDIA_ROOT=self.media_root, VIDEO_SCRATCH_ROOT=os.path.join(self.media_root, 'scratch'))
+        self.settings_override.enable()
+        self.season = Season.objects.create(name='Test')
+        self.animal = Animal.objects.create(season=self.season, code='A1', status=AnimalStatus.PROCESSING)
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root, ignore_errors=True)
+
+    def create_video(self, directory=None):
+        fd, path = tempfile.mkstemp(suffix='.mp4', dir=directory)
+        chunk = os.urandom(1024 * 1024)
+        with os.fdopen(fd, 'wb') as f:
+            for _ in range(self.video_size // len(chunk)):
+                f.write(chunk)
+        return path
+
+    def test_row_lock_is_not_held_while_the_video_is_stored(self):
+        old_name = 'animals/old_processed.mp4'
+        os.makedirs(os.path.join(self.media_root, 'animals'))
+        with open(os.path.join(self.media_root, old_name), 'wb') as f:
+            f.write(b'old')
+        Animal.objects.filter(pk=self.animal.pk).update(processed_video=old_name)
+
+        lock_durations, publish_in_transaction = [], []
+        atomic, publish = transaction.atomic, PublishService.publish
+
+        @contextlib.contextmanager
+        def timed_atomic(*args, **kwargs):
+            started = time.perf_counter()
+            with atomic(*args, **kwargs):
+                yield
+            lock_durations.append(time.perf_counter() - started)
+
+        def tracked_publish(*args, **kwargs):
+            publish_in_transaction.append(connection.in_atomic_block)
+            return publish(*args, **kwargs)
+
+        # A copy from another directory is the slowest publish path
+        temp_video_path = self.create_video()
+        with mock.patch('core.services.transaction.atomic', timed_atomic), \
+                mock.patch.object(PublishService, 'publish', staticmethod(tracked_publish)), \
+                mock.patch.object(PublishService, 'link_or_copy', staticmethod(
+                    lambda source, target: shutil.copyfile(source, target) and os.path.getsize(target))):
+            started = time.perf_counter()
+            AnimalServices.finnish_animal_processing(
+                self.animal.pk, open(temp_video_path, 'rb'), temp_video_path, AnimalStatus.PROCESSED)
+            total_duration = time.perf_counter() - started
+
+        self.assertEqual(publish_in_transaction, [False])
+        self.assertEqual(len(lock_durations), 1)
+        self.assertLess(lock_durations[0], 0.25)
+        self.assertLess(lock_durations[0], total_duration / 2)
+
+        animal = Animal.objects.get(pk=self.animal.pk)
+        self.assertEqual(animal.status, AnimalStatus.PROCESSED)
+        self.assertEqual(os.path.getsize(animal.processed_video.path), self.video_size)
+        self.assertFalse(os.path.exists(temp_video_path))
+        self.assertFalse(os.path.exists(os.path.join(self.media_root, old_name)))
+
+    def test_failed_render_only_updates_status(self):
+        AnimalServices.finnish_animal_processing(self.animal.pk, None, None, AnimalStatus.ERROR)
+
+        animal = Animal.objects.get(pk=self.animal.pk)
+        self.assertEqual(animal.status, AnimalStatus.ERROR)
+        self.assertFalse(animal.processed_video)
+
+    def test_scratch_render_is_linked_without_copying(self):
+        temp_video_path = self.create_video(PublishService.scratch_dir())
+        os.chmod(temp_video_path, 0o600)
+
+        name, copied_bytes = PublishService.publish(self.animal.processed_video, temp_video_path)
+
+        published_path = os.path.join(self.media_root, name)
+        self.assertEqual(copied_bytes, 0)
+        self.assertTrue(os.path.samefile(published_path, temp_video_path))
+        storage = self.animal.processed_video.storage
+        self.assertEqual(os.stat(published_path).st_mode & 0o777, PublishService.file_mode(storage))
+
+
+class MediaProbeTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        self.settings_override.enable()
+        self.season = Season.objects.create(name='Test')
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root, ignore_errors=True)
+
+    @skipUnless(shutil.which(settings.FFMPEG_BINARY) and shutil.which(settings.FFPROBE_BINARY),
+                'ffmpeg and ffprobe are required')
+    def test_upload_is_probed_once(self):
+        video_path = os.path.join(self.media_root, 'upload.mp4')
+        FFmpegService.run(['-f', 'lavfi', '-i', 'testsrc2=size=160x120:rate=30:duration=1', '-c:v', 'libx264',
+                           video_path])
+        with open(video_path, 'rb') as f:
+            upload = SimpleUploadedFile('upload.mp4', f.read())
+        form_class = modelform_factory(Animal, fields=['season', 'code', 'original_video'])
+
+        with mock.patch.object(MediaMetadataService, 'probe_path', wraps=MediaMetadataService.probe_path) as probe:
+            form = form_class({'season': self.season.pk, 'code': 'A1'}, {'original_video': upload})
+            self.assertTrue(form.is_valid(), form.errors)
+            animal = form.save()
+
+        self.assertEqual(probe.call_count, 1)
+        self.assertEqual((animal.video_width, animal.video_height), (160, 120))
+        self.assertEqual(animal.media_metadata['original_video']['name'], animal.original_video.name)
+
+    def test_claiming_an_animal_does_not_probe_under_the_row_lock(self):
+        # Rows uploaded before metadata existed have media without any stored probe result
+        animal = Animal.objects.create(season=self.season, code='A1')
+        Animal.objects.filter(pk=animal.pk).update(original_video='animals/legacy.mp4')
+
+        with mock.patch.object(MediaMetadataService, 'probe_path', side_effect=AssertionError('probed')):
+            animal = AnimalServices.prepare_animal_for_processing(animal.pk)
+
+        self.assertEqual(animal.status, AnimalStatus.PROCESSING)
+        self.assertEqual(Animal.objects.get(pk=animal.pk).status, AnimalStatus.PROCESSING)
+
+
+@override_settings(CELERY_TASK_TIME_LIMIT=600, CELERY_TASK_SOFT_TIME_LIMIT=540)
+class SeasonBatchTimeLimitTests(TestCase):
+    def setUp(self):
+        self.scratch_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(VIDEO_SCRATCH_ROOT=self.scratch_root)
+        self.settings_override.enable()
+        self.season = Season.objects.create(name='Test')
+        self.animal_ids = []
+        for code in ('A1', 'A2', 'A3'):
+            animal = Animal.objects.create(season=self.season, code=code)
+            Animal.objects.filter(pk=animal.pk).update(original_video=f'animals/{code}.mp4', queued_at=timezone.now())
+            self.animal_ids.append(animal.pk)
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.scratch_root, ignore_errors=True)
+
+    def test_batch_limits_scale_with_its_size(self):
+        with mock.patch.object(make_season_videos, 'apply_async') as apply_async:
+            send_season_batches(self.animal_ids, RenderQueue.BULK)
+
+        self.assertEqual(apply_async.call_args.kwargs['time_limit'], 1800)
+        self.assertEqual(apply_async.call_args.kwargs['soft_time_limit'], 1740)
+
+    def test_forced_renders_are_sent_one_animal_per_task(self):
+        with mock.patch.object(make_animal_video, 'apply_async') as apply_async, \
+                mock.patch.object(make_season_videos, 'apply_async') as batch_apply_async:
+            send_forced_renders(self.animal_ids)
+
+        batch_apply_async.assert_not_called()
+        self.assertEqual(apply_async.call_args_list, [
+            mock.call((animal_id,), {'force': True}, queue=RenderQueue.URGENT) for animal_id in self.animal_ids])
+
+    def test_soft_time_limit_stops_the_batch_and_releases_the_rest(self):
+        with mock.patch.object(AnimalServices, 'process_animal', side_effect=SoftTimeLimitExceeded()), \
+                mock.patch.object(auto_process_animals, 'delay') as delay:
+            with self.assertRaises(SoftTimeLimitExceeded):
+                make_season_videos(self.season.pk, self.animal_ids)
+
+        animals = Animal.objects.in_bulk(self.animal_ids)
+        first, *rest = (animals[animal_id] for animal_id in self.animal_ids)
+        self.assertEqual(first.status, AnimalStatus.ERROR)
+        self.assertEqual(first.lease_owner, '')
+        self.assertEqual([animal.status for animal in rest], [AnimalStatus.UNPROCESSED] * 2)
+        self.assertEqual([animal.queued_at for animal in animals.values()], [None] * 3)
+        self.assertEqual(RenderJob.objects.get().error_type, 'SoftTimeLimitExceeded')
+        delay.assert_called_once()
+
+
+class RenderDeferralTests(TestCase):
+    def setUp(self):
+        self.scratch_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(VIDEO_SCRATCH_ROOT=self.scratch_root)
+        self.settings_override.enable()
+        self.animal = Animal.objects.create(season=Season.objects.create(name='Test'), code='A1')
+        Animal.objects.filter(pk=self.animal.pk).update(original_video='animals/A1.mp4')
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.scratch_root, ignore_errors=True)
+
+    def defer(self):
+        deferred = (None, None, AnimalStatus.UNPROCESSED, None)
+        with mock.patch.object(AnimalServices, 'process_animal', return_value=deferred), \
+                mock.patch.object(auto_process_animals, 'apply_async') as apply_async:
+            started_at = timezone.now()
+            make_animal_video(self.animal.pk)
+
+        animal = Animal.objects.get(pk=self.animal.pk)
+        self.assertEqual(animal.status, AnimalStatus.UNPROCESSED)
+        apply_async.assert_called_once_with(eta=animal.retry_after)
+        return (animal.retry_after - started_at).total_seconds()
+
+    def test_deferred_renders_back_off(self):
+        first, second = self.defer(), self.defer()
+
+        self.assertAlmostEqual(first, settings.VIDEO_LEASE_BACKOFF, delta=5)
+        self.assertAlmostEqual(second, settings.VIDEO_LEASE_BACKOFF * 2, delta=5)
+        self.assertEqual(list(RenderJob.objects.values_list('status', flat=True)), [RenderJobStatus.DEFERRED] * 2)
+        self.assertNotIn(self.animal, AnimalServices.fetch_animals_for_auto_processing())
+
+
+class MediaChangeWhileProcessingTests(TestCase):
+    def setUp(self):
+        self.season = Season.objects.create(name='Test', auto_process=True)
+        self.animal = Animal.objects.create(season=self.season, code='A1')
+        Animal.objects.filter(pk=self.animal.pk).update(original_video='animals/A1.mp4')
+        self.animal = AnimalServices.prepare_animal_for_processing(self.animal.pk)
+        self.media = AnimalServices.media_names(self.animal)
+
+    def finish(self):
+        with mock.patch('core.tasks.send_season_batches') as send_season_batches, \
+                self.captureOnCommitCallbacks(execute=True):
+            AnimalServices.finnish_animal_processing(
+                self.animal.pk, None, None, AnimalStatus.PROCESSED, media=self.media)
+        return send_season_batches
+
+    def test_media_saved_while_processing_is_rendered_next(self):
+        animal = Animal.objects.get(pk=self.animal.pk)
+        animal.original_video = 'animals/A1-new.mp4'
+        with mock.patch.object(MediaMetadataService, 'collect', return_value={}), \
+                mock.patch('core.tasks.send_season_batches') as send_season_batches, \
+                self.captureOnCommitCallbacks(execute=True):
+            animal.save()
+        send_season_batches.assert_not_called()
+        self.assertIsNotNone(Animal.objects.get(pk=animal.pk).media_changed_at)
+
+        send_season_batches = self.finish()
+
+        animal = Animal.objects.get(pk=animal.pk)
+        self.assertEqual(animal.status, AnimalStatus.UNPROCESSED)
+        self.assertIsNone(animal.media_changed_at)
+        send_season_batches.assert_called_once_with([animal.pk], RenderQueue.UPLOADS)
+
+    def test_render_of_replaced_media_is_not_kept(self):
+        Animal.objects.filter(pk=self.animal.pk).update(cover='animals/A1.png')
+
+        send_season_batches = self.finish()
+
+        self.assertEqual(Animal.objects.get(pk=self.animal.pk).status, AnimalStatus.UNPROCESSED)
+        send_season_batches.assert_called_once_with([self.animal.pk], RenderQueue.UPLOADS)
+
+    def test_superseded_render_is_not_a_deferral(self):
+        for _ in range(2):
+            RenderJob.objects.create(animal=self.animal, started_at=timezone.now(), status=RenderJobStatus.DEFERRED)
+
+        def replace_cover(animal, context=None):
+            # The render is deferred for memory while an editor uploads a new cover
+            Animal.objects.filter(pk=animal.pk).update(cover='animals/A1-new.png', media_changed_at=timezone.now())
+            return None, None, AnimalStatus.UNPROCESSED, None
+
+        scratch_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, scratch_root, ignore_errors=True)
+        with override_settings(VIDEO_SCRATCH_ROOT=scratch_root), \
+                mock.patch.object(AnimalServices, 'process_animal', side_effect=replace_cover), \
+                mock.patch('core.tasks.send_season_batches') as send_season_batches, \
+                self.captureOnCommitCallbacks(execute=True):
+            retry_after = AnimalServices.render_animal(self.animal)
+
+        self.assertIsNone(retry_after)
+        self.assertEqual(RenderJob.objects.latest('started_at').status, RenderJobStatus.SUPERSEDED)
+        animal = Animal.objects.get(pk=self.animal.pk)
+        self.assertEqual((animal.status, animal.retry_after), (AnimalStatus.UNPROCESSED, None))
+        send_season_batches.assert_called_once_with([animal.pk], RenderQueue.UPLOADS)
+        # The next deferral backs off from the start
+        backoff = AnimalServices.deferral_retry_after(animal.pk) - timezone.now()
+        self.assertAlmostEqual(backoff.total_seconds(), settings.VIDEO_LEASE_BACKOFF, delta=5)
+
+    def test_broker_outage_does_not_fail_the_save(self):
+        animal = Animal.objects.get(pk=self.animal.pk)
+        animal.original_video = 'animals/A1-new.mp4'
+        with mock.patch.object(MediaMetadataService, 'collect', return_value={}), \
+                mock.patch('core.tasks.enqueue_changed_animals', side_effect=OSError('broker is down')), \
+                self.assertLogs('django', 'ERROR') as logs, \
+                self.captureOnCommitCallbacks(execute=True):
+            animal.save()
+
+        self.assertIn('enqueue_pending_animals', logs.output[0])
+        self.assertEqual(Animal.objects.get(pk=animal.pk).original_video.name, 'animals/A1-new.mp4')
+
+    def test_unchanged_media_stays_processed(self):
+        send_season_batches = self.finish()
+
+        self.assertEqual(Animal.objects.get(pk=self.animal.pk).status, AnimalStatus.PROCESSED)
+        send_season_batches.assert_not_called()
+
+
+class RenderQueueClaimTests(TestCase):
+    def test_claim_only_locks_animal_rows(self):
+        # SQLite has no row locks, the query is compiled for the PostgreSQL backend production runs on
+        postgres = PostgresDatabaseWrapper({**connection.settings_dict, 'ENGINE': 'django.db.backends.postgresql'})
+        queryset = RenderQueueService.claimable(AnimalServices.fetch_animals_for_auto_processing())
+        with mock.patch.object(postgres, 'get_autocommit', return_value=False):
+            sql, _ = queryset.values_list('id', flat=True).query.get_compiler(connection=postgres).as_sql()
+
+        self.assertIn('JOIN "core_season"', sql)
+        self.assertTrue(sql.endswith('FOR UPDATE OF "core_animal" SKIP LOCKED'), sql)
+
+    def test_claim_marks_animals_once(self):
+        season = Season.objects.create(name='Test', auto_process=True)
+        for code in ('A1', 'A2'):
+            animal = Animal.objects.create(season=season, code=code)
+            Animal.objects.filter(pk=animal.pk).update(original_video=f'animals/{code}.mp4')
+        queryset = AnimalServices.fetch_animals_for_auto_processing()
+
+        first, second = RenderQueueService.claim(queryset, 5), RenderQueueService.claim(queryset, 5)
+
+        self.assertEqual(len(first), 2)
+        self.assertEqual(second, [])
+        self.assertEqual(Animal.objects.filter(queued_at__isnull=False).count(), 2)
+
+
+class RenderLeaseTests(TestCase):
+    def setUp(self):
+        self.now = timezone.now()
+        self.animal = Animal.objects.create(season=Season.objects.create(name='Test'), code='A1')
+        self.owner = 'worker-1:100'
+        self.start_render()
+
+    def start_render(self):
+        Animal.objects.filter(pk=self.animal.pk).update(
+            status=AnimalStatus.PROCESSING, lease_owner=self.owner, lease_started_at=self.now,
+            lease_heartbeat_at=self.now, updated_at=self.now)
+        return RenderJob.objects.create(animal=self.animal, season=self.animal.season, started_at=self.now)
+
+    def reclaim_after(self, seconds):
+        with mock.patch('core.lease.timezone.now', return_value=self.now + timedelta(seconds=seconds)):
+            return RenderLease.reclaim()
+
+    def test_live_lease_is_kept(self):
+        self.assertEqual(self.reclaim_after(settings.VIDEO_LEASE_TIMEOUT - 1), {})
+
+        animal = Animal.objects.get(pk=self.animal.pk)
+        self.assertEqual(animal.status, AnimalStatus.PROCESSING)
+        self.assertEqual(animal.lease_owner, self.owner)
+        self.assertEqual(RenderJob.objects.get().status, RenderJobStatus.RUNNING)
+
+    def test_expired_lease_is_queued_again_after_a_backoff(self):
+        reclaimed_at = self.now + timedelta(seconds=settings.VIDEO_LEASE_TIMEOUT + 1)
+        reclaimed = self.reclaim_after(settings.VIDEO_LEASE_TIMEOUT + 1)
+
+        retry_after = reclaimed_at + timedelta(seconds=settings.VIDEO_LEASE_BACKOFF)
+        self.assertEqual(reclaimed, {self.animal.pk: retry_after})
+        animal = Animal.objects.get(pk=self.animal.pk)
+        self.assertEqual((animal.status, animal.attempts, animal.retry_after),
+                         (AnimalStatus.UNPROCESSED, 1, retry_after))
+        self.assertEqual((animal.lease_owner, animal.lease_heartbeat_at), ('', None))
+        job = RenderJob.objects.get()
+        self.assertEqual((job.status, job.finished_at), (RenderJobStatus.ABANDONED, reclaimed_at))
+
+    @override_settings(VIDEO_LEASE_MAX_ATTEMPTS=3, VIDEO_LEASE_BACKOFF=60, VIDEO_LEASE_MAX_BACKOFF=90)
+    def test_backoff_grows_until_the_animal_is_given_up(self):
+        backoffs = []
+        for _ in range(3):
+            self.start_render()
+            reclaimed = self.reclaim_after(settings.VIDEO_LEASE_TIMEOUT + 1)
+            retry_after = reclaimed[self.animal.pk]
+            expired_at = self.now + timedelta(seconds=settings.VIDEO_LEASE_TIMEOUT + 1)
+            backoffs.append(retry_after and (retry_after - expired_at).total_seconds())
+
+        # Capped at VIDEO_LEASE_MAX_BACKOFF, the third expiry uses up the attempts
+        self.assertEqual(backoffs, [60, 90, None])
+        animal = Animal.objects.get(pk=self.animal.pk)
+        self.assertEqual((animal.status, animal.attempts, animal.retry_after), (AnimalStatus.ERROR, 3, None))
+        self.assertEqual(set(RenderJob.objects.values_list('status', flat=True)), {RenderJobStatus.ABANDONED})
+
+    def test_row_without_heartbeat_expires_after_the_task_time_limit(self):
+        # Rows put in PROCESSING before leases existed
+        Animal.objects.filter(pk=self.animal.pk).update(lease_owner='', lease_heartbeat_at=None)
+
+        self.assertEqual(self.reclaim_after(settings.VIDEO_LEASE_TIMEOUT + 1), {})
+        self.assertEqual(list(self.reclaim_after(settings.CELERY_TASK_TIME_LIMIT + 1)), [self.animal.pk])
+        self.assertEqual(Animal.objects.get(pk=self.animal.pk).status, AnimalStatus.UNPROCESSED)
+
+    def test_heartbeat_stops_once_the_lease_is_lost(self):
+        lease = RenderLease(self.animal.pk, self.owner)
+        with mock.patch('core.lease.timezone.now', return_value=self.now + timedelta(seconds=10)):
+            self.assertTrue(lease.beat())
+        self.assertEqual(Animal.objects.get(pk=self.animal.pk).lease_heartbeat_at, self.now + timedelta(seconds=10))
+
+        self.reclaim_after(settings.VIDEO_LEASE_TIMEOUT + 11)
+        self.assertFalse(lease.beat())
+        self.assertFalse(RenderLease(self.animal.pk, 'worker-2:100').beat())
+
+
+class RenderKeyTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(
+            MEDIA_ROOT=self.media_root, VIDEO_SCRATCH_ROOT=os.path.join(self.media_root, 'scratch'))
+        self.settings_override.enable()
+        season = Season.objects.create(name='Test')
+        self.animal = Animal.objects.create(season=season, code='A1')
+        Season.objects.filter(pk=season.pk).update(
+            frame=self.write('seasons/frame.png'), logo=self.write('seasons/logo.png'))
+        Animal.objects.filter(pk=self.animal.pk).update(
+            original_video=self.write('animals/A1.mp4'), cover=self.write('animals/A1.png'),
+            processed_video=self.write('animals/A1_processed.mp4'), status=AnimalStatus.PROCESSED)
+        self.store_key()
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root, ignore_errors=True)
+
+    def write(self, name, content=b'initial'):
+        path = Path(self.media_root) / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(content)
+        return name
+
+    def animal_and_engine(self):
+        animal = Animal.objects.select_related('season').get(pk=self.animal.pk)
+        return animal, RENDER_ENGINES[animal.season.render_engine]
+
+    def store_key(self):
+        render_key = RenderKeyService.build(*self.animal_and_engine())
+        Animal.objects.filter(pk=self.animal.pk).update(render_key=render_key.key, render_key_parts=render_key.parts)
+
+    def assert_changed(self, part):
+        animal, engine = self.animal_and_engine()
+        with self.assertLogs('core.render_key', 'INFO') as logs:
+            self.assertFalse(RenderKeyService.is_current(animal, RenderKeyService.build(animal, engine)))
+        self.assertEqual(logs.output, [f'INFO:core.render_key:render_key - {animal} changed inputs: {part}'])
+
+    def test_unchanged_animal_is_skipped(self):
+        with mock.patch.object(VideoConcatenationService, 'concatenate_sacrifice_clips') as render:
+            make_animal_video(self.animal.pk, force=True)
+
+        render.assert_not_called()
+        self.assertEqual(RenderJob.objects.get().status, RenderJobStatus.SKIPPED)
+        animal = Animal.objects.get(pk=self.animal.pk)
+        self.assertEqual((animal.status, animal.processed_video.name),
+                         (AnimalStatus.PROCESSED, 'animals/A1_processed.mp4'))
+
+    def test_changed_media_changes_the_key(self):
+        for part, name in (('cover', 'animals/A1.png'), ('frame', 'seasons/frame.png'), ('logo', 'seasons/logo.png')):
+            with self.subTest(part=part):
+                self.write(name, f'changed {part}'.encode())
+                self.assert_changed(part)
+                self.store_key()
+
+    def test_changed_engine_changes_the_key(self):
+        Season.objects.filter(pk=self.animal.season_id).update(render_engine=RenderEngine.FFMPEG)
+        self.assert_changed('engine')
+        self.store_key()
+
+        with mock.patch.object(FFmpegConcatenationService, 'version', FFmpegConcatenationService.version + 1):
+            self.assert_changed('engine')
+
+    def test_missing_processed_video_is_not_current(self):
+        os.remove(os.path.join(self.media_root, 'animals/A1_processed.mp4'))
+        animal, engine = self.animal_and_engine()
+
+        self.assertFalse(RenderKeyService.is_current(animal, RenderKeyService.build(animal, engine)))
+
+
+class RenderWorkspaceTests(TestCase):
+    def setUp(self):
+        self.scratch_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(
+            VIDEO_SCRATCH_ROOT=self.scratch_root, VIDEO_SCRATCH_QUOTA_BYTES=1000, VIDEO_SCRATCH_MIN_FREE_BYTES=0)
+        self.settings_override.enable()
+        self.animal = Animal.objects.create(season=Season.objects.create(name='Test'), code='A1')
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.scratch_root, ignore_errors=True)
+
+    def create_workspace(self, status=RenderJobStatus.RUNNING, size=100):
+        job = RenderJob.objects.create(animal=self.animal, started_at=timezone.now(), status=status)
+        workspace = RenderWorkspace(f'animal-{self.animal.pk}', render_job_id=job.pk).__enter__()
+        temp_directory.reset(workspace.token)
+        (workspace.path / 'video.mp4').write_bytes(b'0' * size)
+        return workspace.path
+
+    def test_quota_counts_the_scratch_root(self):
+        RenderWorkspace.check_quota(1000)
+        self.create_workspace(size=600)
+
+        with self.assertRaisesRegex(WorkspaceQuotaError, 'quota'):
+            RenderWorkspace.check_quota(500)
+        with override_settings(VIDEO_SCRATCH_MIN_FREE_BYTES=shutil.disk_usage(self.scratch_root).free):
+            with self.assertRaisesRegex(WorkspaceQuotaError, 'disk space'):
+                RenderWorkspace.check_quota(1)
+
+    def test_workspace_is_removed_when_the_render_raises(self):
+        with self.assertRaises(ValueError), RenderWorkspace('animal-1') as workspace:
+            self.assertEqual(temp_directory.get(), str(workspace.path))
+            raise ValueError
+
+        self.assertFalse(workspace.path.exists())
+        self.assertIsNone(temp_directory.get())
+
+    def test_sweep_follows_the_render_job(self):
+        running = self.create_workspace()
+        abandoned = self.create_workspace(RenderJobStatus.ABANDONED)
+        failed = self.create_workspace(RenderJobStatus.FAILED)
+
+        ended_bytes = RenderWorkspace.usage(abandoned) + RenderWorkspace.usage(failed)
+
+        # Neither its age nor whether its PID is alive matter while the job runs
+        with mock.patch('core.workspace.time.time', return_value=time.time() + settings.VIDEO_SCRATCH_MAX_AGE * 2):
+            self.assertEqual(RenderWorkspace.sweep(), ended_bytes)
+
+        self.assertEqual([path.exists() for path in (running, abandoned, failed)], [True, False, False])
+
+    def test_sweep_removes_files_of_no_job_after_max_age(self):
+        root = Path(self.scratch_root)
+        (root / 'stray').mkdir()
+        (root / 'stray.mp4').write_bytes(b'0' * 10)
+
+        self.assertEqual(RenderWorkspace.sweep(max_age=60), 0)
+        with mock.patch('core.workspace.time.time', return_value=time.time() + 61):
+            self.assertEqual(RenderWorkspace.sweep(max_age=60), 10)
+        self.assertEqual(list(root.iterdir()), [])
+
+
+def ffmpeg_children() -> list[int]:
+    """ffmpeg processes whose parent is this process, zombies included."""
+    pids = []
+    for stat_path in Path('/proc').glob('[0-9]*/stat'):
+        try:
+            stat = stat_path.read_text()
+        except OSError:
+            continue
+        name, fields = stat[stat.index('(') + 1:stat.rindex(')')], stat[stat.rindex(')') + 2:].split()
+        if int(fields[1]) == os.getpid() and 'ffmpeg' in name:
+            pids.append(int(stat_path.parent.name))
+    return pids
+
+
+@skipUnless(shutil.which(settings.FFMPEG_BINARY) and os.path.isdir('/proc'), 'ffmpeg and procfs are required')
+class ClipScopeTests(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        # The intro and outro readers are what the scope has to close, they are not taken from the segment cache
+        self.settings_override = override_settings(
+            VIDEO_SCRATCH_ROOT=os.path.join(self.directory, 'scratch'),
+            VIDEO_CACHE_ROOT=os.path.join(self.directory, 'cache'), VIDEO_SEGMENT_CACHE=False)
+        self.settings_override.enable()
+        self.video_path = os.path.join(self.directory, 'video.mp4')
+        FFmpegService.run([
+            '-f', 'lavfi', '-i', 'testsrc2=size=160x120:rate=30:duration=1',
+            '-f', 'lavfi', '-i', 'sine=duration=1', '-c:v', 'libx264', '-c:a', 'aac', '-shortest', self.video_path
+        ])
+        self.frame_path = os.path.join(self.directory, 'frame.png')
+        Image.new('RGBA', (160, 120), (255, 255, 255, 128)).save(self.frame_path)
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def plan(self, video_size=(160, 120), outro_path=None) -> RenderPlan:
+        video = InputPlan('video', self.video_path, *video_size, 1.0, 30, True)
+        intro = InputPlan('intro', self.video_path, 160, 120, 1.0, 30, True)
+        outro = InputPlan('outro', outro_path, 160, 120, 1.0, 30, True) if outro_path else None
+        inputs = tuple(item for item in (intro, video, outro) if item)
+        return RenderPlan(160, 120, 30, 44100, sum(item.duration for item in inputs), inputs)
+
+    def render(self, plan):
+        django_file, temp_video_path = VideoConcatenationService.concatenate_sacrifice_clips(
+            self.video_path, None, None, None, self.frame_path, None, None, None, 0, 0, 0, 0, plan=plan, workers=1)
+        django_file.close()
+        os.remove(temp_video_path)
+
+    def test_renders_leave_no_ffmpeg_children(self):
+        for _ in range(2):
+            self.render(self.plan())
+            self.assertEqual(ffmpeg_children(), [])
+
+            # The outro fails to open after the intro and the clip readers were started
+            with self.assertRaises(OSError):
+                self.render(self.plan(outro_path=os.path.join(self.directory, 'missing.mp4')))
+            self.assertEqual(ffmpeg_children(), [])
+
+            # The overlay does not match the frames, writing fails on the first frame of the clip
+            with self.assertRaises(ValueError):
+                self.render(self.plan(video_size=(320, 240)))
+            self.assertEqual(ffmpeg_children(), [])
+
+
+@skipUnless(shutil.which(settings.FFMPEG_BINARY) and shutil.which(settings.FFPROBE_BINARY),
+            'ffmpeg and ffprobe are required')
+class SegmentCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.settings_override = override_settings(
+            VIDEO_SCRATCH_ROOT=os.path.join(self.directory, 'scratch'),
+            VIDEO_CACHE_ROOT=os.path.join(self.directory, 'cache'), VIDEO_SEGMENT_CACHE=True)
+        self.settings_override.enable()
+        self.intro_path = os.path.join(self.directory, 'intro.mp4')
+        FFmpegService.run([
+            '-f', 'lavfi', '-i', 'testsrc2=size=320x240:rate=25:duration=1',
+            '-f', 'lavfi', '-i', 'sine=duration=1', '-c:v', 'libx264', '-c:a', 'aac', '-ac', '1', '-shortest',
+            self.intro_path
+        ])
+        # A clip without audio gets a silent track, otherwise it could not be joined with the segments
+        self.video_path = os.path.join(self.directory, 'video.mp4')
+        FFmpegService.run([
+            '-f', 'lavfi', '-i', 'testsrc2=size=160x120:rate=30:duration=1', '-c:v', 'libx264', self.video_path
+        ])
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_moviepy_render_joins_cached_intro_and_outro(self):
+        intro = InputPlan('intro', self.intro_path, 320, 240, 1.0, 25, True, 'scale')
+        video = InputPlan('video', self.video_path, 160, 120, 1.0, 30, False)
+        outro = InputPlan('outro', self.intro_path, 320, 240, 1.0, 25, True, 'scale')
+        plan = RenderPlan(160, 120, 30, 44100, 3.0, (intro, video, outro))
+
+        build_command = FFmpegConcatenationService.build_command
+        for encoded_segments in (1, 0):
+            with mock.patch.object(FFmpegConcatenationService, 'build_command',
+                                   side_effect=build_command) as segment_command:
+                django_file, temp_video_path = VideoConcatenationService.concatenate_sacrifice_clips(
+                    self.video_path, None, self.intro_path, self.intro_path, None, None, None, None, 0, 0, 0, 0,
+                    plan=plan, workers=1)
+            django_file.close()
+            # Intro and outro are the same file, it is encoded once and stream copied on every render after
+            self.assertEqual(segment_command.call_count, encoded_segments)
+            self.assertEqual(ProbeService.frame_count(temp_video_path), plan.frames)
+            os.remove(temp_video_path)
+
+    def test_engines_render_the_planned_frames(self):
+        # Durations that are no whole number of output frames, the fps filter alone rounds every segment down
+        intro_path, video_path = os.path.join(self.directory, 'intro2.mp4'), os.path.join(self.directory, 'video2.mp4')
+        FFmpegService.run([
+            '-f', 'lavfi', '-i', 'testsrc2=size=320x240:rate=25:duration=1.37',
+            '-f', 'lavfi', '-i', 'sine=duration=1.37', '-c:v', 'libx264', '-c:a', 'aac', '-shortest', intro_path
+        ])
+        FFmpegService.run([
+            '-f', 'lavfi', '-i', 'testsrc2=size=120x200:rate=29.97:duration=2.53',
+            '-f', 'lavfi', '-i', 'sine=duration=2.53', '-c:v', 'libx264', '-c:a', 'aac', '-shortest', video_path
+        ])
+        cover_path = os.path.join(self.directory, 'cover.png')
+        Image.new('RGB', (200, 100), (10, 200, 30)).save(cover_path)
+        plan = RenderPlanner.plan(video_path, cover_path, intro_path, intro_path)
+
+        for segment_cache in (False, True):
+            for engine in (FFmpegConcatenationService, VideoConcatenationService):
+                with self.subTest(engine=engine.__name__, segment_cache=segment_cache), \
+                        override_settings(VIDEO_SEGMENT_CACHE=segment_cache):
+                    django_file, temp_video_path = engine.concatenate_sacrifice_clips(
+                        video_path, cover_path, intro_path, intro_path, None, None, None, None, 0, 0, 0, 0,
+                        plan=plan, workers=1)
+                    django_file.close()
+                    self.assertEqual(ProbeService.frame_count(temp_video_path), plan.frames)
+                    os.remove(temp_video_path)
+
+    @override_settings(VIDEO_SEGMENT_CACHE=False)
+    def test_parallel_render_uses_the_batch_context(self):
+        plan = RenderPlanner.plan(self.video_path, None, self.intro_path, self.intro_path)
+        with SeasonRenderContext(None) as context:
+            django_file, temp_video_path = VideoConcatenationService.concatenate_sacrifice_clips(
+                self.video_path, None, self.intro_path, self.intro_path, None, None, None, None, 0, 0, 0, 0,
+                plan=plan, workers=2, context=context)
+            django_file.close()
+            # Intro and outro are the same file, one reader of the batch serves both
+            self.assertEqual(list(context.clips), [(self.intro_path, tuple(plan.size))])
+        self.assertEqual(ProbeService.frame_count(temp_video_path), plan.frames)
+        os.remove(temp_video_path)
+
+
+def write_chunk(label, start_frame, frame_count, output_path, threads):
+    """Stands in for render_chunk, the encode_chunk process imports it from this module."""
+    with open(output_path, 'w') as f:
+        f.write(f'{label} {start_frame} {frame_count} {settings.VIDEO_PROGRESS_INTERVAL}')
+
+
+def encode_chunks(results):
+    try:
+        chunk_paths = ChunkedEncodingService.encode(write_chunk, ('chunk',), [(0, 60), (60, 30)], workers=2)
+        results.put([Path(path).read_text() for path in chunk_paths])
+        ChunkedEncodingService.cleanup(chunk_paths)
+    except BaseException as e:
+        results.put(repr(e))
+
+
+class ChunkedEncodingTests(SimpleTestCase):
+    @override_settings(VIDEO_PROGRESS_INTERVAL=7.5)
+    def test_chunks_are_encoded_inside_a_daemonic_worker(self):
+        # The prefork pool of a Celery worker runs tasks in daemonic processes like this one
+        context = multiprocessing.get_context('fork')
+        results = context.Queue()
+        process = context.Process(target=encode_chunks, args=(results,), daemon=True)
+        process.start()
+        result = results.get(timeout=120)
+        process.join()
+
+        # Settings changed at runtime reach the chunk processes too
+        self.assertEqual(result, ['chunk 0 60 7.5', 'chunk 60 30 7.5'])
+
+
+@override_settings(VIDEO_TRACE_SPANS=True, VIDEO_PROFILE_SAMPLE_RATE=0)
+class RenderTraceTests(SimpleTestCase):
+    def test_spans_nest_and_per_frame_calls_are_aggregated(self):
+        resize = RenderTrace.timed('resize', lambda frame: frame)
+        with self.assertLogs('core.tracing', 'INFO') as logs:
+            with RenderTrace('render-1'):
+                with RenderTrace.span('load', path='video.mp4'):
+                    with RenderTrace.span('open'):
+                        pass
+                with contextlib.suppress(ValueError), RenderTrace.span('encode'):
+                    for frame in range(3):
+                        resize(frame)
+                    raise ValueError('the span of a failing stage is still closed')
+            # Outside a trace spans and timed functions do nothing
+            with RenderTrace.span('publish') as span:
+                self.assertIsNone(span)
+            self.assertEqual(resize(4), 4)
+
+        self.assertEqual(len(logs.records), 1)
+        root = json.loads(logs.records[0].getMessage().removeprefix('render_trace - '))
+        self.assertEqual(root['name'], 'render-1')
+        load, encode = root['children']
+        self.assertEqual((load['name'], load['attributes']), ('load', {'path': 'video.mp4'}))
+        self.assertEqual([span['name'] for span in load['children']], ['open'])
+        self.assertEqual(encode['name'], 'encode')
+        self.assertEqual([(span['name'], span['calls']) for span in encode['children']], [('resize', 3)])
+        self.assertNotIn('at_ms', encode['children'][0])
+
+    def test_profiled_trace_writes_the_profile_and_chrome_trace(self):
+        with tempfile.TemporaryDirectory() as directory, override_settings(VIDEO_TRACE_ROOT=directory):
+            with RenderTrace('render-2', profiler='cprofile'):
+                with RenderTrace.span('encode'):
+                    sum(range(1000))
+
+            files = sorted(path.name for path in Path(directory).iterdir())
+            self.assertEqual([name.split('.', 1)[1] for name in files], ['prof', 'trace.json'])
+            self.assertTrue(all(name.startswith('render-2-') for name in files))
+            events = json.loads(next(Path(directory).glob('*.trace.json')).read_text())['traceEvents']
+            self.assertEqual([event['name'] for event in events], ['render-2', 'encode'])
+            self.assertGreaterEqual(events[1]['ts'], events[0]['ts'])
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+                   VIDEO_PROGRESS_INTERVAL=0, VIDEO_SEGMENT_CACHE=False)
+class RenderProgressTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.directory = tempfile.mkdtemp()
+        self.settings_override = override_settings(VIDEO_SCRATCH_ROOT=self.directory)
+        self.settings_override.enable()
+        self.video_path = os.path.join(self.directory, 'video.mp4')
+        FFmpegService.run([
+            '-f', 'lavfi', '-i', 'testsrc2=size=160x120:rate=30:duration=1', '-c:v', 'libx264', self.video_path
+        ])
+        video = InputPlan('video', self.video_path, 160, 120, 1.0, 30, False)
+        self.plan = RenderPlan(160, 120, 30, 44100, 1.0, (video,))
+        self.animal = Animal.objects.create(season=Season.objects.create(name='Test'), code='A1')
+        Animal.objects.filter(pk=self.animal.pk).update(status=AnimalStatus.PROCESSING)
+        self.client.force_login(get_user_model().objects.create_superuser('admin', 'admin@example.com', 'admin'))
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def poll(self, **params):
+        return self.client.get(reverse('admin:core_animal_progress'), params).json()
+
+    def test_render_reports_its_stage_and_frames(self):
+        for engine in (FFmpegConcatenationService, VideoConcatenationService):
+            with self.subTest(engine=engine.__name__):
+                with RenderProgress(self.animal.pk):
+                    self.assertEqual(self.poll()[str(self.animal.pk)]['stage'], 'preparing')
+                    django_file, temp_video_path = engine.concatenate_sacrifice_clips(
+                        self.video_path, None, None, None, None, None, None, None, 0, 0, 0, 0,
+                        plan=self.plan, workers=1)
+                    django_file.close()
+                    os.remove(temp_video_path)
+
+                    progress = self.poll(ids=str(self.animal.pk))[str(self.animal.pk)]
+                    self.assertEqual(progress['stage'], 'encoding')
+                    self.assertEqual((progress['frames'], progress['total_frames']), (30, 30))
+                    self.assertEqual(progress['percent'], 100.0)
+                # A finished render leaves nothing behind for the next poll
+                self.assertEqual(self.poll(), {})
+
+
+class SimulateEidLoadTests(TransactionTestCase):
+    def test_schedule_is_seeded_and_reuploads_follow_their_upload(self):
+        def schedule(seed):
+            command = SimulateEidLoadCommand()
+            command.random = random.Random(seed)
+            return command.schedule({'animals': 20, 'hours': 1, 'reuploads': 0.1, 'force_renders': 3})
+
+        events = schedule(1)
+        self.assertEqual(events, schedule(1))
+        self.assertEqual(events, sorted(events))
+        self.assertEqual([event for _, event, _ in events].count('upload'), 20)
+        self.assertEqual([event for _, event, _ in events].count('force_render'), 3)
+        uploads = {index: at for at, event, index in events if event == 'upload'}
+        reuploads = [(at, index) for at, event, index in events if event == 'reupload']
+        self.assertEqual(len(reuploads), 2)
+        self.assertTrue(all(uploads[index] < at <= 3600 for at, index in reuploads))
+
+    def test_replays_uploads_with_eager_tasks_and_cleans_up(self):
+        with tempfile.TemporaryDirectory() as directory, \
+                override_settings(DEBUG=True, MEDIA_ROOT=os.path.join(directory, 'media'),
+                                  VIDEO_SCRATCH_ROOT=os.path.join(directory, 'scratch'),
+                                  VIDEO_CACHE_ROOT=os.path.join(directory, 'cache'), VIDEO_QUEUE_SLOTS=1,
+                                  CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+                                  CELERY_TASK_ALWAYS_EAGER=True), \
+                mock.patch.object(current_app.control, 'ping', return_value=[{'worker@test': {'ok': 'pong'}}]), \
+                mock.patch.object(RenderQueueService, 'queue_depths', return_value={}):
+            output = os.path.join(directory, 'eid.json')
+            call_command('simulate_eid_load', animals=2, shares=1, hours=0.001, speedup=1, reuploads=0.5,
+                         force_renders=1, admins=1, admin_interval=0.5, resolution='720p', duration=1,
+                         engine=RenderEngine.FFMPEG, sample_interval=0.5, timeout=60, output=output,
+                         stdout=io.StringIO())
+            report = json.loads(Path(output).read_text())
+            media = [path for path in Path(directory, 'media').rglob('*') if path.is_file()]
+
+        # Every upload and the reupload were rendered in the task they queued
+        self.assertEqual(report['uploads'], 3)
+        self.assertEqual(report['animals'], {'processed': 2})
+        self.assertEqual((report['latency_seconds']['count'], report['latency_seconds']['pending']), (3, 0))
+        self.assertTrue(report['timeline'])
+        # Polls that met the SQLite table lock of a render count as errors, only PostgreSQL serves them all
+        self.assertTrue(report['admin_seconds']['progress']['count'])
+        # The season, its animals, the admin user and their files are removed
+        self.assertFalse(Season.objects.exists())
+        self.assertFalse(Animal.objects.exists())
+        self.assertFalse(get_user_model().objects.exists())
+        self.assertEqual(media, [])
+
+
+SAMPLE_LINE = re.compile(r'^([a-zA-Z_:][a-zA-Z0-9_:]*)(?:\{(.*)\})? (\S+)$')
+LABEL = re.compile(r'([a-zA-Z_][a-zA-Z0-9_]*)="((?:[^"\\]|\\.)*)"')
+
+
+def parse_metrics(text) -> dict:
+    """Samples of a text exposition by name and labels, every line must be a comment or a valid sample."""
+    samples = {}
+    for line in text.splitlines():
+        if line.startswith('# HELP ') or line.startswith('# TYPE '):
+            continue
+        match = SAMPLE_LINE.match(line)
+        assert match, f'invalid sample line: {line!r}'
+        name, labels, value = match.groups()
+        samples[name, frozenset(LABEL.findall(labels or ''))] = float(value)
+    return samples
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+                   METRICS_TOKEN='', VIDEO_METRICS_BUCKETS=[1.0, 10.0, 60.0])
+class MetricsEndpointTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        season = Season.objects.create(name='Test', year=2024)
+        for code, status in (('A1', AnimalStatus.PROCESSED), ('A2', AnimalStatus.PROCESSED),
+                             ('A3', AnimalStatus.ERROR), ('A4', AnimalStatus.UNPROCESSED)):
+            Animal.objects.create(season=season, code=code, status=status)
+        animal = Animal.objects.first()
+        now = timezone.now()
+        jobs = (
+            (RenderJobStatus.SUCCEEDED, 5.0, 4.0, 250, ''),
+            (RenderJobStatus.SUCCEEDED, 30.0, 20.0, 750, ''),
+            (RenderJobStatus.FAILED, 0.5, None, None, 'OSError'),
+            (RenderJobStatus.ABANDONED, None, None, None, ''),
+        )
+        for status, duration, encode, frames, error_type in jobs:
+            job = RenderJob.objects.create(
+                animal=animal, season=season, status=status, started_at=now, finished_at=now,
+                duration_seconds=duration, encode_seconds=encode, frames=frames, error_type=error_type,
+                input_bytes=1000 if duration else None, output_bytes=500 if frames else None)
+            RenderCounters.record(job, RenderJobRecorder.stages)
+        RenderJob.objects.create(animal=animal, season=season, started_at=now, duration_seconds=100.0)
+
+    def scrape(self, **headers):
+        depths = {queue: index for index, queue in enumerate([*RenderQueue.values, 'celery'])}
+        with mock.patch.object(RenderQueueService, 'queue_depths', return_value=depths):
+            return self.client.get('/metrics', headers=headers)
+
+    def test_scrape_reports_render_and_queue_metrics(self):
+        response = self.scrape()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        samples = parse_metrics(response.content.decode())
+
+        def sample(name, **labels):
+            return samples[name, frozenset((key, str(value)) for key, value in labels.items())]
+
+        # The running job is not counted, buckets are cumulative
+        self.assertEqual(sample('sacrifice_render_stage_seconds_bucket', stage='total', le='1.0'), 1)
+        self.assertEqual(sample('sacrifice_render_stage_seconds_bucket', stage='total', le='10.0'), 2)
+        self.assertEqual(sample('sacrifice_render_stage_seconds_bucket', stage='total', le='+Inf'), 3)
+        self.assertEqual(sample('sacrifice_render_stage_seconds_count', stage='total'), 3)
+        self.assertEqual(sample('sacrifice_render_stage_seconds_sum', stage='total'), 35.5)
+        self.assertEqual(sample('sacrifice_render_stage_seconds_count', stage='encode'), 2)
+        self.assertEqual(sample('sacrifice_render_stage_seconds_sum', stage='encode'), 24.0)
+
+        self.assertEqual(sample('sacrifice_render_frames_total'), 1000)
+        self.assertEqual(sample('sacrifice_render_input_bytes_total'), 3000)
+        self.assertEqual(sample('sacrifice_render_output_bytes_total'), 1000)
+        self.assertEqual(sample('sacrifice_render_jobs_total', status='succeeded'), 2)
+        self.assertEqual(sample('sacrifice_render_failures_total', error_type='OSError'), 1)
+        self.assertEqual(sample('sacrifice_render_lease_expiries_total'), 1)
+        self.assertEqual(sample('sacrifice_render_encode_fps'), 0)
+
+        self.assertEqual(sample('sacrifice_broker_up'), 1)
+        self.assertEqual(sample('sacrifice_queue_depth', queue=RenderQueue.UPLOADS), 1)
+        self.assertEqual(sample('sacrifice_queue_depth', queue='celery'), 3)
+        self.assertEqual(sample('sacrifice_queue_wait_seconds_count', queue=RenderQueue.BULK), 0)
+
+        self.assertEqual(sample('sacrifice_animals', year=2024, season='Test', status='processed'), 2)
+        self.assertEqual(sample('sacrifice_animals', year=2024, season='Test', status='error'), 1)
+        self.assertEqual(sample('sacrifice_animals', year=2024, season='Test', status='processing'), 0)
+
+    def test_counters_do_not_go_down_when_jobs_are_deleted(self):
+        before = parse_metrics(self.scrape().content.decode())
+        Animal.objects.all().delete()
+        after = parse_metrics(self.scrape().content.decode())
+
+        self.assertFalse(RenderJob.objects.exists())
+        counters = [key for key in before if key[0].endswith(('_total', '_bucket', '_count', '_sum'))]
+        self.assertEqual({key: after[key] for key in counters}, {key: before[key] for key in counters})
+
+    def test_finished_and_abandoned_renders_are_counted(self):
+        animal = Animal.objects.create(season=Season.objects.get(), code='A5')
+        with RenderJobRecorder(animal) as recorder:
+            recorder.finish(RenderJobStatus.SKIPPED)
+        job = RenderJob.objects.create(animal=animal, started_at=timezone.now(), input_bytes=300)
+        Animal.objects.filter(pk=animal.pk).update(
+            status=AnimalStatus.PROCESSING, lease_heartbeat_at=timezone.now() - timedelta(days=1))
+        with self.captureOnCommitCallbacks(execute=True):
+            RenderLease.reclaim()
+
+        self.assertEqual(RenderJob.objects.get(pk=job.pk).status, RenderJobStatus.ABANDONED)
+        samples = parse_metrics(self.scrape().content.decode())
+        self.assertEqual(samples['sacrifice_render_jobs_total', frozenset({('status', 'skipped')})], 1)
+        self.assertEqual(samples['sacrifice_render_lease_expiries_total', frozenset()], 2)
+        self.assertEqual(samples['sacrifice_render_input_bytes_total', frozenset()], 3300)
+
+    def test_broker_outage_does_not_fail_the_scrape(self):
+        with mock.patch.object(RenderQueueService, 'queue_depths', side_effect=ConnectionError('broker is down')):
+            response = self.client.get('/metrics')
+
+        self.assertEqual(response.status_code, 200)
+        samples = parse_metrics(response.content.decode())
+        self.assertEqual(samples['sacrifice_broker_up', frozenset()], 0)
+        self.assertFalse([name for name, labels in samples if name == 'sacrifice_queue_depth'])
+
+    @override_settings(METRICS_TOKEN='secret')
+    def test_token_is_required_when_set(self):
+        self.assertEqual(self.scrape().status_code, 401)
+        self.assertEqual(self.scrape(Authorization='Bearer wrong').status_code, 401)
+        self.assertEqual(self.scrape(Authorization='Bearer secret').status_code, 200)
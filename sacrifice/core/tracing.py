@@ -0,0 +1,178 @@
+import json
+import time
+import random
+import logging
+import cProfile
+import contextlib
+from pathlib import Path
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+
+from django.conf import settings
+
+try:
+    from pyinstrument import Profiler as Pyinstrument
+except ImportError:
+    Pyinstrument = None
+
+logger = logging.getLogger(__name__)
+
+current_trace = ContextVar('current_trace', default=None)
+current_span = ContextVar('current_span', default=None)
+
+PROFILERS = ('cprofile', 'pyinstrument')
+
+
+@dataclass
+class Span:
+    name: str
+    start: float
+    duration: float = 0.0
+    # Spans of per frame functions are aggregated, they count their calls instead of having one start
+    calls: int = 0
+    attributes: dict = field(default_factory=dict)
+    children: list = field(default_factory=list)
+
+    def child(self, name) -> 'Span':
+        for span in self.children:
+            if span.name == name and span.calls:
+                return span
+        span = Span(name, self.start)
+        self.children.append(span)
+        return span
+
+    def to_dict(self, origin) -> dict:
+        data = {'name': self.name, 'ms': round(self.duration * 1000, 1)}
+        if self.calls:
+            data['calls'] = self.calls
+        else:
+            data['at_ms'] = round((self.start - origin) * 1000, 1)
+        if self.attributes:
+            data['attributes'] = self.attributes
+        if self.children:
+            data['children'] = [span.to_dict(origin) for span in self.children]
+        return data
+
+
+class RenderTrace:
+    """
+    Nested span timings of one render, logged as one structured line when the render ends.
+    span() opens a timed child of the current span, timed() wraps per frame functions such as resizing and
+    compositing into one aggregated span. Both are no-ops outside a trace.
+    A profiled trace also runs cProfile or pyinstrument on the rendering thread and writes the profile with a
+    Chrome trace of the spans to VIDEO_TRACE_ROOT. Profiling is requested per task or sampled with
+    VIDEO_PROFILE_SAMPLE_RATE, chunk processes of a parallel render are not profiled.
+    """
+    def __init__(self, name, profiler=None):
+        self.name = name
+        self.profiler_name = profiler or RenderTrace.sampled_profiler()
+        self.profiler = None
+        self.root = None
+        self.tokens = None
+
+    @staticmethod
+    def sampled_profiler() -> str | None:
+        if settings.VIDEO_PROFILE_SAMPLE_RATE and random.random() < settings.VIDEO_PROFILE_SAMPLE_RATE:
+            return settings.VIDEO_PROFILER
+        return None
+
+    def __enter__(self):
+        self.root = Span(self.name, time.perf_counter())
+        self.tokens = current_trace.set(self), current_span.set(self.root)
+        self.start_profiler()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.root.duration = time.perf_counter() - self.root.start
+        self.stop_profiler()
+        current_span.reset(self.tokens[1])
+        current_trace.reset(self.tokens[0])
+        if settings.VIDEO_TRACE_SPANS:
+            logger.info(f'render_trace - {json.dumps(self.root.to_dict(self.root.start))}')
+        if self.profiler:
+            self.write_files()
+
+    @staticmethod
+    @contextlib.contextmanager
+    def span(name, **attributes):
+        parent = current_span.get()
+        if parent is None:
+            yield None
+            return
+        span = Span(name, time.perf_counter(), attributes=attributes)
+        parent.children.append(span)
+        token = current_span.set(span)
+        try:
+            yield span
+        finally:
+            span.duration = time.perf_counter() - span.start
+            current_span.reset(token)
+
+    @staticmethod
+    def timed(name, function):
+        """Wraps a per frame function, its calls are added to one span under the span running at call time."""
+        def wrapper(*args, **kwargs):
+            parent = current_span.get()
+            if parent is None:
+                return function(*args, **kwargs)
+            started = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                span = parent.child(name)
+                span.duration += time.perf_counter() - started
+                span.calls += 1
+        return wrapper
+
+    def start_profiler(self):
+        if self.profiler_name and self.profiler_name not in PROFILERS:
+            logger.warning(f'render_trace - unknown profiler {self.profiler_name}, {self.name} is not profiled')
+            return
+        if self.profiler_name == 'pyinstrument' and Pyinstrument is None:
+            logger.warning('render_trace - pyinstrument is not installed, profiling with cProfile')
+            self.profiler_name = 'cprofile'
+        if self.profiler_name == 'pyinstrument':
+            self.profiler = Pyinstrument()
+            self.profiler.start()
+        elif self.profiler_name == 'cprofile':
+            self.profiler = cProfile.Profile()
+            try:
+                self.profiler.enable()
+            except ValueError as e:
+                # Only one profiler can run in a process, e.g. a worker started under a profiler itself
+                logger.warning(f'render_trace - {self.name} is not profiled: {e}')
+                self.profiler = None
+
+    def stop_profiler(self):
+        if isinstance(self.profiler, cProfile.Profile):
+            self.profiler.disable()
+        elif self.profiler:
+            self.profiler.stop()
+
+    def chrome_trace(self) -> dict:
+        """Spans as Chrome trace events, for chrome://tracing or Perfetto."""
+        events = []
+
+        def add(span):
+            # Aggregated spans have no single start, they start with their parent
+            events.append({'name': span.name, 'ph': 'X', 'pid': 1, 'tid': 1,
+                           'ts': round((span.start - self.root.start) * 1e6), 'dur': round(span.duration * 1e6),
+                           'args': {**span.attributes, 'calls': span.calls}})
+            for child in span.children:
+                add(child)
+
+        add(self.root)
+        return {'traceEvents': events}
+
+    def write_files(self):
+        root = Path(settings.VIDEO_TRACE_ROOT)
+        root.mkdir(parents=True, exist_ok=True)
+        base = root / f'{self.name}-{time.strftime("%Y%m%d-%H%M%S")}'
+        base.with_suffix('.trace.json').write_text(json.dumps(self.chrome_trace()))
+        if isinstance(self.profiler, cProfile.Profile):
+            profile_path = base.with_suffix('.prof')
+            self.profiler.dump_stats(profile_path)
+        else:
+            profile_path = base.with_suffix('.html')
+            profile_path.write_text(self.profiler.output_html())
+        logger.info(f'render_trace - {self.name} profiled with {self.profiler_name}: {profile_path}')
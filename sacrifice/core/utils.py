@@ -1,6 +1,11 @@
+import os
 import datetime
+import contextvars
+import hashlib
+import functools
 import random
 import string
+import tempfile
 from typing import Union
 
 
@@ -46,3 +51,116 @@ def animal_video_path_processed(instance, filename):
 
 def animal_video_path_cover(instance, filename):
     return generate_animal_video_path('cover')(instance, filename)
+
+
+# Directory of the active render workspace, temp files of a render are created there instead of the system temp dir
+temp_directory = contextvars.ContextVar('temp_directory', default=None)
+
+
+def create_temp_video_path(suffix='.mp4', directory=None):
+    temp_video = tempfile.NamedTemporaryFile(suffix=suffix, dir=directory or temp_directory.get(), delete=False)
+    temp_video.close()
+    return temp_video.name
+
+
+@functools.lru_cache(maxsize=256)
+def _file_digest(path, size, mtime_ns):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def file_digest(path):
+    """sha256 of the file content, memoized until the file is replaced or modified."""
+    stat = os.stat(path)
+    return _file_digest(str(path), stat.st_size, stat.st_mtime_ns)
+
+
+def fit_size(source_size, size):
+    """Largest size with the aspect ratio of source_size that fits in size."""
+    scale = min(size[0] / source_size[0], size[1] / source_size[1])
+    return min(size[0], round(source_size[0] * scale)), min(size[1], round(source_size[1] * scale))
+
+
+def cpu_quota():
+    """CPUs this process may actually use, honoring the cgroup quota of the container and the affinity mask."""
+    cpus = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count() or 1
+    quota = None
+    try:
+        # cgroup v2
+        with open('/sys/fs/cgroup/cpu.max') as f:
+            limit, period = f.read().split()[:2]
+        if limit != 'max':
+            quota = int(limit) / int(period)
+    except (OSError, ValueError):
+        try:
+            # cgroup v1
+            with open('/sys/fs/cgroup/cpu/cpu.cfs_quota_us') as f:
+                limit = int(f.read())
+            with open('/sys/fs/cgroup/cpu/cpu.cfs_period_us') as f:
+                period = int(f.read())
+            if limit > 0:
+                quota = limit / period
+        except (OSError, ValueError):
+            pass
+    if quota:
+        cpus = min(cpus, max(1, int(quota)))
+    return cpus
+
+
+def read_cgroup_value(*paths):
+    """First readable integer among the cgroup v2 and v1 files, None when unlimited or missing."""
+    for path in paths:
+        try:
+            with open(path) as f:
+                value = f.read().strip()
+        except OSError:
+            continue
+        return None if value == 'max' else int(value)
+    return None
+
+
+def memory_limit():
+    """Bytes of memory this process may use, the cgroup limit of the container or the physical memory."""
+    physical = os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    limit = read_cgroup_value('/sys/fs/cgroup/memory.max', '/sys/fs/cgroup/memory/memory.limit_in_bytes')
+    # cgroup v1 reports an unlimited group as a huge number
+    return min(limit, physical) if limit else physical
+
+
+def read_cgroup_stat(path, key):
+    """Value of key in a cgroup stat file such as memory.stat, 0 when it is missing."""
+    try:
+        with open(path) as f:
+            for line in f:
+                name, _, value = line.partition(' ')
+                if name == key:
+                    return int(value)
+    except (OSError, ValueError):
+        pass
+    return 0
+
+
+def memory_usage():
+    """
+    Working set of the container in bytes, None outside a cgroup.
+    The usage counters include the page cache, the inactive part of it is reclaimed before the container runs
+    out of memory and is not counted, like the working set the OOM killer and kubectl top look at.
+    """
+    for usage_path, stat_path, inactive_key in (
+        ('/sys/fs/cgroup/memory.current', '/sys/fs/cgroup/memory.stat', 'inactive_file'),
+        ('/sys/fs/cgroup/memory/memory.usage_in_bytes', '/sys/fs/cgroup/memory/memory.stat', 'total_inactive_file'),
+    ):
+        usage = read_cgroup_value(usage_path)
+        if usage is not None:
+            return max(0, usage - read_cgroup_stat(stat_path, inactive_key))
+    return None
+
+
+def percentile(values, fraction):
+    """Nearest rank percentile of sorted values."""
+    if not values:
+        return None
+    return values[min(len(values) - 1, max(0, round(fraction * len(values)) - 1))]
@@ -1,6 +1,9 @@
 from django.core.exceptions import ValidationError
 from django.utils.deconstruct import deconstructible
 
+from .metadata import MediaMetadataService
+from .probe import ProbeError
+
 
 @deconstructible
 class FileSizeValidator:
@@ -21,3 +24,28 @@ class FileSizeValidator:
 
     def __eq__(self, other):
         return isinstance(other, self.__class__) and self.max_size == other.max_size
+
+
+@deconstructible
+class MediaProbeValidator:
+    """
+    Rejects uploads that ffprobe can not read, before they reach the render worker.
+    :param field_name: Name of the field, decides whether the file is probed as a video or an image.
+    """
+    def __init__(self, field_name: str):
+        self.message = "Dosya okunamadı, bozuk ya da desteklenmeyen bir formatta olabilir."
+        self.code = 'unreadable'
+        self.field_name = field_name
+
+    def __call__(self, value):
+        # Only fresh uploads are probed, stored files were checked when they were uploaded
+        if getattr(value, '_committed', True):
+            return
+        try:
+            # Kept on the upload, saving the model stores it instead of probing the file again
+            value.file.probed_metadata = MediaMetadataService.probe_upload(value.file, self.field_name)
+        except ProbeError as e:
+            raise ValidationError(self.message, code=self.code, params={'error': str(e)})
+
+    def __eq__(self, other):
+        return isinstance(other, self.__class__) and self.field_name == other.field_name
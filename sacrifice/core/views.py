@@ -1,3 +1,16 @@
-from django.shortcuts import render
+import hmac
 
-# Create your views here.
+from django.conf import settings
+from django.http import HttpResponse
+from django.views.decorators.http import require_GET
+
+from .metrics import RenderMetrics, CONTENT_TYPE
+
+
+@require_GET
+def metrics(request):
+    """Render and queue metrics for Prometheus compatible scrapers, see RenderMetrics."""
+    token = settings.METRICS_TOKEN
+    if token and not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        return HttpResponse(status=401)
+    return HttpResponse(RenderMetrics.expose(), content_type=CONTENT_TYPE)
@@ -0,0 +1,118 @@
+import os
+import json
+import time
+import shutil
+import socket
+import logging
+from pathlib import Path
+
+from django.conf import settings
+
+from .enums import RenderJobStatus
+from .models import RenderJob
+from .utils import temp_directory
+
+logger = logging.getLogger(__name__)
+
+OWNER_FILE = '.owner'
+
+
+class WorkspaceQuotaError(Exception):
+    pass
+
+
+class RenderWorkspace:
+    """
+    Per job scratch directory under VIDEO_SCRATCH_ROOT.
+    Every temp file of the render, including MoviePy's audio track, is created inside it and the whole
+    directory is removed when the job ends, whether it succeeded, failed or raised. Directories left behind
+    by killed workers are reclaimed by sweep() once their RenderJob is no longer running.
+    """
+    def __init__(self, job_id, required_bytes=0, render_job_id=None):
+        self.job_id = job_id
+        self.required_bytes = required_bytes
+        self.render_job_id = render_job_id
+        self.path = None
+        self.token = None
+
+    @staticmethod
+    def root() -> Path:
+        root = Path(settings.VIDEO_SCRATCH_ROOT)
+        root.mkdir(parents=True, exist_ok=True)
+        return root
+
+    @staticmethod
+    def usage(path) -> int:
+        total = 0
+        for directory, _, file_names in os.walk(path):
+            for file_name in file_names:
+                try:
+                    total += os.lstat(os.path.join(directory, file_name)).st_size
+                except OSError:
+                    pass
+        return total
+
+    @staticmethod
+    def check_quota(required_bytes):
+        root = RenderWorkspace.root()
+        free_bytes = shutil.disk_usage(root).free
+        if free_bytes - required_bytes < settings.VIDEO_SCRATCH_MIN_FREE_BYTES:
+            raise WorkspaceQuotaError(f'Not enough disk space in {root}: {free_bytes} bytes free, '
+                                      f'{required_bytes} bytes needed')
+        used_bytes = RenderWorkspace.usage(root)
+        if used_bytes + required_bytes > settings.VIDEO_SCRATCH_QUOTA_BYTES:
+            raise WorkspaceQuotaError(f'Scratch quota of {root} exceeded: {used_bytes} bytes used, '
+                                      f'{required_bytes} bytes needed')
+
+    def __enter__(self):
+        RenderWorkspace.check_quota(self.required_bytes)
+        self.path = RenderWorkspace.root() / f'{self.job_id}-{os.getpid()}-{time.time_ns()}'
+        self.path.mkdir()
+        owner = {'host': socket.gethostname(), 'pid': os.getpid(), 'job_id': str(self.job_id),
+                 'render_job': self.render_job_id, 'created': time.time()}
+        (self.path / OWNER_FILE).write_text(json.dumps(owner))
+        self.token = temp_directory.set(str(self.path))
+        logger.info(f'render_workspace - created: {self.path}')
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        temp_directory.reset(self.token)
+        shutil.rmtree(self.path, ignore_errors=True)
+        logger.info(f'render_workspace - removed: {self.path}')
+
+    @staticmethod
+    def is_orphan(path, max_age) -> bool:
+        try:
+            owner = json.loads((path / OWNER_FILE).read_text())
+        except (OSError, ValueError):
+            # Half created or foreign directory, judge it by its age
+            return time.time() - path.stat().st_mtime > max_age
+
+        if owner.get('render_job') is None:
+            return time.time() - owner.get('created', 0) > max_age
+        # Host names and PIDs repeat after a container restart, the job is RUNNING until it finishes or the lease
+        # reaper gives up on its worker
+        return not RenderJob.objects.filter(pk=owner['render_job'], status=RenderJobStatus.RUNNING).exists()
+
+    @staticmethod
+    def sweep(max_age=None) -> int:
+        """Removes workspaces of jobs that ended and other files older than max_age, returns the bytes reclaimed."""
+        max_age = max_age or settings.VIDEO_SCRATCH_MAX_AGE
+        reclaimed = 0
+        for path in RenderWorkspace.root().iterdir():
+            try:
+                if path.is_dir():
+                    if not RenderWorkspace.is_orphan(path, max_age):
+                        continue
+                    size = RenderWorkspace.usage(path)
+                    shutil.rmtree(path, ignore_errors=True)
+                elif time.time() - path.stat().st_mtime > max_age:
+                    size = path.stat().st_size
+                    path.unlink()
+                else:
+                    continue
+            except FileNotFoundError:
+                continue
+            reclaimed += size
+            logger.info(f'render_workspace - swept: {path} ({size} bytes)')
+        return reclaimed
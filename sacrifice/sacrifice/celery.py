@@ -1,6 +1,13 @@
 import os
+import logging
+from dataclasses import dataclass
 
 from celery import Celery
+from celery.signals import celeryd_init, worker_process_init
+
+from core.utils import cpu_quota, memory_limit
+
+logger = logging.getLogger(__name__)
 
 # Set the default Django settings module for the 'celery' program.
 # os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'sacrifice.settings.dev')
@@ -21,6 +28,52 @@ app.config_from_object('django.conf:settings', namespace='CELERY')
 app.autodiscover_tasks()
 
 
+@dataclass(frozen=True)
+class WorkerResources:
+    """
+    Worker sizing derived from the container's cgroup CPU quota and memory limit.
+    Concurrency is bounded by both CPUs and the memory a typical job needs, encoder threads and chunk
+    processes share the CPUs of one job slot, and every job gets an equal share of the memory as its budget.
+    """
+    cpus: int
+    memory: int
+    concurrency: int
+    threads: int
+    job_memory: int
+
+    @classmethod
+    def detect(cls, job_memory, concurrency=None):
+        cpus, memory = cpu_quota(), memory_limit()
+        concurrency = concurrency or max(1, min(cpus, memory // job_memory))
+        return cls(cpus, memory, concurrency, max(1, cpus // concurrency), memory // concurrency)
+
+
+def get_worker_resources(concurrency=None) -> WorkerResources:
+    # Django settings are read here and not at import, this module is imported while settings load
+    from django.conf import settings
+    return WorkerResources.detect(settings.VIDEO_JOB_MEMORY_BYTES, concurrency)
+
+
+@celeryd_init.connect
+def configure_worker_concurrency(sender=None, conf=None, options=None, **kwargs):
+    # --concurrency on the command line still wins
+    resources = get_worker_resources(options.get('concurrency') if options else None)
+    conf.worker_concurrency = resources.concurrency
+    logger.info(f'worker_resources - {resources}')
+
+
+@worker_process_init.connect
+def configure_worker_process(**kwargs):
+    from django.conf import settings
+    resources = get_worker_resources(app.conf.worker_concurrency)
+    if settings.VIDEO_AUTO_SIZING:
+        settings.VIDEO_ENCODER_PROFILE['threads'] = resources.threads
+        # Chunks are encoded in encode_chunk subprocesses, not a process pool, so daemonic prefork children
+        # can split a render too
+        settings.VIDEO_PARALLEL_WORKERS = resources.threads
+    settings.VIDEO_JOB_MEMORY_BUDGET = resources.job_memory
+
+
 @app.task(bind=True, ignore_result=True)
 def debug_task(self):
     print(f'Request: {self.request!r}')
@@ -31,6 +84,15 @@ def debug_task(self):
 app.conf.beat_schedule = {
     'make_animal_video': {
         'task': 'core.tasks.auto_process_animals',
-        'schedule': 60.0 * 5
+        # Uploads are queued on commit and finished batches refill the queue, this is only the safety net
+        'schedule': 60.0 * 30
+    },
+    'reclaim_expired_leases': {
+        'task': 'core.tasks.reclaim_expired_leases',
+        'schedule': 60.0
+    },
+    'sweep_render_workspaces': {
+        'task': 'core.tasks.sweep_render_workspaces',
+        'schedule': 60.0 * 15
     },
 }
@@ -193,9 +193,111 @@ PHONENUMBER_DEFAULT_REGION = 'TR'
 CELERY_TIMEZONE = "Europe/Istanbul"
 CELERY_TASK_TRACK_STARTED = True
 CELERY_TASK_TIME_LIMIT = 30 * 60
+# Raised inside the task a minute before the hard limit, so renders can close their ffmpeg readers
+CELERY_TASK_SOFT_TIME_LIMIT = CELERY_TASK_TIME_LIMIT - 60
 CELERY_BROKER_URL = "redis://redis:6379"
 CELERY_RESULT_BACKEND = "redis://redis:6379"
 CELERY_BROKER_CONNECTION_RETRY_ON_STARTUP = True
+# Renders are sent to a queue by origin, see core.enums.RenderQueue. Workers list them with -Q from the most
+# urgent one and take the first queue that has a message, instead of the default round robin.
+CELERY_TASK_ROUTES = {
+    'core.tasks.make_animal_video': {'queue': 'render-urgent'},
+    'core.tasks.make_season_videos': {'queue': 'render-bulk'},
+}
+CELERY_BROKER_TRANSPORT_OPTIONS = {'queue_order_strategy': 'priority'}
+# Renders take minutes, a worker process reserves only one message so an urgent one is never stuck behind it
+CELERY_WORKER_PREFETCH_MULTIPLIER = 1
+
+
+# VIDEO PROCESSING
+
+FFMPEG_BINARY = env('FFMPEG_BINARY', cast=str, default='ffmpeg')
+FFPROBE_BINARY = env('FFPROBE_BINARY', cast=str, default='ffprobe')
+
+# Shared by every render engine. Changing it invalidates the cached intro/outro segments.
+VIDEO_ENCODER_PROFILE = {
+    'video_codec': 'libx264',
+    'preset': 'ultrafast',
+    'crf': 23,
+    'fps': 30,
+    'pix_fmt': 'yuv420p',
+    'gop': 60,
+    'audio_codec': 'aac',
+    'audio_sample_rate': 44100,
+    'audio_channels': 2,
+    'threads': 8,
+}
+
+# Upper bound of the output canvas, larger intros/outros are scaled down to fit
+VIDEO_MAX_SIZE = (1920, 1920)
+
+# One of auto, nearest, linear, cubic, area, lanczos. auto uses area when shrinking and linear when enlarging.
+VIDEO_RESIZE_INTERPOLATION = env('VIDEO_RESIZE_INTERPOLATION', cast=str, default='auto')
+
+# Season assets encoded once and reused for every animal. Both render engines encode only the cover and the
+# animal clip and join them with the cached intro/outro segments by stream copy.
+VIDEO_CACHE_ROOT = env('VIDEO_CACHE_ROOT', cast=str, default=str(BASE_DIR / 'cache'))
+VIDEO_SEGMENT_CACHE = env('VIDEO_SEGMENT_CACHE', cast=bool, default=True)
+
+# Every render gets its own workspace here. Rendered videos are hardlinked into MEDIA_ROOT,
+# so keep it on the same filesystem, otherwise publishing falls back to a copy.
+VIDEO_SCRATCH_ROOT = env('VIDEO_SCRATCH_ROOT', cast=str, default=str(BASE_DIR / 'scratch'))
+# A render needs about this many times the size of its video inputs while it runs
+VIDEO_SCRATCH_INPUT_FACTOR = env('VIDEO_SCRATCH_INPUT_FACTOR', cast=int, default=3)
+VIDEO_SCRATCH_QUOTA_BYTES = env('VIDEO_SCRATCH_QUOTA_BYTES', cast=int, default=20 * 1024 ** 3)
+VIDEO_SCRATCH_MIN_FREE_BYTES = env('VIDEO_SCRATCH_MIN_FREE_BYTES', cast=int, default=1024 ** 3)
+
+# Processes that encode chunks of a MoviePy render in parallel. 0 follows the CPU quota, 1 renders serially.
+VIDEO_PARALLEL_WORKERS = env('VIDEO_PARALLEL_WORKERS', cast=int, default=0)
+
+# Worker sizing, see sacrifice/celery.py. A worker runs as many jobs as both its CPU quota and its memory
+# limit allow, encoder threads and chunk processes follow the CPUs left for each job.
+VIDEO_AUTO_SIZING = env('VIDEO_AUTO_SIZING', cast=bool, default=True)
+# Memory a typical 1080p job needs, used to size the worker
+VIDEO_JOB_MEMORY_BYTES = env('VIDEO_JOB_MEMORY_BYTES', cast=int, default=1024 ** 3)
+# Estimate of a single render: the interpreter and libraries plus this many decoded frames per render process
+VIDEO_JOB_BASE_MEMORY_BYTES = env('VIDEO_JOB_BASE_MEMORY_BYTES', cast=int, default=300 * 1024 ** 2)
+VIDEO_JOB_MEMORY_FRAMES = env('VIDEO_JOB_MEMORY_FRAMES', cast=int, default=40)
+# Set by the worker at startup, renders that would need more memory are refused. None disables the check.
+VIDEO_JOB_MEMORY_BUDGET = None
+
+# Animals of one season rendered back to back by a single make_season_videos task
+VIDEO_BATCH_SIZE = env('VIDEO_BATCH_SIZE', cast=int, default=10)
+# Worker processes the poller fills with a batch each. 0 asks the running workers for their concurrency.
+VIDEO_QUEUE_SLOTS = env('VIDEO_QUEUE_SLOTS', cast=int, default=0)
+# Seconds after which a queued animal that no worker claimed is queued again, its message is considered lost
+VIDEO_QUEUE_TTL = env('VIDEO_QUEUE_TTL', cast=int, default=VIDEO_BATCH_SIZE * CELERY_TASK_TIME_LIMIT)
+# A workspace lives as long as its render job runs. Scratch files of no job are removed after this many seconds,
+# longer than a season batch may run.
+VIDEO_SCRATCH_MAX_AGE = env('VIDEO_SCRATCH_MAX_AGE', cast=int, default=(VIDEO_BATCH_SIZE + 1) * CELERY_TASK_TIME_LIMIT)
+
+# A rendering worker refreshes its lease every VIDEO_LEASE_HEARTBEAT seconds. A lease without a heartbeat for
+# VIDEO_LEASE_TIMEOUT seconds belongs to a dead worker, the animal is queued again after an exponential backoff
+# or marked as failed after VIDEO_LEASE_MAX_ATTEMPTS reclaims.
+VIDEO_LEASE_HEARTBEAT = env('VIDEO_LEASE_HEARTBEAT', cast=int, default=30)
+VIDEO_LEASE_TIMEOUT = env('VIDEO_LEASE_TIMEOUT', cast=int, default=5 * 60)
+VIDEO_LEASE_MAX_ATTEMPTS = env('VIDEO_LEASE_MAX_ATTEMPTS', cast=int, default=3)
+VIDEO_LEASE_BACKOFF = env('VIDEO_LEASE_BACKOFF', cast=int, default=60)
+VIDEO_LEASE_MAX_BACKOFF = env('VIDEO_LEASE_MAX_BACKOFF', cast=int, default=30 * 60)
+
+# Seconds between the progress updates a render writes to the cache
+VIDEO_PROGRESS_INTERVAL = env('VIDEO_PROGRESS_INTERVAL', cast=float, default=2.0)
+
+# Every render logs its span timings as one render_trace line. A profiled render also writes its profile and
+# a Chrome trace of its spans to VIDEO_TRACE_ROOT. Renders are profiled when a task asks for it with the
+# profiler argument, or for VIDEO_PROFILE_SAMPLE_RATE of all renders with VIDEO_PROFILER.
+VIDEO_TRACE_SPANS = env('VIDEO_TRACE_SPANS', cast=bool, default=True)
+VIDEO_TRACE_ROOT = env('VIDEO_TRACE_ROOT', cast=str, default=str(BASE_DIR / 'traces'))
+VIDEO_PROFILE_SAMPLE_RATE = env('VIDEO_PROFILE_SAMPLE_RATE', cast=float, default=0.0)
+# cprofile or pyinstrument, pyinstrument has to be installed separately
+VIDEO_PROFILER = env('VIDEO_PROFILER', cast=str, default='cprofile')
+
+# /metrics answers only requests with "Authorization: Bearer <METRICS_TOKEN>" when it is set
+METRICS_TOKEN = env('METRICS_TOKEN', cast=str, default='')
+# Upper bounds in seconds of the render stage duration histogram buckets
+VIDEO_METRICS_BUCKETS = [
+    float(bound) for bound in env('VIDEO_METRICS_BUCKETS', cast=list, default=[1, 5, 15, 30, 60, 120, 300, 600, 1800])
+]
 
 
 # LOGGING